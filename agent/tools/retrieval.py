@@ -187,6 +187,7 @@ class Retrieval(ToolBase, ABC):
                 aggs=False,
                 rerank_mdl=rerank_mdl,
                 rank_feature=label_question(query, kbs),
+                lean=True,
             )
             if self.check_if_canceled("Retrieval processing"):
                 return
@@ -48,6 +48,7 @@ from api.utils.validation_utils import (
     validate_and_parse_request_args,
 )
 from rag.nlp import search
+from graphrag.utils import GRAPH_FORMAT_PARTITIONED, get_graph_overview
 from common.constants import PAGERANK_FLD
 from common import settings
 
@@ -519,6 +520,8 @@ async def knowledge_graph(tenant_id, dataset_id):
 
         obj[ty] = content_json
 
+    if obj["graph"].get("format") == GRAPH_FORMAT_PARTITIONED:
+        obj["graph"] = await get_graph_overview(kb.tenant_id, dataset_id, obj["graph"])
     if "nodes" in obj["graph"]:
         obj["graph"]["nodes"] = sorted(obj["graph"]["nodes"], key=lambda x: x.get("pagerank", 0), reverse=True)[:256]
         if "edges" in obj["graph"]:
@@ -539,7 +542,7 @@ def delete_knowledge_graph(tenant_id, dataset_id):
             code=RetCode.AUTHENTICATION_ERROR
         )
     _, kb = KnowledgebaseService.get_by_id(dataset_id)
-    settings.docStoreConn.delete({"knowledge_graph_kwd": ["graph", "subgraph", "entity", "relation"]},
+    settings.docStoreConn.delete({"knowledge_graph_kwd": ["graph", "graph_partition", "subgraph", "entity", "relation"]},
                                  search.index_name(kb.tenant_id), dataset_id)
 
     return get_result(data=True)
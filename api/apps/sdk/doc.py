@@ -13,6 +13,7 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 #
+import asyncio
 import datetime
 import json
 import logging
@@ -1410,6 +1411,23 @@ async def update_chunk(tenant_id, dataset_id, document_id, chunk_id):
     return get_result()
 
 
+def _rename_retrieved_chunks(chunks):
+    key_mapping = {
+        "chunk_id": "id",
+        "content_with_weight": "content",
+        "doc_id": "document_id",
+        "important_kwd": "important_keywords",
+        "question_kwd": "questions",
+        "docnm_kwd": "document_keyword",
+        "kb_id": "dataset_id",
+    }
+    renamed_chunks = []
+    for chunk in chunks:
+        chunk.pop("vector", None)
+        renamed_chunks.append({key_mapping.get(key, key): value for key, value in chunk.items()})
+    return renamed_chunks
+
+
 @manager.route("/retrieval", methods=["POST"])  # noqa: F821
 @token_required
 async def retrieval_test(tenant_id):
@@ -1438,6 +1456,11 @@ async def retrieval_test(tenant_id):
               type: string
               required: true
               description: Query string.
+            questions:
+              type: array
+              items:
+                type: string
+              description: Several query strings retrieved together, instead of `question`.
             document_ids:
               type: array
               items:
@@ -1509,15 +1532,21 @@ async def retrieval_test(tenant_id):
             message='Datasets use different embedding models."',
             code=RetCode.DATA_ERROR,
         )
-    if "question" not in req:
+    questions = req.get("questions")
+    if questions is not None:
+        if not isinstance(questions, list) or not all(isinstance(q, str) for q in questions):
+            return get_error_data_result("`questions` should be a list of strings")
+    elif "question" not in req:
         return get_error_data_result("`question` is required.")
     page = int(req.get("page", 1))
     size = int(req.get("page_size", 30))
-    question = req["question"]
+    question = req.get("question", "")
     doc_ids = req.get("document_ids", [])
     use_kg = req.get("use_kg", False)
     toc_enhance = req.get("toc_enhance", False)
     langs = req.get("cross_languages", [])
+    if questions is not None and (use_kg or toc_enhance):
+        return get_error_data_result("`use_kg` and `toc_enhance` are not supported with `questions`")
     if not isinstance(doc_ids, list):
         return get_error_data_result("`documents` should be a list")   
     if doc_ids: 
@@ -1552,6 +1581,33 @@ async def retrieval_test(tenant_id):
         if req.get("rerank_id"):
             rerank_mdl = LLMBundle(kb.tenant_id, LLMType.RERANK, llm_name=req["rerank_id"])
 
+        if questions is not None:
+            if langs:
+                questions = await asyncio.gather(*[cross_languages(kb.tenant_id, None, q, langs) for q in questions])
+            if req.get("keyword", False):
+                chat_mdl = LLMBundle(kb.tenant_id, LLMType.CHAT)
+                kwds = await asyncio.gather(*[keyword_extraction(chat_mdl, q) for q in questions])
+                questions = [q + k for q, k in zip(questions, kwds)]
+            results = await settings.retriever.batch_retrieval(
+                questions,
+                embd_mdl,
+                tenant_ids,
+                kb_ids,
+                page,
+                size,
+                similarity_threshold,
+                vector_similarity_weight,
+                top,
+                doc_ids,
+                rerank_mdl=rerank_mdl,
+                highlight=highlight,
+                rank_feature=[label_question(q, kbs) for q in questions],
+            )
+            for q, ranks in zip(questions, results):
+                ranks["question"] = q
+                ranks["chunks"] = _rename_retrieved_chunks(ranks["chunks"])
+            return get_result(data={"results": results})
+
         if langs:
             question = await cross_languages(kb.tenant_id, None, question, langs)
 
@@ -1584,27 +1640,7 @@ async def retrieval_test(tenant_id):
             if ck["content_with_weight"]:
                 ranks["chunks"].insert(0, ck)
 
-        for c in ranks["chunks"]:
-            c.pop("vector", None)
-
-        ##rename keys
-        renamed_chunks = []
-        for chunk in ranks["chunks"]:
-            key_mapping = {
-                "chunk_id": "id",
-                "content_with_weight": "content",
-                "doc_id": "document_id",
-                "important_kwd": "important_keywords",
-                "question_kwd": "questions",
-                "docnm_kwd": "document_keyword",
-                "kb_id": "dataset_id",
-            }
-            rename_chunk = {}
-            for key, value in chunk.items():
-                new_key = key_mapping.get(key, key)
-                rename_chunk[new_key] = value
-            renamed_chunks.append(rename_chunk)
-        ranks["chunks"] = renamed_chunks
+        ranks["chunks"] = _rename_retrieved_chunks(ranks["chunks"])
         return get_result(data=ranks)
     except Exception as e:
         if str(e).find("not_found") > 0:
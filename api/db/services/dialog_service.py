@@ -33,6 +33,7 @@ from api.db.services.knowledgebase_service import KnowledgebaseService
 from api.db.services.langfuse_service import TenantLangfuseService
 from api.db.services.llm_service import LLMBundle
 from common.metadata_utils import apply_meta_data_filter
+from common.misc_utils import thread_pool_exec, thread_pool_exec_in, THREAD_POOL_DOC_STORE
 from api.db.services.tenant_llm_service import TenantLLMService
 from common.time_utils import current_timestamp, datetime_format
 from graphrag.general.mind_map_extractor import MindMapExtractor
@@ -42,6 +43,7 @@ from rag.nlp.search import index_name
 from rag.prompts.generator import chunks_format, citation_prompt, cross_languages, full_question, kb_prompt, keyword_extraction, message_fit_in, \
     PROMPT_JINJA_ENV, ASK_SUMMARY
 from common.token_utils import num_tokens_from_string
+from rag.utils.retrieval_orchestrator import RETRIEVAL_KG_TIMEOUT, RETRIEVAL_WEB_TIMEOUT, RetrievalOrchestrator
 from rag.utils.tavily_conn import Tavily
 from common.string_utils import remove_redundant_spaces
 from common import settings
@@ -372,11 +374,54 @@ async def async_chat(dialog, messages, stream=True, **kwargs):
     thought = ""
     kbinfos = {"total": 0, "chunks": [], "doc_aggs": []}
     knowledges = []
+    retrievals = RetrievalOrchestrator()
+    kg_elapsed = ""
+    kg_timings = {}
 
     if attachments is not None and "knowledge" in param_keys:
         logging.debug("Proceeding with retrieval")
         tenant_ids = list(set([kb.tenant_id for kb in kbs]))
         knowledges = []
+
+        async def kb_retrieval():
+            kb_res = await retriever.retrieval(
+                " ".join(questions),
+                embd_mdl,
+                tenant_ids,
+                dialog.kb_ids,
+                1,
+                dialog.top_n,
+                dialog.similarity_threshold,
+                dialog.vector_similarity_weight,
+                doc_ids=attachments,
+                top=dialog.top_k,
+                aggs=True,
+                rerank_mdl=rerank_mdl,
+                rank_feature=label_question(" ".join(questions), kbs),
+                lean=True,
+            )
+            if prompt_config.get("toc_enhance"):
+                cks = await retriever.retrieval_by_toc(" ".join(questions), kb_res["chunks"], tenant_ids, chat_mdl, dialog.top_n)
+                if cks:
+                    kb_res["chunks"] = cks
+            kb_res["chunks"] = retriever.retrieval_by_children(kb_res["chunks"], tenant_ids)
+            return kb_res
+
+        # Independent sources run concurrently, and are merged below in a fixed order.
+        # With reasoning on, DeepResearcher searches the web and the knowledge graph per sub-query itself.
+        if not prompt_config.get("reasoning", False):
+            if embd_mdl:
+                retrievals.add("Knowledge base", kb_retrieval, required=True)
+            if prompt_config.get("tavily_api_key"):
+                tav = Tavily(prompt_config["tavily_api_key"])
+                retrievals.add("Web search", thread_pool_exec, tav.retrieve_chunks, " ".join(questions),
+                               timeout=RETRIEVAL_WEB_TIMEOUT)
+            if prompt_config.get("use_kg"):
+                retrievals.add("Knowledge graph", settings.kg_retriever.retrieval, " ".join(questions), tenant_ids,
+                               dialog.kb_ids, embd_mdl, LLMBundle(dialog.tenant_id, LLMType.CHAT), timings=kg_timings,
+                               timeout=RETRIEVAL_KG_TIMEOUT)
+        retrieval_task = asyncio.create_task(retrievals.run())
+
         if prompt_config.get("reasoning", False):
             reasoner = DeepResearcher(
                 chat_mdl,
@@ -412,38 +457,18 @@ async def async_chat(dialog, messages, stream=True, **kwargs):
 
             await task
 
-        else:
-            if embd_mdl:
-                kbinfos = await retriever.retrieval(
-                    " ".join(questions),
-                    embd_mdl,
-                    tenant_ids,
-                    dialog.kb_ids,
-                    1,
-                    dialog.top_n,
-                    dialog.similarity_threshold,
-                    dialog.vector_similarity_weight,
-                    doc_ids=attachments,
-                    top=dialog.top_k,
-                    aggs=True,
-                    rerank_mdl=rerank_mdl,
-                    rank_feature=label_question(" ".join(questions), kbs),
-                )
-                if prompt_config.get("toc_enhance"):
-                    cks = await retriever.retrieval_by_toc(" ".join(questions), kbinfos["chunks"], tenant_ids, chat_mdl, dialog.top_n)
-                    if cks:
-                        kbinfos["chunks"] = cks
-                kbinfos["chunks"] = retriever.retrieval_by_children(kbinfos["chunks"], tenant_ids)
-            if prompt_config.get("tavily_api_key"):
-                tav = Tavily(prompt_config["tavily_api_key"])
-                tav_res = tav.retrieve_chunks(" ".join(questions))
-                kbinfos["chunks"].extend(tav_res["chunks"])
-                kbinfos["doc_aggs"].extend(tav_res["doc_aggs"])
-            if prompt_config.get("use_kg"):
-                ck = await settings.kg_retriever.retrieval(" ".join(questions), tenant_ids, dialog.kb_ids, embd_mdl,
-                                                       LLMBundle(dialog.tenant_id, LLMType.CHAT))
-                if ck["content_with_weight"]:
-                    kbinfos["chunks"].insert(0, ck)
+        retrieved = await retrieval_task
+        if retrieved.get("Knowledge base"):
+            kbinfos = retrieved["Knowledge base"]
+        tav_res = retrieved.get("Web search")
+        if tav_res:
+            kbinfos["chunks"].extend(tav_res["chunks"])
+            kbinfos["doc_aggs"].extend(tav_res["doc_aggs"])
+        ck = retrieved.get("Knowledge graph")
+        if ck:
+            kg_elapsed = ", ".join(f"{k}: {v:.1f}ms" for k, v in kg_timings.items() if k != "total")
+            if ck["content_with_weight"]:
+                kbinfos["chunks"].insert(0, ck)
 
     knowledges = kb_prompt(kbinfos, max_tokens)
     logging.debug("{}->{}".format(" ".join(questions), "\n->".join(knowledges)))
@@ -470,8 +495,8 @@ async def async_chat(dialog, messages, stream=True, **kwargs):
     if "max_tokens" in gen_conf:
         gen_conf["max_tokens"] = min(gen_conf["max_tokens"], max_tokens - used_token_count)
 
-    def decorate_answer(answer):
-        nonlocal embd_mdl, prompt_config, knowledges, kwargs, kbinfos, prompt, retrieval_ts, questions, langfuse_tracer
+    async def decorate_answer(answer):
+        nonlocal embd_mdl, prompt_config, knowledges, kwargs, kbinfos, prompt, retrieval_ts, questions, langfuse_tracer, retrievals, kg_elapsed
 
         refs = []
         ans = answer.split("</think>")
@@ -483,6 +508,8 @@ async def async_chat(dialog, messages, stream=True, **kwargs):
         if knowledges and (prompt_config.get("quote", True) and kwargs.get("quote", True)):
             idx = set([])
             if embd_mdl and not re.search(r"\[ID:([0-9]+)\]", answer):
+                await thread_pool_exec_in(THREAD_POOL_DOC_STORE, retriever.fill_citation_fields, kbinfos["chunks"],
+                                          [kb.tenant_id for kb in kbs])
                 answer, idx = retriever.insert_citations(
                     answer,
                     [ck["content_ltks"] for ck in kbinfos["chunks"]],
@@ -533,6 +560,7 @@ async def async_chat(dialog, messages, stream=True, **kwargs):
             f"  - Bind models: {bind_embedding_time_cost:.1f}ms\n"
             f"  - Query refinement(LLM): {refine_question_time_cost:.1f}ms\n"
             f"  - Retrieval: {retrieval_time_cost:.1f}ms\n"
+            f"{retrievals.elapsed({'Knowledge graph': kg_elapsed})}"
             f"  - Generate answer: {generate_result_time_cost:.1f}ms\n\n"
             "## Token usage:\n"
             f"  - Generated tokens(approximately): {tk_num}\n"
@@ -566,7 +594,7 @@ async def async_chat(dialog, messages, stream=True, **kwargs):
             yield {"answer": value, "reference": {}, "audio_binary": tts(tts_mdl, value), "final": False}
         full_answer = last_state.full_text if last_state else ""
         if full_answer:
-            final = decorate_answer(thought + full_answer)
+            final = await decorate_answer(thought + full_answer)
             final["final"] = True
             final["audio_binary"] = None
             final["answer"] = ""
@@ -575,7 +603,7 @@ async def async_chat(dialog, messages, stream=True, **kwargs):
         answer = await chat_mdl.async_chat(prompt + prompt4citation, msg[1:], gen_conf)
         user_content = msg[-1].get("content", "[content not available]")
         logging.debug("User: {}|Assistant: {}".format(user_content, answer))
-        res = decorate_answer(answer)
+        res = await decorate_answer(answer)
         res["audio_binary"] = tts(tts_mdl, answer)
         yield res
 
@@ -1064,7 +1092,8 @@ async def async_ask(question, kb_ids, tenant_id, chat_llm_name=None, search_conf
         doc_ids=doc_ids,
         aggs=True,
         rerank_mdl=rerank_mdl,
-        rank_feature=label_question(question, kbs)
+        rank_feature=label_question(question, kbs),
+        lean=True,
     )
 
     knowledges = kb_prompt(kbinfos, max_tokens)
@@ -1072,8 +1101,9 @@ async def async_ask(question, kb_ids, tenant_id, chat_llm_name=None, search_conf
 
     msg = [{"role": "user", "content": question}]
 
-    def decorate_answer(answer):
+    async def decorate_answer(answer):
         nonlocal knowledges, kbinfos, sys_prompt
+        await thread_pool_exec_in(THREAD_POOL_DOC_STORE, retriever.fill_citation_fields, kbinfos["chunks"], tenant_ids)
         answer, idx = retriever.insert_citations(answer, [ck["content_ltks"] for ck in kbinfos["chunks"]], [ck["vector"] for ck in kbinfos["chunks"]],
                                                  embd_mdl, tkweight=0.7, vtweight=0.3)
         idx = set([kbinfos["chunks"][int(i)]["doc_id"] for i in idx])
@@ -1101,7 +1131,7 @@ async def async_ask(question, kb_ids, tenant_id, chat_llm_name=None, search_conf
             continue
         yield {"answer": value, "reference": {}, "final": False}
     full_answer = last_state.full_text if last_state else ""
-    final = decorate_answer(full_answer)
+    final = await decorate_answer(full_answer)
     final["final"] = True
     final["answer"] = ""
     yield final
@@ -14,14 +14,13 @@
 #  limitations under the License.
 #
 import logging
-import os
 import random
 import xxhash
 from datetime import datetime
 
 from api.db.db_utils import bulk_insert_into_db
 from deepdoc.parser import PdfParser
-from peewee import JOIN
+from peewee import JOIN, Case
 from api.db.db_models import DB, File2Document, File
 from api.db import FileType
 from api.db.db_models import Task, Document, Knowledgebase, Tenant
@@ -37,6 +36,7 @@ from rag.nlp import search
 
 CANVAS_DEBUG_DOC_ID = "dataflow_x"
 GRAPH_RAPTOR_FAKE_DOC_ID = "graph_raptor_x"
+PROGRESS_WRITE_RETRIES = 5
 
 def trim_header_by_lines(text: str, max_length) -> str:
     # Trim header text to maximum length while preserving line breaks
@@ -217,8 +217,11 @@ class TaskService(CommonService):
         Args:
             id (str): The unique identifier of the task.
             chunk_ids (str): Space-separated string of chunk identifiers.
+
+        Returns:
+            int: Number of updated rows, 0 if the task does not exist anymore.
         """
-        cls.model.update(chunk_ids=chunk_ids).where(cls.model.id == id).execute()
+        return cls.model.update(chunk_ids=chunk_ids).where(cls.model.id == id).execute()
 
     @classmethod
     @DB.connection_context()
@@ -299,8 +302,9 @@ class TaskService(CommonService):
         """Update the progress information for a task.
 
         This method updates both the progress message and completion percentage of a task.
-        It handles platform-specific behavior (macOS vs others) and uses database locking
-        when necessary to ensure thread safety.
+        Instead of a global lock, the new values are written with a conditional UPDATE
+        which only applies if the stored progress message is still the one read, and
+        the read-modify-write is retried otherwise.
 
         Update Rules:
             - progress_msg: Always appends the new message to the existing one, and trims the result to max 3000 lines.
@@ -314,41 +318,50 @@ class TaskService(CommonService):
                         - progress_msg (str, optional): Progress message to append
                         - progress (float, optional): Progress percentage (0.0 to 1.0)
         """
-        task = cls.model.get_by_id(id)
-        if not task:
-            logging.warning("Update_progress error: task not found")
-            return
-
-        if os.environ.get("MACOS"):
-            if info["progress_msg"]:
+        for _ in range(PROGRESS_WRITE_RETRIES):
+            task = cls.model.get_by_id(id)
+            if not task:
+                logging.warning("Update_progress error: task not found")
+                return
+            progress_msg = task.progress_msg
+            if info.get("progress_msg"):
                 progress_msg = trim_header_by_lines(task.progress_msg + "\n" + info["progress_msg"], 3000)
-                cls.model.update(progress_msg=progress_msg).where(cls.model.id == id).execute()
-            if "progress" in info:
-                prog = info["progress"]
-                cls.model.update(progress=prog).where(
-                    (cls.model.id == id) &
-                    (
-                            (cls.model.progress != -1) &
-                            ((prog == -1) | (prog > cls.model.progress))
-                    )
-                ).execute()
-        else:
-            with DB.lock("update_progress", -1):
-                if info["progress_msg"]:
-                    progress_msg = trim_header_by_lines(task.progress_msg + "\n" + info["progress_msg"], 3000)
-                    cls.model.update(progress_msg=progress_msg).where(cls.model.id == id).execute()
-                if "progress" in info:
-                    prog = info["progress"]
-                    cls.model.update(progress=prog).where(
-                        (cls.model.id == id) &
-                        (
-                            (cls.model.progress != -1) &
-                            ((prog == -1) | (prog > cls.model.progress))
-                        )
-                    ).execute()
+            process_duration = (datetime.now() - task.begin_at).total_seconds()
+            if cls.write_progress(id, task.progress_msg, progress_msg, info.get("progress"), process_duration):
+                return
+        logging.warning(f"Update_progress error: task {id} kept changing, progress is dropped")
 
-        process_duration = (datetime.now() - task.begin_at).total_seconds()
-        cls.model.update(process_duration=process_duration).where(cls.model.id == id).execute()
+    @classmethod
+    @DB.connection_context()
+    def write_progress(cls, id, expected_msg, progress_msg, prog=None, process_duration=None):
+        """Write the progress of a task in a single conditional UPDATE.
+
+        The progress message is only replaced if the stored one still equals
+        `expected_msg`, so concurrent writers never drop each other's lines.
+        Progress follows the rules of `update_progress`.
+
+        Args:
+            id (str): The unique identifier of the task to update.
+            expected_msg (str): The progress message the new one was built from.
+            progress_msg (str): The new, already trimmed, progress message.
+            prog (float, optional): Progress percentage (0.0 to 1.0), or -1.
+            process_duration (float, optional): Seconds since the task began.
+
+        Returns:
+            bool: False if the stored progress message had changed meanwhile.
+        """
+        fields = {cls.model.progress_msg: progress_msg}
+        if prog is not None:
+            cond = cls.model.progress != -1
+            if prog != -1:
+                cond &= cls.model.progress < prog
+            fields[cls.model.progress] = Case(None, [(cond, prog)], cls.model.progress)
+        if process_duration is not None:
+            fields[cls.model.process_duration] = process_duration
+        if cls.model.update(fields).where((cls.model.id == id) & (cls.model.progress_msg == expected_msg)).execute():
+            return True
+        # MySQL reports 0 affected rows when nothing changed, tell that from a lost race.
+        return cls.model.select().where((cls.model.id == id) & (cls.model.progress_msg == progress_msg)).exists()
 
     @classmethod
     @DB.connection_context()
@@ -449,6 +462,9 @@ def queue_tasks(doc: dict, bucket: str, name: str, priority: int):
         for pre_task in prev_tasks:
             if pre_task["chunk_ids"]:
                 pre_chunk_ids.extend(pre_task["chunk_ids"].split())
+            else:
+                # the task did not finish, its chunks are only recorded in the ledger
+                pre_chunk_ids.extend(ChunkIdLedger.load(pre_task["id"]))
         if pre_chunk_ids:
             settings.docStoreConn.delete({"id": pre_chunk_ids}, search.index_name(chunking_config["tenant_id"]),
                                          chunking_config["kb_id"])
@@ -529,6 +545,67 @@ def has_canceled(task_id):
     return False
 
 
+class ChunkIdLedger:
+    """Append-only record of the chunk ids a task has inserted into the doc store.
+
+    Every bulk insert only appends its own ids to a per-task Redis list, instead of
+    rewriting the task's whole chunk_ids column with the cumulative list. The ids
+    are compacted into the task row once, when the task ends, and the list is dropped.
+    The list survives an executor crash, so the chunks of an unfinished task can still
+    be found and removed when the document is parsed again.
+    """
+
+    TTL = 7 * 24 * 3600
+
+    def __init__(self, task_id: str):
+        self.task_id = task_id
+        self.chunk_ids = []
+        self.bytes_written = 0
+        # What rewriting the cumulative chunk_ids string after every bulk would have cost.
+        self.cumulative_bytes = 0
+        self._cumulative_len = 0
+
+    @staticmethod
+    def key(task_id: str) -> str:
+        return f"{task_id}-chunk_ids"
+
+    @classmethod
+    def load(cls, task_id: str) -> list[str]:
+        return REDIS_CONN.lrange(cls.key(task_id))
+
+    def __len__(self):
+        return len(self.chunk_ids)
+
+    def append(self, chunk_ids: list[str]):
+        if not chunk_ids:
+            return
+        self.chunk_ids.extend(chunk_ids)
+        REDIS_CONN.rpush(self.key(self.task_id), chunk_ids, self.TTL)
+        size = sum(len(i) + 1 for i in chunk_ids)
+        self.bytes_written += size
+        self._cumulative_len += size
+        self.cumulative_bytes += self._cumulative_len
+
+    def compact(self) -> bool:
+        """Write all ids into the task row and drop the Redis list.
+
+        Returns:
+            bool: False if the task does not exist anymore.
+        """
+        chunk_ids_str = " ".join(self.chunk_ids)
+        updated = TaskService.update_chunk_ids(self.task_id, chunk_ids_str)
+        self.bytes_written += len(chunk_ids_str)
+        if not updated:
+            # MySQL reports 0 affected rows when the value is unchanged as well
+            updated, _ = TaskService.get_by_id(self.task_id)
+        REDIS_CONN.delete(self.key(self.task_id))
+        return bool(updated)
+
+    def write_amplification(self) -> str:
+        return "chunk id bookkeeping wrote {} bytes for {} chunks (cumulative rewrites: {} bytes)".format(
+            self.bytes_written, len(self.chunk_ids), self.cumulative_bytes)
+
+
 def queue_dataflow(tenant_id:str, flow_id:str, task_id:str, doc_id:str=CANVAS_DEBUG_DOC_ID, file:dict=None, priority: int=0, rerun:bool=False) -> tuple[bool, str]:
 
     task = dict(
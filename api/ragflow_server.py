@@ -40,6 +40,7 @@ from api.db.init_data import init_web_data, init_superuser
 from common.versions import get_ragflow_version
 from common.config_utils import show_configs
 from common.mcp_tool_call_conn import shutdown_all_mcp_sessions
+from common.misc_utils import shutdown_thread_pools
 from common.log_utils import init_root_logger
 from plugin import GlobalPluginManager
 from rag.utils.redis_conn import RedisDistributedLock
@@ -69,6 +70,7 @@ def update_progress():
 def signal_handler(sig, frame):
     logging.info("Received interrupt signal, shutting down...")
     shutdown_all_mcp_sessions()
+    shutdown_thread_pools()
     stop_event.set()
     stop_event.wait(1)
     sys.exit(0)
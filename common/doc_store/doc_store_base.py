@@ -207,6 +207,13 @@ class DocStoreConnection(ABC):
         """
         raise NotImplementedError("Not implemented")
 
+    def msearch(self, searches: list[list]) -> list:
+        """
+        Run several searches, each given as the positional arguments of `search`, and return their results.
+        Engines with a multi-search API override this to send them in one round trip.
+        """
+        return [self.search(*args) for args in searches]
+
     @abstractmethod
     def get(self, data_id: str, index_name: str, dataset_ids: list[str]) -> dict | None:
         """
@@ -214,6 +221,22 @@ class DocStoreConnection(ABC):
         """
         raise NotImplementedError("Not implemented")
 
+    def mget(self, data_ids: list[str], index_names: str | list[str], dataset_ids: list[str]) -> dict[str, dict]:
+        """
+        Get several chunks with given ids from any of the given indexes, keyed by id. Missing ids are left out.
+        Engines with a multi-get API override this to fetch them in one round trip.
+        """
+        if isinstance(index_names, str):
+            index_names = index_names.split(",")
+        chunks = {}
+        for data_id in data_ids:
+            for index_name in index_names:
+                chunk = self.get(data_id, index_name, dataset_ids)
+                if chunk:
+                    chunks[data_id] = chunk
+                    break
+        return chunks
+
     @abstractmethod
     def insert(self, rows: list[dict], index_name: str, dataset_id: str = None) -> list[str]:
         """
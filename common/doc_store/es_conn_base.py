@@ -183,6 +183,30 @@ class ESConnectionBase(DocStoreConnection):
         self.logger.error(f"ESConnection.get timeout for {ATTEMPT_TIME} times!")
         raise Exception("ESConnection.get timeout.")
 
+    def mget(self, doc_ids: list[str], index_names: str | list[str], dataset_ids: list[str]) -> dict[str, dict]:
+        if isinstance(index_names, str):
+            index_names = index_names.split(",")
+        if not doc_ids:
+            return {}
+        docs = [{"_index": index_name, "_id": doc_id} for index_name in index_names for doc_id in doc_ids]
+        for i in range(ATTEMPT_TIME):
+            try:
+                res = self.es.mget(docs=docs)
+                chunks = {}
+                for d in res["docs"]:
+                    if d.get("found") and d["_id"] not in chunks:
+                        chunk = d["_source"]
+                        chunk["id"] = d["_id"]
+                        chunks[d["_id"]] = chunk
+                return chunks
+            except Exception as e:
+                self.logger.exception(f"ESConnection.mget({len(doc_ids)} ids) got exception")
+                if str(e).find("Timeout") > 0:
+                    continue
+                raise e
+        self.logger.error(f"ESConnection.mget timeout for {ATTEMPT_TIME} times!")
+        raise Exception("ESConnection.mget timeout.")
+
     @abstractmethod
     def search(
             self, select_fields: list[str],
@@ -246,7 +270,10 @@ class ESConnectionBase(DocStoreConnection):
                 ans[d["_id"]] = txt
                 continue
 
-            txt = d["_source"][field_name]
+            txt = d["_source"].get(field_name)
+            if not txt:
+                ans[d["_id"]] = "...".join([a for a in list(highlights.items())[0][1]])
+                continue
             txt = re.sub(r"[\r\n]", " ", txt, flags=re.IGNORECASE | re.MULTILINE)
             txt_list = []
             for t in re.split(r"[.?!;\n]", txt):
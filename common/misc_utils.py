@@ -113,20 +113,135 @@ def pip_install_torch():
     subprocess.check_call([sys.executable, "-m", "pip", "install", *pkg_names])
 
 
-def _thread_pool_executor():
-    max_workers_env = os.getenv("THREAD_POOL_MAX_WORKERS", "128")
+THREAD_POOL_DEFAULT = "default"
+THREAD_POOL_STORAGE = "storage"
+THREAD_POOL_DOC_STORE = "doc_store"
+THREAD_POOL_CPU = "cpu"
+THREAD_POOL_MODEL = "model"
+
+_THREAD_POOL_DEFAULT_SIZES = {
+    THREAD_POOL_DEFAULT: 128,
+    THREAD_POOL_STORAGE: 32,
+    THREAD_POOL_DOC_STORE: 32,
+    THREAD_POOL_CPU: os.cpu_count() or 4,
+    THREAD_POOL_MODEL: 64,
+}
+
+_thread_pools = {}
+_thread_pools_lock = threading.Lock()
+
+
+class _ManagedThreadPoolExecutor(ThreadPoolExecutor):
+    """
+    A ThreadPoolExecutor which keeps track of how many submitted callables are
+    running and how many have completed, so the pool can be observed.
+    """
+
+    def __init__(self, name: str, max_workers: int):
+        super().__init__(max_workers=max_workers, thread_name_prefix=f"ragflow_{name}")
+        self.name = name
+        self._active = 0
+        self._completed = 0
+        self._stats_lock = threading.Lock()
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(self._run, fn, *args, **kwargs)
+
+    def _run(self, fn, *args, **kwargs):
+        with self._stats_lock:
+            self._active += 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._stats_lock:
+                self._active -= 1
+                self._completed += 1
+
+    def stats(self) -> dict:
+        return {
+            "max_workers": self._max_workers,
+            "threads": len(self._threads),
+            "active": self._active,
+            "queued": self._work_queue.qsize(),
+            "completed": self._completed,
+        }
+
+
+def _thread_pool_size(name: str) -> int:
+    """
+    Resolve the size of a named pool. Environment variables take precedence over
+    the `thread_pool` section of service_conf.yaml, e.g.
+
+        thread_pool:
+          default: 128
+          storage: 32
+          doc_store: 32
+          cpu: 8
+          model: 64
+    """
+    default = _THREAD_POOL_DEFAULT_SIZES.get(name, _THREAD_POOL_DEFAULT_SIZES[THREAD_POOL_DEFAULT])
     try:
-        max_workers = int(max_workers_env)
-    except ValueError:
-        max_workers = 128
+        from common.config_utils import get_base_config
+        conf = get_base_config("thread_pool", {}) or {}
+    except Exception:
+        conf = {}
+    env_name = "THREAD_POOL_MAX_WORKERS" if name == THREAD_POOL_DEFAULT else f"THREAD_POOL_{name.upper()}_MAX_WORKERS"
+    max_workers = os.getenv(env_name, conf.get(name, default))
+    try:
+        max_workers = int(max_workers)
+    except (TypeError, ValueError):
+        max_workers = default
     if max_workers < 1:
         max_workers = 1
-    return ThreadPoolExecutor(max_workers=max_workers)
+    return max_workers
 
 
-async def thread_pool_exec(func, *args, **kwargs):
+def get_thread_pool(name: str = THREAD_POOL_DEFAULT) -> ThreadPoolExecutor:
+    """
+    Return the process-wide executor for a workload class, creating it on first use.
+    """
+    pool = _thread_pools.get(name)
+    if pool is not None:
+        return pool
+    with _thread_pools_lock:
+        pool = _thread_pools.get(name)
+        if pool is None:
+            pool = _ManagedThreadPoolExecutor(name, _thread_pool_size(name))
+            _thread_pools[name] = pool
+            logging.info(f"Thread pool '{name}' created with {pool._max_workers} workers")
+        return pool
+
+
+def thread_pool_stats() -> dict:
+    """
+    Queue depth and active-thread metrics of every pool created so far.
+    """
+    with _thread_pools_lock:
+        pools = dict(_thread_pools)
+    return {name: pool.stats() for name, pool in pools.items()}
+
+
+def shutdown_thread_pools(wait: bool = False):
+    """
+    Shut down all pools, dropping callables which have not started yet.
+    A later `get_thread_pool` call creates a fresh pool.
+    """
+    with _thread_pools_lock:
+        pools = dict(_thread_pools)
+        _thread_pools.clear()
+    for name, pool in pools.items():
+        logging.info(f"Shutting down thread pool '{name}': {pool.stats()}")
+        pool.shutdown(wait=wait, cancel_futures=True)
+
+
+async def thread_pool_exec_in(pool_name: str, func, *args, **kwargs):
     loop = asyncio.get_running_loop()
+    pool = get_thread_pool(pool_name)
     if kwargs:
         func = functools.partial(func, *args, **kwargs)
-        return await loop.run_in_executor(_thread_pool_executor(), func)
-    return await loop.run_in_executor(_thread_pool_executor(), func, *args)
+        return await loop.run_in_executor(pool, func)
+    return await loop.run_in_executor(pool, func, *args)
+
+
+async def thread_pool_exec(func, *args, **kwargs):
+    return await thread_pool_exec_in(THREAD_POOL_DEFAULT, func, *args, **kwargs)
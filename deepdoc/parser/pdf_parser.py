@@ -47,11 +47,26 @@ from common import settings
 
 from common.misc_utils import thread_pool_exec
 
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PDF_PAGE_WINDOW = int(os.environ.get("PDF_PAGE_WINDOW", "16"))
+
 LOCK_KEY_pdfplumber = "global_shared_lock_pdfplumber"
 if LOCK_KEY_pdfplumber not in sys.modules:
     sys.modules[LOCK_KEY_pdfplumber] = threading.Lock()
 
 
+def peak_rss_mb() -> float:
+    if resource is None:
+        return 0.0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, in kilobytes elsewhere.
+    return rss / 1024 / 1024 if sys.platform == "darwin" else rss / 1024
+
+
 class RAGFlowPdfParser:
     def __init__(self, **kwargs):
         """
@@ -283,14 +298,40 @@ class RAGFlowPdfParser:
                 b["SP"] = ii
 
     def __ocr(self, pagenum, img, chars, ZM=3, device_id: int | None = None):
+        self.__ocr_pages([(pagenum, img, chars)], ZM, device_id)
+
+    def __ocr_pages(self, pages, ZM=3, device_id: int | None = None):
+        """
+        OCR a list of (pagenum, img, chars), detecting page by page but recognizing
+        the text lines without chars of all the pages in shared batches.
+        """
+        detected = [self.__ocr_detect(pagenum, img, chars, ZM, device_id) for pagenum, img, chars in pages]
+
+        start = timer()
+        boxes_to_reg = [b for bxs in detected for b in bxs if "box_image" in b]
+        texts = self.ocr.recognize_batch([b["box_image"] for b in boxes_to_reg], device_id)
+        for i in range(len(boxes_to_reg)):
+            boxes_to_reg[i]["text"] = texts[i]
+            del boxes_to_reg[i]["box_image"]
+        logging.info(f"__ocr recognize {len(boxes_to_reg)} boxes of {len(pages)} pages cost {timer() - start}s")
+
+        for (pagenum, _, _), bxs in zip(pages, detected):
+            if not bxs:
+                self.boxes.append([])
+                continue
+            bxs = [b for b in bxs if b["text"]]
+            if self.mean_height[pagenum - 1] == 0:
+                self.mean_height[pagenum - 1] = np.median([b["bottom"] - b["top"] for b in bxs])
+            self.boxes.append(bxs)
+
+    def __ocr_detect(self, pagenum, img, chars, ZM=3, device_id: int | None = None):
         start = timer()
         bxs = self.ocr.detect(np.array(img), device_id)
         logging.info(f"__ocr detecting boxes of a image cost ({timer() - start}s)")
 
         start = timer()
         if not bxs:
-            self.boxes.append([])
-            return
+            return []
         bxs = [(line[0], line[1][0]) for line in bxs]
         bxs = Recognizer.sort_Y_firstly(
             [
@@ -328,24 +369,13 @@ class RAGFlowPdfParser:
             del b["chars"]
 
         logging.info(f"__ocr sorting {len(chars)} chars cost {timer() - start}s")
-        start = timer()
-        boxes_to_reg = []
         img_np = np.array(img)
         for b in bxs:
             if not b["text"]:
                 left, right, top, bott = b["x0"] * ZM, b["x1"] * ZM, b["top"] * ZM, b["bottom"] * ZM
                 b["box_image"] = self.ocr.get_rotate_crop_image(img_np, np.array([[left, top], [right, top], [right, bott], [left, bott]], dtype=np.float32))
-                boxes_to_reg.append(b)
             del b["txt"]
-        texts = self.ocr.recognize_batch([b["box_image"] for b in boxes_to_reg], device_id)
-        for i in range(len(boxes_to_reg)):
-            boxes_to_reg[i]["text"] = texts[i]
-            del boxes_to_reg[i]["box_image"]
-        logging.info(f"__ocr recognize {len(bxs)} boxes cost {timer() - start}s")
-        bxs = [b for b in bxs if b["text"]]
-        if self.mean_height[pagenum - 1] == 0:
-            self.mean_height[pagenum - 1] = np.median([b["bottom"] - b["top"] for b in bxs])
-        self.boxes.append(bxs)
+        return bxs
 
     def _layouts_rec(self, ZM, drop=True):
         assert len(self.page_images) == len(self.boxes)
@@ -1045,6 +1075,15 @@ class RAGFlowPdfParser:
             logging.exception("total_page_number")
 
     def __images__(self, fnm, zoomin=3, page_from=0, page_to=299, callback=None):
+        """
+        Render and OCR the pages in [page_from, page_to).
+
+        Page chars are extracted up front, and pdfplumber's per-page caches are
+        dropped right after. Pages are then rendered PDF_PAGE_WINDOW at a time: the
+        next window is rendered while the current one is OCRed, and a page's chars are
+        released once it has been OCRed. Only the page images, which the layout, table
+        and crop stages need, are kept.
+        """
         self.lefted_chars = []
         self.mean_height = []
         self.mean_width = []
@@ -1053,20 +1092,24 @@ class RAGFlowPdfParser:
         self.page_cum_height = [0]
         self.page_layout = []
         self.page_from = page_from
+        self.page_images = []
+        self.page_chars = []
         start = timer()
+        pdf = None
         try:
             with sys.modules[LOCK_KEY_pdfplumber]:
-                with pdfplumber.open(fnm) if isinstance(fnm, str) else pdfplumber.open(BytesIO(fnm)) as pdf:
-                    self.pdf = pdf
-                    self.page_images = [p.to_image(resolution=72 * zoomin, antialias=True).annotated for i, p in enumerate(self.pdf.pages[page_from:page_to])]
-
-                    try:
-                        self.page_chars = [[c for c in page.dedupe_chars().chars if self._has_color(c)] for page in self.pdf.pages[page_from:page_to]]
-                    except Exception as e:
-                        logging.warning(f"Failed to extract characters for pages {page_from}-{page_to}: {str(e)}")
-                        self.page_chars = [[] for _ in range(page_to - page_from)]  # If failed to extract, using empty list instead.
+                pdf = pdfplumber.open(fnm) if isinstance(fnm, str) else pdfplumber.open(BytesIO(fnm))
+                self.pdf = pdf
+                pages = self.pdf.pages[page_from:page_to]
+                try:
+                    for page in pages:
+                        self.page_chars.append([c for c in page.dedupe_chars().chars if self._has_color(c)])
+                        page.close()
+                except Exception as e:
+                    logging.warning(f"Failed to extract characters for pages {page_from}-{page_to}: {str(e)}")
+                    self.page_chars = [[] for _ in range(len(pages))]  # If failed to extract, using empty list instead.
 
-                    self.total_page = len(self.pdf.pages)
+                self.total_page = len(self.pdf.pages)
 
         except Exception as e:
             logging.exception(f"RAGFlowPdfParser __images__, exception: {e}")
@@ -1074,8 +1117,8 @@ class RAGFlowPdfParser:
 
         self.outlines = []
         try:
-            with pdf2_read(fnm if isinstance(fnm, str) else BytesIO(fnm)) as pdf:
-                self.pdf = pdf
+            with pdf2_read(fnm if isinstance(fnm, str) else BytesIO(fnm)) as pdf2:
+                self.pdf = pdf2
 
                 outlines = self.pdf.outline
 
@@ -1094,17 +1137,26 @@ class RAGFlowPdfParser:
         if not self.outlines:
             logging.warning("Miss outlines")
 
-        logging.debug("Images converted.")
+        page_num = len(self.page_chars)
+        has_chars = any(self.page_chars)
         self.is_english = [
             re.search(r"[ a-zA-Z0-9,/¸;:'\[\]\(\)!@#$%^&*\"?<>._-]{30,}", "".join(random.choices([c["text"] for c in self.page_chars[i]], k=min(100, len(self.page_chars[i])))))
-            for i in range(len(self.page_chars))
+            for i in range(page_num)
         ]
-        if sum([1 if e else 0 for e in self.is_english]) > len(self.page_images) / 2:
+        if sum([1 if e else 0 for e in self.is_english]) > page_num / 2:
             self.is_english = True
         else:
             self.is_english = False
 
-        async def __img_ocr(i, id, img, chars, limiter):
+        def __render(s, e):
+            with sys.modules[LOCK_KEY_pdfplumber]:
+                images = []
+                for p in pdf.pages[page_from + s:page_from + e]:
+                    images.append(p.to_image(resolution=72 * zoomin, antialias=True).annotated)
+                    p.close()
+                return images
+
+        def __space_chars(chars):
             j = 0
             while j + 1 < len(chars):
                 if (
@@ -1116,14 +1168,18 @@ class RAGFlowPdfParser:
                     chars[j]["text"] += " "
                 j += 1
 
-            if limiter:
-                async with limiter:
-                    await thread_pool_exec(self.__ocr, i + 1, img, chars, zoomin, id)
-            else:
-                self.__ocr(i + 1, img, chars, zoomin, id)
+        def __ocr_done(i):
+            self.page_chars[i] = []
+            logging.info(f"__images__ page {i + 1} OCR done, peak RSS {peak_rss_mb():.1f}MB")
 
             if callback and i % 6 == 5:
-                callback((i + 1) * 0.6 / len(self.page_images))
+                callback((i + 1) * 0.6 / page_num)
+
+        async def __img_ocr(i, id, img, chars, limiter):
+            __space_chars(chars)
+            async with limiter:
+                await thread_pool_exec(self.__ocr, i + 1, img, chars, zoomin, id)
+            __ocr_done(i)
 
         async def __img_ocr_launcher():
             def __ocr_preprocess():
@@ -1133,47 +1189,83 @@ class RAGFlowPdfParser:
                 self.page_cum_height.append(img.size[1] / zoomin)
                 return chars
 
-            if self.parallel_limiter:
-                tasks = []
+            window = max(PDF_PAGE_WINDOW, settings.PARALLEL_DEVICES) if PDF_PAGE_WINDOW > 0 else page_num
+            rendering = asyncio.create_task(thread_pool_exec(__render, 0, min(window, page_num))) if pdf and page_num else None
+            s = 0
+            while rendering:
+                try:
+                    images = await rendering
+                except Exception as e:
+                    logging.exception(f"RAGFlowPdfParser __images__ rendering pages from {s + 1}, exception: {e}")
+                    break
+                rendering = None
+                self.page_images.extend(images)
+                e = s + len(images)
+                if images and e < page_num:
+                    rendering = asyncio.create_task(thread_pool_exec(__render, e, min(e + window, page_num)))
 
-                for i, img in enumerate(self.page_images):
-                    chars = __ocr_preprocess()
+                if self.parallel_limiter:
+                    tasks = []
 
-                    semaphore = self.parallel_limiter[i % settings.PARALLEL_DEVICES]
+                    for i, img in enumerate(images, start=s):
+                        chars = __ocr_preprocess()
 
-                    async def wrapper(i=i, img=img, chars=chars, semaphore=semaphore):
-                        await __img_ocr(
-                            i,
-                            i % settings.PARALLEL_DEVICES,
-                            img,
-                            chars,
-                            semaphore,
-                        )
+                        semaphore = self.parallel_limiter[i % settings.PARALLEL_DEVICES]
 
-                    tasks.append(asyncio.create_task(wrapper()))
-                    await asyncio.sleep(0)
+                        async def wrapper(i=i, img=img, chars=chars, semaphore=semaphore):
+                            await __img_ocr(
+                                i,
+                                i % settings.PARALLEL_DEVICES,
+                                img,
+                                chars,
+                                semaphore,
+                            )
 
-                try:
-                    await asyncio.gather(*tasks, return_exceptions=False)
-                except Exception as e:
-                    logging.error(f"Error in OCR: {e}")
-                    for t in tasks:
-                        t.cancel()
-                    await asyncio.gather(*tasks, return_exceptions=True)
-                    raise
+                        tasks.append(asyncio.create_task(wrapper()))
+                        await asyncio.sleep(0)
 
-            else:
-                for i, img in enumerate(self.page_images):
-                    chars = __ocr_preprocess()
-                    await __img_ocr(i, 0, img, chars, None)
+                    try:
+                        await asyncio.gather(*tasks, return_exceptions=False)
+                    except Exception as e:
+                        logging.error(f"Error in OCR: {e}")
+                        for t in tasks:
+                            t.cancel()
+                        await asyncio.gather(*tasks, return_exceptions=True)
+                        if rendering:
+                            rendering.cancel()
+                            await asyncio.gather(rendering, return_exceptions=True)
+                        raise
+
+                else:
+                    # One device: recognize the text lines of the whole window together, off the event loop
+                    # so that the next window renders meanwhile.
+                    pages = []
+                    for i, img in enumerate(images, start=s):
+                        chars = __ocr_preprocess()
+                        __space_chars(chars)
+                        pages.append((i + 1, img, chars))
+                    try:
+                        await thread_pool_exec(self.__ocr_pages, pages, zoomin, 0)
+                    except Exception:
+                        if rendering:
+                            rendering.cancel()
+                            await asyncio.gather(rendering, return_exceptions=True)
+                        raise
+                    for i in range(s, e):
+                        __ocr_done(i)
+                s = e
 
         start = timer()
 
-        asyncio.run(__img_ocr_launcher())
+        try:
+            asyncio.run(__img_ocr_launcher())
+        finally:
+            if pdf:
+                pdf.close()
 
-        logging.info(f"__images__ {len(self.page_images)} pages cost {timer() - start}s")
+        logging.info(f"__images__ {len(self.page_images)} pages cost {timer() - start}s, peak RSS {peak_rss_mb():.1f}MB")
 
-        if not self.is_english and not any([c for c in self.page_chars]) and self.boxes:
+        if not self.is_english and not has_chars and self.boxes:
             bxes = [b for bxs in self.boxes for b in bxs]
             self.is_english = re.search(r"[ \na-zA-Z0-9,/¸;:'\[\]\(\)!@#$%^&*\"?<>._-]{30,}", "".join([b["text"] for b in random.choices(bxes, k=min(30, len(bxes)))]))
 
@@ -1182,6 +1274,8 @@ class RAGFlowPdfParser:
         self.page_cum_height = np.cumsum(self.page_cum_height)
         assert len(self.page_cum_height) == len(self.page_images) + 1
         if len(self.boxes) == 0 and zoomin < 9:
+            # Let the images of this zoom go before rendering the pages again.
+            self.page_images = []
             self.__images__(fnm, zoomin * 3, page_from, page_to, callback)
 
     def __call__(self, fnm, need_image=True, zoomin=3, return_html=False):
@@ -705,6 +705,51 @@ class OCR:
             texts.append(text)
         return texts
 
+    def batch(self, img_list, device_id: int | None = None):
+        """
+        OCR several images, e.g. the pages of a document, at once.
+
+        Text lines are detected image by image, but recognized all together, so
+        the recognizer gets width sorted batches pooled across images instead of
+        one image's lines at a time. Returns, for each image, the same list of
+        (box, (text, score)) as __call__, empty if nothing was detected.
+        """
+        if device_id is None:
+            device_id = 0
+
+        start = time.time()
+        page_boxes = []
+        img_crop_list = []
+        for img in img_list:
+            if img is None:
+                page_boxes.append([])
+                continue
+            ori_im = img.copy()
+            dt_boxes, _ = self.text_detector[device_id](img)
+            if dt_boxes is None:
+                page_boxes.append([])
+                continue
+            dt_boxes = self.sorted_boxes(dt_boxes)
+            page_boxes.append(dt_boxes)
+            for box in dt_boxes:
+                img_crop_list.append(self.get_rotate_crop_image(ori_im, copy.deepcopy(box)))
+        det_elapse = time.time() - start
+
+        rec_res, rec_elapse = self.text_recognizer[device_id](img_crop_list)
+        logging.info(f"OCR.batch {len(img_list)} images, {len(img_crop_list)} text lines, detection cost {det_elapse:.2f}s, recognition cost {rec_elapse:.2f}s")
+
+        res = []
+        i = 0
+        for dt_boxes in page_boxes:
+            page = []
+            for box in dt_boxes:
+                text, score = rec_res[i]
+                i += 1
+                if score >= self.drop_score:
+                    page.append((box.tolist(), (text, score)))
+            res.append(page)
+        return res
+
     def __call__(self, img, device_id = 0, cls=True):
         time_dict = {'det': 0, 'rec': 0, 'cls': 0, 'all': 0}
         if device_id is None:
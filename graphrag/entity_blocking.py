@@ -0,0 +1,100 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Blocking of entity names for entity resolution.
+
+EntityResolution.is_similarity compares English names by edit distance, which has to be
+within half the shorter length, and other names by the overlap of their character sets.
+Rather than checking every pair of names, candidate pairs are drawn from inverted indexes:
+
+- Names that are not both English must share 80% of their characters (2 of them below 4),
+  so with characters ordered from rarest to most common, the first few characters of both
+  names intersect. This prefix filter finds every such pair.
+- English names are indexed by their padded character bigrams, and pairs whose lengths
+  differ by more than half the shorter one are dropped. Each edit changes at most two
+  bigrams, so names within the edit distance is_similarity allows share at least one, and
+  this finds every such pair too. With ENTITY_BLOCKING_KEYS set, names are only indexed by
+  that many of their rarest bigrams: similar names share most bigrams, so they nearly
+  always share one of the rarest, but this may miss pairs for fewer candidates.
+
+Candidates still have to pass is_similarity; test/unit_test/utils/test_entity_blocking.py
+checks that none of the pairs it accepts is missed.
+"""
+
+import os
+from collections import Counter, defaultdict
+
+# Bigrams indexed per English name, 0 for all of them.
+ENTITY_BLOCKING_KEYS = int(os.environ.get("ENTITY_BLOCKING_KEYS", 0))
+
+
+def padded_bigrams(name: str) -> set[str]:
+    name = f"\x02{name}\x03"
+    return {name[i: i + 2] for i in range(len(name) - 1)}
+
+
+def _rarest(keys, frequency: Counter, n: int) -> list:
+    return sorted(keys, key=lambda k: (frequency[k], k))[:n]
+
+
+def candidate_pairs(names: list[str], english: list[bool], anchors: set[str] | None = None,
+                    num_keys: int = ENTITY_BLOCKING_KEYS) -> list[tuple[str, str]]:
+    """
+    Candidate pairs of similar `names`, `english` telling which ones are English. Only pairs with
+    at least one name in `anchors`, if given, are returned. Each pair is ordered like `names`.
+    """
+    probes = [i for i, name in enumerate(names) if anchors is None or name in anchors]
+    pairs = set()
+
+    # Character sets of names that are not both English.
+    char_sets = [set(name) for name in names]
+    char_frequency = Counter(c for s in char_sets for c in s)
+    prefixes = []
+    postings = {True: defaultdict(list), False: defaultdict(list)}
+    for i, s in enumerate(char_sets):
+        overlap = 2 if len(s) < 4 else (4 * len(s) + 4) // 5
+        prefix = _rarest(s, char_frequency, len(s) - overlap + 1) if len(s) >= 2 else []
+        prefixes.append(prefix)
+        for c in prefix:
+            postings[english[i]][c].append(i)
+    for i in probes:
+        partners = [postings[False]] if english[i] else [postings[False], postings[True]]
+        for c in prefixes[i]:
+            for posting in partners:
+                pairs.update((min(i, j), max(i, j)) for j in posting[c] if j != i)
+
+    # English names by their rarest bigrams, within the length difference edit distance allows.
+    english_ids = [i for i in range(len(names)) if english[i]]
+    bigrams = {i: padded_bigrams(names[i]) for i in english_ids}
+    bigram_frequency = Counter(b for i in english_ids for b in bigrams[i])
+    keys = {i: _rarest(bigrams[i], bigram_frequency, num_keys) if num_keys > 0 else bigrams[i] for i in english_ids}
+    index = defaultdict(list)
+    for i in english_ids:
+        for k in keys[i]:
+            index[k].append(i)
+    for i in probes:
+        if not english[i]:
+            continue
+        for k in keys[i]:
+            for j in index[k]:
+                if j == i:
+                    continue
+                la, lb = len(names[i]), len(names[j])
+                if abs(la - lb) <= min(la, lb) // 2:
+                    pairs.add((min(i, j), max(i, j)))
+
+    return [(names[i], names[j]) for i, j in sorted(pairs)]
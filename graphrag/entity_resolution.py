@@ -23,6 +23,7 @@ from typing import Any, Callable
 
 import networkx as nx
 
+from graphrag.entity_blocking import candidate_pairs
 from graphrag.general.extractor import Extractor
 from rag.nlp import is_english
 import editdistance
@@ -37,6 +38,8 @@ from common.misc_utils import thread_pool_exec
 DEFAULT_RECORD_DELIMITER = "##"
 DEFAULT_ENTITY_INDEX_DELIMITER = "<|>"
 DEFAULT_RESOLUTION_RESULT_DELIMITER = "&&"
+# Draw candidate pairs from graphrag.entity_blocking rather than checking all pairs of each entity type.
+ENTITY_RESOLUTION_BLOCKING = os.environ.get("ENTITY_RESOLUTION_BLOCKING", "1").lower() in ["1", "true", "yes"]
 
 
 @dataclass
@@ -97,7 +100,11 @@ class EntityResolution(Extractor):
 
         candidate_resolution = {entity_type: [] for entity_type in entity_types}
         for k, v in node_clusters.items():
-            candidate_resolution[k] = [(a, b) for a, b in itertools.combinations(v, 2) if (a in subgraph_nodes or b in subgraph_nodes) and self.is_similarity(a, b)]
+            if ENTITY_RESOLUTION_BLOCKING:
+                pairs = candidate_pairs(v, [is_english(n) for n in v], subgraph_nodes)
+            else:
+                pairs = [(a, b) for a, b in itertools.combinations(v, 2) if a in subgraph_nodes or b in subgraph_nodes]
+            candidate_resolution[k] = [(a, b) for a, b in pairs if self.is_similarity(a, b)]
         num_candidates = sum([len(candidates) for _, candidates in candidate_resolution.items()])
         callback(msg=f"Identified {num_candidates} candidate pairs")
         remain_candidates_to_resolve = num_candidates
@@ -269,7 +276,8 @@ class EntityResolution(Extractor):
 
         return ans_list
 
-    def _has_digit_in_2gram_diff(self, a, b):
+    @staticmethod
+    def _has_digit_in_2gram_diff(a, b):
         def to_2gram_set(s):
             return {s[i:i+2] for i in range(len(s) - 1)}
 
@@ -279,8 +287,9 @@ class EntityResolution(Extractor):
 
         return any(any(c.isdigit() for c in pair) for pair in diff)
 
-    def is_similarity(self, a, b):
-        if self._has_digit_in_2gram_diff(a, b):
+    @staticmethod
+    def is_similarity(a, b):
+        if EntityResolution._has_digit_in_2gram_diff(a, b):
             return False
 
         if is_english(a) and is_english(b):
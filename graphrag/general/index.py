@@ -39,7 +39,7 @@ from graphrag.utils import (
     set_graph,
     tidy_graph,
 )
-from common.misc_utils import thread_pool_exec
+from common.misc_utils import thread_pool_exec_in, THREAD_POOL_DOC_STORE
 from rag.nlp import rag_tokenizer, search
 from rag.utils.redis_conn import RedisDistributedLock
 from common import settings
@@ -153,6 +153,7 @@ async def run_graphrag_for_kb(
     with_resolution: bool = True,
     with_community: bool = True,
     max_parallel_docs: int = 4,
+    batch_merge: bool = True,
 ) -> dict:
     tenant_id, kb_id = row["tenant_id"], row["kb_id"]
     enable_timeout_assertion = os.environ.get("ENABLE_TIMEOUT_ASSERTION")
@@ -315,20 +316,29 @@ async def run_graphrag_for_kb(
         union_nodes: set = set()
         final_graph = None
 
-        for doc_id in ok_docs:
-            sg = subgraphs[doc_id]
-            union_nodes.update(set(sg.nodes()))
-
-            new_graph = await merge_subgraph(
+        if batch_merge:
+            final_graph = await merge_subgraphs(
                 tenant_id,
                 kb_id,
-                doc_id,
-                sg,
+                [subgraphs[doc_id] for doc_id in ok_docs],
                 embedding_model,
                 callback,
             )
-            if new_graph is not None:
-                final_graph = new_graph
+        else:
+            for doc_id in ok_docs:
+                sg = subgraphs[doc_id]
+                union_nodes.update(set(sg.nodes()))
+
+                new_graph = await merge_subgraph(
+                    tenant_id,
+                    kb_id,
+                    doc_id,
+                    sg,
+                    embedding_model,
+                    callback,
+                )
+                if new_graph is not None:
+                    final_graph = new_graph
 
         if final_graph is None:
             callback(msg=f"[GraphRAG] kb:{kb_id} merge finished (no in-memory graph returned).")
@@ -461,8 +471,8 @@ async def generate_subgraph(
         "removed_kwd": "N",
     }
     cid = chunk_id(chunk)
-    await thread_pool_exec(settings.docStoreConn.delete,{"knowledge_graph_kwd": "subgraph", "source_id": doc_id},search.index_name(tenant_id),kb_id,)
-    await thread_pool_exec(settings.docStoreConn.insert,[{"id": cid, **chunk}],search.index_name(tenant_id),kb_id,)
+    await thread_pool_exec_in(THREAD_POOL_DOC_STORE, settings.docStoreConn.delete,{"knowledge_graph_kwd": "subgraph", "source_id": doc_id},search.index_name(tenant_id),kb_id,)
+    await thread_pool_exec_in(THREAD_POOL_DOC_STORE, settings.docStoreConn.insert,[{"id": cid, **chunk}],search.index_name(tenant_id),kb_id,)
     now = asyncio.get_running_loop().time()
     callback(msg=f"generated subgraph for doc {doc_id} in {now - start:.2f} seconds.")
     return subgraph
@@ -498,6 +508,53 @@ async def merge_subgraph(
     return new_graph
 
 
+@timeout(60 * 20, 1)
+async def merge_subgraphs(
+    tenant_id: str,
+    kb_id: str,
+    subgraphs: list[nx.Graph],
+    embedding_model,
+    callback,
+):
+    """
+    Merge the subgraphs of many documents into the global graph at once: unlike calling merge_subgraph
+    per document, the global graph is loaded, ranked and persisted a single time, with one GraphChange.
+    """
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    timings = {}
+    change = GraphChange()
+    source_ids = [doc_id for sg in subgraphs for doc_id in sg.graph["source_id"]]
+    new_graph = await get_graph(tenant_id, kb_id, source_ids)
+    timings["load"] = loop.time() - start
+
+    st = loop.time()
+    if new_graph is not None:
+        logging.info("Merge with an exiting graph...................")
+        tidy_graph(new_graph, callback)
+    else:
+        new_graph = nx.Graph()
+    for i, sg in enumerate(subgraphs):
+        graph_merge(new_graph, sg, change, update_rank=i == len(subgraphs) - 1)
+    timings["merge"] = loop.time() - st
+
+    st = loop.time()
+    pr = nx.pagerank(new_graph)
+    for node_name, pagerank in pr.items():
+        new_graph.nodes[node_name]["pagerank"] = pagerank
+    timings["pagerank"] = loop.time() - st
+
+    st = loop.time()
+    await set_graph(tenant_id, kb_id, embedding_model, new_graph, change, callback)
+    timings["persist"] = loop.time() - st
+
+    now = loop.time()
+    callback(msg=f"merging {len(subgraphs)} subgraphs into the global graph done in {now - start:.2f} seconds "
+                 f"({', '.join(f'{k} {v:.2f}s' for k, v in timings.items())}), "
+                 f"{new_graph.number_of_nodes()} nodes and {new_graph.number_of_edges()} edges.")
+    return new_graph
+
+
 @timeout(60 * 30, 1)
 async def resolve_entities(
     graph,
@@ -593,10 +650,10 @@ async def extract_community(
         chunk["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(chunk["content_ltks"])
         chunks.append(chunk)
 
-    await thread_pool_exec(settings.docStoreConn.delete,{"knowledge_graph_kwd": "community_report", "kb_id": kb_id},search.index_name(tenant_id),kb_id,)
+    await thread_pool_exec_in(THREAD_POOL_DOC_STORE, settings.docStoreConn.delete,{"knowledge_graph_kwd": "community_report", "kb_id": kb_id},search.index_name(tenant_id),kb_id,)
     es_bulk_size = 4
     for b in range(0, len(chunks), es_bulk_size):
-        doc_store_result = await thread_pool_exec(settings.docStoreConn.insert,chunks[b : b + es_bulk_size],search.index_name(tenant_id),kb_id,)
+        doc_store_result = await thread_pool_exec_in(THREAD_POOL_DOC_STORE, settings.docStoreConn.insert,chunks[b : b + es_bulk_size],search.index_name(tenant_id),kb_id,)
         if doc_store_result:
             error_message = f"Insert chunk error: {doc_store_result}, please check log file and Elasticsearch/Infinity status!"
             raise Exception(error_message)
@@ -16,12 +16,14 @@
 import asyncio
 import json
 import logging
+import os
 from collections import defaultdict
 from copy import deepcopy
+from timeit import default_timer as timer
 import json_repair
 import pandas as pd
 
-from common.misc_utils import get_uuid
+from common.misc_utils import get_uuid, thread_pool_exec_in, THREAD_POOL_DOC_STORE
 from graphrag.query_analyze_prompt import PROMPTS
 from graphrag.utils import get_entity_type2samples, get_llm_cache, set_llm_cache, get_relation
 from common.token_utils import num_tokens_from_string
@@ -29,7 +31,20 @@ from common.token_utils import num_tokens_from_string
 from rag.nlp.search import Dealer, index_name
 from common.float_utils import get_float
 from common import settings
-from common.doc_store.doc_store_base import OrderByExpr
+from common.doc_store.doc_store_base import OrderByExpr, MatchDenseExpr
+
+# Entities of the query's answer types are only used to boost entities and relations found
+# otherwise, so only the highest ranked ones are fetched, page by page.
+KG_TYPE_ENTITY_LIMIT = int(os.environ.get("KG_TYPE_ENTITY_LIMIT", 2048))
+KG_TYPE_ENTITY_PAGE_SIZE = int(os.environ.get("KG_TYPE_ENTITY_PAGE_SIZE", 512))
+
+
+async def _timed(timings: dict, stage: str, coro):
+    st = timer()
+    try:
+        return await coro
+    finally:
+        timings[stage] = round((timer() - st) * 1000, 1)
 
 
 class KGSearch(Dealer):
@@ -105,29 +120,39 @@ class KGSearch(Dealer):
             }
         return res
 
-    def get_relevant_ents_by_keywords(self, keywords, filters, idxnms, kb_ids, emb_mdl, sim_thr=0.3, N=56):
+    @staticmethod
+    def _with_similarity(matchDense, sim_thr):
+        return MatchDenseExpr(matchDense.vector_column_name, matchDense.embedding_data, matchDense.embedding_data_type,
+                              matchDense.distance_type, matchDense.topn, {"similarity": sim_thr})
+
+    async def get_relevant_ents_by_keywords(self, keywords, filters, idxnms, kb_ids, emb_mdl, sim_thr=0.3, N=56,
+                                            matchDense=None):
         if not keywords:
             return {}
         filters = deepcopy(filters)
         filters["knowledge_graph_kwd"] = "entity"
-        matchDense = self.get_vector(", ".join(keywords), emb_mdl, 1024, sim_thr)
-        es_res = self.dataStore.search(["content_with_weight", "entity_kwd", "rank_flt"], [], filters, [matchDense],
-                                       OrderByExpr(), 0, N,
-                                       idxnms, kb_ids)
+        if matchDense is None:
+            matchDense = await self.get_vector(", ".join(keywords), emb_mdl, 1024, sim_thr)
+        es_res = await thread_pool_exec_in(THREAD_POOL_DOC_STORE, self.dataStore.search,
+                                           ["content_with_weight", "entity_kwd", "rank_flt", "n_hop_with_weight"], [], filters,
+                                           [matchDense], OrderByExpr(), 0, N, idxnms, kb_ids)
         return self._ent_info_from_(es_res, sim_thr)
 
-    def get_relevant_relations_by_txt(self, txt, filters, idxnms, kb_ids, emb_mdl, sim_thr=0.3, N=56):
+    async def get_relevant_relations_by_txt(self, txt, filters, idxnms, kb_ids, emb_mdl, sim_thr=0.3, N=56,
+                                            matchDense=None):
         if not txt:
             return {}
         filters = deepcopy(filters)
         filters["knowledge_graph_kwd"] = "relation"
-        matchDense = self.get_vector(txt, emb_mdl, 1024, sim_thr)
-        es_res = self.dataStore.search(
-            ["content_with_weight", "_score", "from_entity_kwd", "to_entity_kwd", "weight_int"],
-            [], filters, [matchDense], OrderByExpr(), 0, N, idxnms, kb_ids)
+        if matchDense is None:
+            matchDense = await self.get_vector(txt, emb_mdl, 1024, sim_thr)
+        es_res = await thread_pool_exec_in(THREAD_POOL_DOC_STORE, self.dataStore.search,
+                                           ["content_with_weight", "_score", "from_entity_kwd", "to_entity_kwd",
+                                            "weight_int"],
+                                           [], filters, [matchDense], OrderByExpr(), 0, N, idxnms, kb_ids)
         return self._relation_info_from_(es_res, sim_thr)
 
-    def get_relevant_ents_by_types(self, types, filters, idxnms, kb_ids, N=56):
+    def get_relevant_ents_by_types(self, types, filters, idxnms, kb_ids, N=56, page_size=KG_TYPE_ENTITY_PAGE_SIZE):
         if not types:
             return {}
         filters = deepcopy(filters)
@@ -135,9 +160,17 @@ class KGSearch(Dealer):
         filters["entity_type_kwd"] = types
         ordr = OrderByExpr()
         ordr.desc("rank_flt")
-        es_res = self.dataStore.search(["entity_kwd", "rank_flt"], [], filters, [], ordr, 0, N,
-                                       idxnms, kb_ids)
-        return self._ent_info_from_(es_res, 0)
+        res = {}
+        page_size = max(1, min(page_size, N))
+        for offset in range(0, N, page_size):
+            limit = min(page_size, N - offset)
+            es_res = self.dataStore.search(["entity_kwd", "rank_flt"], [], filters, [], ordr, offset, limit,
+                                           idxnms, kb_ids)
+            for ent, info in self._ent_info_from_(es_res, 0).items():
+                res.setdefault(ent, info)
+            if len(self.dataStore.get_doc_ids(es_res)) < limit:
+                break
+        return res
 
     async def retrieval(self, question: str,
                tenant_ids: str | list[str],
@@ -150,25 +183,54 @@ class KGSearch(Dealer):
                comm_topn: int = 1,
                ent_sim_threshold: float = 0.3,
                rel_sim_threshold: float = 0.3,
+               timings: dict | None = None,
                   **kwargs
                ):
+        """
+        The knowledge graph context of the question, as a single chunk.
+
+        If `timings` is given, it is filled with the elapsed milliseconds of each stage.
+        """
         qst = question
         filters = self.get_filters({"kb_ids": kb_ids})
         if isinstance(tenant_ids, str):
             tenant_ids = tenant_ids.split(",")
         idxnms = [index_name(tid) for tid in tenant_ids]
+        if timings is None:
+            timings = {}
+        st = timer()
+        # The question is embedded while the LLM rewrites it, and its vector is shared by the
+        # relation search and, if the rewrite yields no entities, the entity search.
+        qst_vector = asyncio.create_task(_timed(timings, "embedding", self.get_vector(qst, emb_mdl, 1024, rel_sim_threshold)))
         ty_kwds = []
         try:
-            ty_kwds, ents = await self.query_rewrite(llm, qst, [index_name(tid) for tid in tenant_ids], kb_ids)
+            ty_kwds, ents = await _timed(timings, "query_rewrite", self.query_rewrite(llm, qst, idxnms, kb_ids))
             logging.info(f"Q: {qst}, Types: {ty_kwds}, Entities: {ents}")
         except Exception as e:
             logging.exception(e)
             ents = [qst]
             pass
 
-        ents_from_query = self.get_relevant_ents_by_keywords(ents, filters, idxnms, kb_ids, emb_mdl, ent_sim_threshold)
-        ents_from_types = self.get_relevant_ents_by_types(ty_kwds, filters, idxnms, kb_ids, 10000)
-        rels_from_txt = self.get_relevant_relations_by_txt(qst, filters, idxnms, kb_ids, emb_mdl, rel_sim_threshold)
+        async def ents_by_keywords():
+            if not ents:
+                return {}
+            if ", ".join(ents) == qst:
+                matchDense = self._with_similarity(await qst_vector, ent_sim_threshold)
+            else:
+                matchDense = await self.get_vector(", ".join(ents), emb_mdl, 1024, ent_sim_threshold)
+            return await self.get_relevant_ents_by_keywords(ents, filters, idxnms, kb_ids, emb_mdl, ent_sim_threshold,
+                                                            matchDense=matchDense)
+
+        async def rels_by_txt():
+            return await self.get_relevant_relations_by_txt(qst, filters, idxnms, kb_ids, emb_mdl, rel_sim_threshold,
+                                                            matchDense=await qst_vector)
+
+        ents_from_query, ents_from_types, rels_from_txt = await asyncio.gather(
+            _timed(timings, "entities", ents_by_keywords()),
+            _timed(timings, "entity_types", thread_pool_exec_in(THREAD_POOL_DOC_STORE, self.get_relevant_ents_by_types,
+                                                                ty_kwds, filters, idxnms, kb_ids, KG_TYPE_ENTITY_LIMIT)),
+            _timed(timings, "relations", rels_by_txt()),
+        )
         nhop_pathes = defaultdict(dict)
         for _, ent in ents_from_query.items():
             nhops = ent.get("n_hop_ents", [])
@@ -239,6 +301,7 @@ class KGSearch(Dealer):
                 ents = ents[:-1]
                 break
 
+        relation_st = timer()
         for (f, t), rel in rels_from_txt:
             if not rel.get("description"):
                 for tid in tenant_ids:
@@ -264,6 +327,8 @@ class KGSearch(Dealer):
                 relas = relas[:-1]
                 break
 
+        timings["relation_details"] = round((timer() - relation_st) * 1000, 1)
+
         if ents:
             ents = "\n---- Entities ----\n{}".format(pd.DataFrame(ents).to_csv())
         else:
@@ -273,11 +338,16 @@ class KGSearch(Dealer):
         else:
             relas = ""
 
+        communities = await _timed(timings, "communities", thread_pool_exec_in(
+            THREAD_POOL_DOC_STORE, self._community_retrieval_, [n for n, _ in ents_from_query], filters, kb_ids, idxnms,
+            comm_topn, max_token))
+        timings["total"] = round((timer() - st) * 1000, 1)
+        logging.info(f"Knowledge graph retrieval elapsed(ms): {timings}")
+
         return {
                 "chunk_id": get_uuid(),
                 "content_ltks": "",
-                "content_with_weight": ents + relas + self._community_retrieval_([n for n, _ in ents_from_query], filters, kb_ids, idxnms,
-                                                        comm_topn, max_token),
+                "content_with_weight": ents + relas + communities,
                 "doc_id": "",
                 "docnm_kwd": "Related content in Knowledge Graph",
                 "kb_id": kb_ids,
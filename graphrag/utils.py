@@ -1,7 +1,7 @@
 # Copyright (c) 2024 Microsoft Corporation.
 # Licensed under the MIT License
 
-from common.misc_utils import thread_pool_exec
+from common.misc_utils import thread_pool_exec_in, THREAD_POOL_DOC_STORE, THREAD_POOL_MODEL
 
 """
 Reference:
@@ -17,6 +17,7 @@ import logging
 import os
 import re
 import time
+import weakref
 from collections import defaultdict
 from hashlib import md5
 from typing import Any, Callable, Set, Tuple
@@ -39,6 +40,16 @@ ErrorHandlerFn = Callable[[BaseException | None, str | None, dict | None], None]
 
 chat_limiter = asyncio.Semaphore(int(os.environ.get("MAX_CONCURRENT_CHATS", 10)))
 
+# The KB graph is stored as a manifest, the "graph" chunk, plus "graph_partition" chunks each holding the
+# nodes of one partition and their edges, so that only partitions that changed are rewritten.
+GRAPH_FORMAT_PARTITIONED = "partitioned"
+GRAPH_PARTITION_NODES = int(os.environ.get("GRAPH_PARTITION_NODES", 2000))
+GRAPH_PARTITION_FETCH_SIZE = int(os.environ.get("GRAPH_PARTITION_FETCH_SIZE", 16))
+# The manifest also keeps the subgraph of this many nodes of highest pagerank, which graph views show.
+GRAPH_OVERVIEW_NODES = int(os.environ.get("GRAPH_OVERVIEW_NODES", 256))
+# The partitions each graph was loaded or last saved with, to tell which ones changed.
+_graph_partitions = weakref.WeakKeyDictionary()
+
 
 @dataclasses.dataclass
 class GraphChange:
@@ -93,11 +104,14 @@ def dict_has_keys_with_types(data: dict, expected_fields: list[tuple[str, type]]
     return True
 
 
-def get_llm_cache(llmnm, txt, history, genconf):
+def _llm_cache_key(llmnm, txt, history, genconf):
     hasher = xxhash.xxh64()
     hasher.update((str(llmnm)+str(txt)+str(history)+str(genconf)).encode("utf-8"))
+    return hasher.hexdigest()
 
-    k = hasher.hexdigest()
+
+def get_llm_cache(llmnm, txt, history, genconf):
+    k = _llm_cache_key(llmnm, txt, history, genconf)
     bin = REDIS_CONN.get(k)
     if not bin:
         return None
@@ -105,18 +119,38 @@ def get_llm_cache(llmnm, txt, history, genconf):
 
 
 def set_llm_cache(llmnm, txt, v, history, genconf):
-    hasher = xxhash.xxh64()
-    hasher.update((str(llmnm)+str(txt)+str(history)+str(genconf)).encode("utf-8"))
-    k = hasher.hexdigest()
+    k = _llm_cache_key(llmnm, txt, history, genconf)
     REDIS_CONN.set(k, v.encode("utf-8"), 24 * 3600)
 
 
-def get_embed_cache(llmnm, txt):
+def get_llm_cache_batch(llmnm, txts, history, genconf):
+    """
+    Same as get_llm_cache for many texts at once, in a single MGET.
+    """
+    if not txts:
+        return []
+    values = REDIS_CONN.mget([_llm_cache_key(llmnm, txt, history, genconf) for txt in txts]) or [None] * len(txts)
+    return [v if v else None for v in values]
+
+
+def set_llm_cache_batch(llmnm, txts, vs, history, genconf):
+    """
+    Same as set_llm_cache for many texts at once, in a single pipelined MSET.
+    """
+    if not txts:
+        return
+    REDIS_CONN.mset({_llm_cache_key(llmnm, txt, history, genconf): v for txt, v in zip(txts, vs)}, 24 * 3600)
+
+
+def _embed_cache_key(llmnm, txt):
     hasher = xxhash.xxh64()
     hasher.update(str(llmnm).encode("utf-8"))
     hasher.update(str(txt).encode("utf-8"))
+    return hasher.hexdigest()
 
-    k = hasher.hexdigest()
+
+def get_embed_cache(llmnm, txt):
+    k = _embed_cache_key(llmnm, txt)
     bin = REDIS_CONN.get(k)
     if not bin:
         return
@@ -124,15 +158,33 @@ def get_embed_cache(llmnm, txt):
 
 
 def set_embed_cache(llmnm, txt, arr):
-    hasher = xxhash.xxh64()
-    hasher.update(str(llmnm).encode("utf-8"))
-    hasher.update(str(txt).encode("utf-8"))
-
-    k = hasher.hexdigest()
+    k = _embed_cache_key(llmnm, txt)
     arr = json.dumps(arr.tolist() if isinstance(arr, np.ndarray) else arr)
     REDIS_CONN.set(k, arr.encode("utf-8"), 24 * 3600)
 
 
+def get_embed_cache_batch(llmnm, txts):
+    """
+    Same as get_embed_cache for many texts at once, in a single MGET.
+    """
+    if not txts:
+        return []
+    values = REDIS_CONN.mget([_embed_cache_key(llmnm, txt) for txt in txts]) or [None] * len(txts)
+    return [np.array(json.loads(v)) if v else None for v in values]
+
+
+def set_embed_cache_batch(llmnm, txts, arrs):
+    """
+    Same as set_embed_cache for many texts at once, in a single pipelined MSET.
+    """
+    if not txts:
+        return
+    REDIS_CONN.mset({
+        _embed_cache_key(llmnm, txt): json.dumps(arr.tolist() if isinstance(arr, np.ndarray) else arr).encode("utf-8")
+        for txt, arr in zip(txts, arrs)
+    }, 24 * 3600)
+
+
 def get_tags_from_cache(kb_ids):
     hasher = xxhash.xxh64()
     hasher.update(str(kb_ids).encode("utf-8"))
@@ -195,8 +247,8 @@ def get_from_to(node1, node2):
         return (node2, node1)
 
 
-def graph_merge(g1: nx.Graph, g2: nx.Graph, change: GraphChange):
-    """Merge graph g2 into g1 in place."""
+def graph_merge(g1: nx.Graph, g2: nx.Graph, change: GraphChange, update_rank: bool = True):
+    """Merge graph g2 into g1 in place. Merging many graphs in a row, only the last merge needs `update_rank`."""
     for node_name, attr in g2.nodes(data=True):
         change.added_updated_nodes.add(node_name)
         if not g1.has_node(node_name):
@@ -219,8 +271,9 @@ def graph_merge(g1: nx.Graph, g2: nx.Graph, change: GraphChange):
         # A edge's source_id indicates which chunks it came from.
         edge["source_id"] += attr["source_id"]
 
-    for node_degree in g1.degree:
-        g1.nodes[str(node_degree[0])]["rank"] = int(node_degree[1])
+    if update_rank:
+        for node_degree in g1.degree:
+            g1.nodes[str(node_degree[0])]["rank"] = int(node_degree[1])
     # A graph's source_id indicates which documents it came from.
     if "source_id" not in g1.graph:
         g1.graph["source_id"] = []
@@ -297,9 +350,7 @@ def chunk_id(chunk):
     return xxhash.xxh64((chunk["content_with_weight"] + chunk["kb_id"]).encode("utf-8")).hexdigest()
 
 
-async def graph_node_to_chunk(kb_id, embd_mdl, ent_name, meta, chunks):
-    global chat_limiter
-    enable_timeout_assertion = os.environ.get("ENABLE_TIMEOUT_ASSERTION")
+def graph_node_chunk(kb_id, ent_name, meta):
     chunk = {
         "id": get_uuid(),
         "important_kwd": [ent_name],
@@ -314,17 +365,12 @@ async def graph_node_to_chunk(kb_id, embd_mdl, ent_name, meta, chunks):
         "available_int": 0,
     }
     chunk["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(chunk["content_ltks"])
-    ebd = get_embed_cache(embd_mdl.llm_name, ent_name)
-    if ebd is None:
-        async with chat_limiter:
-            timeout = 3 if enable_timeout_assertion else 30000000
-            ebd, _ = await asyncio.wait_for(
-                thread_pool_exec(embd_mdl.encode, [ent_name]),
-                timeout=timeout
-            )
-        ebd = ebd[0]
-        set_embed_cache(embd_mdl.llm_name, ent_name, ebd)
-    assert ebd is not None
+    return chunk
+
+
+async def graph_node_to_chunk(kb_id, embd_mdl, ent_name, meta, chunks):
+    chunk = graph_node_chunk(kb_id, ent_name, meta)
+    ebd = (await embed_graph_texts(embd_mdl, [ent_name], [ent_name]))[0]
     chunk["q_%d_vec" % len(ebd)] = ebd
     chunks.append(chunk)
 
@@ -351,8 +397,7 @@ async def get_relation(tenant_id, kb_id, from_ent_name, to_ent_name, size=1):
     return res
 
 
-async def graph_edge_to_chunk(kb_id, embd_mdl, from_ent_name, to_ent_name, meta, chunks):
-    enable_timeout_assertion = os.environ.get("ENABLE_TIMEOUT_ASSERTION")
+def graph_edge_chunk(kb_id, from_ent_name, to_ent_name, meta):
     chunk = {
         "id": get_uuid(),
         "from_entity_kwd": from_ent_name,
@@ -367,23 +412,67 @@ async def graph_edge_to_chunk(kb_id, embd_mdl, from_ent_name, to_ent_name, meta,
         "available_int": 0,
     }
     chunk["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(chunk["content_ltks"])
+    return chunk
+
+
+def graph_edge_embedding_text(from_ent_name, to_ent_name, meta):
+    """
+    The embedding cache key and the text embedded for a relation.
+    """
     txt = f"{from_ent_name}->{to_ent_name}"
-    ebd = get_embed_cache(embd_mdl.llm_name, txt)
-    if ebd is None:
+    return txt, txt + f": {meta['description']}"
+
+
+async def graph_edge_to_chunk(kb_id, embd_mdl, from_ent_name, to_ent_name, meta, chunks):
+    chunk = graph_edge_chunk(kb_id, from_ent_name, to_ent_name, meta)
+    key, txt = graph_edge_embedding_text(from_ent_name, to_ent_name, meta)
+    ebd = (await embed_graph_texts(embd_mdl, [key], [txt]))[0]
+    chunk["q_%d_vec" % len(ebd)] = ebd
+    chunks.append(chunk)
+
+
+async def embed_graph_texts(embd_mdl, keys: list[str], txts: list[str], callback=None) -> list[np.ndarray]:
+    """
+    Embeddings of entities and relations: `txts` are embedded and cached under `keys`. The cache is read
+    with one MGET, then the misses are encoded in batches of EMBEDDING_BATCH_SIZE and written back at once.
+    """
+    global chat_limiter
+    enable_timeout_assertion = os.environ.get("ENABLE_TIMEOUT_ASSERTION")
+    if not keys:
+        return []
+    cached = await thread_pool_exec_in(THREAD_POOL_DOC_STORE, get_embed_cache_batch, embd_mdl.llm_name, keys)
+    vectors = dict((k, v) for k, v in zip(keys, cached) if v is not None)
+    misses = {k: t for k, t in zip(keys, txts) if k not in vectors}
+    miss_keys = list(misses.keys())
+    batch_size = max(1, settings.EMBEDDING_BATCH_SIZE)
+    done = 0
+
+    async def encode(batch):
+        nonlocal done
         async with chat_limiter:
-            timeout = 3 if enable_timeout_assertion else 300000000
-            ebd, _ = await asyncio.wait_for(
-                thread_pool_exec(
-                    embd_mdl.encode,
-                    [txt + f": {meta['description']}"]
-                ),
+            timeout = 3 if enable_timeout_assertion else 30000000
+            ebds, _ = await asyncio.wait_for(
+                thread_pool_exec_in(THREAD_POOL_MODEL, embd_mdl.encode, [misses[k] for k in batch]),
                 timeout=timeout
             )
-        ebd = ebd[0]
-        set_embed_cache(embd_mdl.llm_name, txt, ebd)
-    assert ebd is not None
-    chunk["q_%d_vec" % len(ebd)] = ebd
-    chunks.append(chunk)
+        assert len(ebds) == len(batch)
+        vectors.update(zip(batch, ebds))
+        done += len(batch)
+        if callback:
+            callback(msg=f"Get embedding of entities and relations: {done}/{len(miss_keys)}")
+
+    tasks = [asyncio.create_task(encode(miss_keys[b: b + batch_size])) for b in range(0, len(miss_keys), batch_size)]
+    try:
+        await asyncio.gather(*tasks, return_exceptions=False)
+    except Exception as e:
+        logging.error(f"Error in embed_graph_texts: {e}")
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    await thread_pool_exec_in(THREAD_POOL_DOC_STORE, set_embed_cache_batch, embd_mdl.llm_name, miss_keys,
+                              [vectors[k] for k in miss_keys])
+    return [vectors[k] for k in keys]
 
 
 async def does_graph_contains(tenant_id, kb_id, doc_id):
@@ -393,7 +482,8 @@ async def does_graph_contains(tenant_id, kb_id, doc_id):
         "knowledge_graph_kwd": ["graph"],
         "removed_kwd": "N",
     }
-    res = await thread_pool_exec(
+    res = await thread_pool_exec_in(
+        THREAD_POOL_DOC_STORE,
         settings.docStoreConn.search,
         fields, [], condition, [], OrderByExpr(),
         0, 1, search.index_name(tenant_id), [kb_id]
@@ -416,6 +506,138 @@ async def get_graph_doc_ids(tenant_id, kb_id) -> list[str]:
     return doc_ids
 
 
+def graph_partition_count(num_nodes: int) -> int:
+    """
+    The smallest power of two keeping partitions within GRAPH_PARTITION_NODES nodes. As graphs grow,
+    nodes only move to other partitions when the count doubles.
+    """
+    n = 1
+    while n * GRAPH_PARTITION_NODES < num_nodes:
+        n *= 2
+    return n
+
+
+def graph_partition_of(node_name: str, num_partitions: int) -> int:
+    return xxhash.xxh64_intdigest(str(node_name).encode("utf-8")) % num_partitions
+
+
+def graph_partitions(kb_id: str, graph: nx.Graph) -> tuple[dict, list[str]]:
+    """
+    Split `graph` into the manifest and the node-link JSON of every partition. Nodes go to partitions by
+    name hash and edges go with their first node. Pageranks change with every merge, so they are kept in
+    the manifest and a partition only changes when its own nodes or edges do. The manifest also holds the
+    overview, the subgraph of the GRAPH_OVERVIEW_NODES nodes of highest pagerank.
+    """
+    num_partitions = graph_partition_count(graph.number_of_nodes())
+    parts = [{"nodes": [], "edges": []} for _ in range(num_partitions)]
+    pagerank = {}
+    for node_name, attrs in graph.nodes(data=True):
+        attrs = dict(attrs)
+        if "pagerank" in attrs:
+            pagerank[node_name] = attrs.pop("pagerank")
+        parts[graph_partition_of(node_name, num_partitions)]["nodes"].append({**attrs, "id": node_name})
+    for source, target, attrs in graph.edges(data=True):
+        source, target = get_from_to(source, target)
+        parts[graph_partition_of(source, num_partitions)]["edges"].append({**attrs, "source": source, "target": target})
+
+    contents, partitions = [], []
+    for i, part in enumerate(parts):
+        part["nodes"].sort(key=lambda n: n["id"])
+        part["edges"].sort(key=lambda e: (e["source"], e["target"]))
+        content = json.dumps(part, ensure_ascii=False, sort_keys=True)
+        contents.append(content)
+        partitions.append({
+            "id": xxhash.xxh64(f"{kb_id}:graph_partition:{num_partitions}:{i}".encode("utf-8")).hexdigest(),
+            "hash": xxhash.xxh64(content.encode("utf-8")).hexdigest(),
+            "nodes": len(part["nodes"]),
+            "edges": len(part["edges"]),
+        })
+    manifest = {
+        "format": GRAPH_FORMAT_PARTITIONED,
+        "graph": dict(graph.graph),
+        "partitions": partitions,
+        "pagerank": pagerank,
+        "overview": graph_overview(graph, GRAPH_OVERVIEW_NODES),
+    }
+    return manifest, contents
+
+
+def graph_overview(graph: nx.Graph, max_nodes: int) -> dict:
+    """
+    The node-link data of the `max_nodes` nodes of highest pagerank and the edges among them.
+    """
+    top = sorted(graph.nodes(data="pagerank", default=0), key=lambda n: n[1], reverse=True)[:max_nodes]
+    overview = graph.subgraph([n for n, _ in top]).copy()
+    overview.graph.clear()
+    return json_graph.node_link_data(overview, edges="edges")
+
+
+def graph_from_partitions(manifest: dict, contents: list[str]) -> nx.Graph:
+    """
+    The graph of the given partitions of `manifest`. Edges to nodes of partitions left out are dropped.
+    """
+    graph = nx.Graph()
+    graph.graph.update(manifest.get("graph", {}))
+    edges = []
+    for content in contents:
+        part = json.loads(content)
+        for attrs in part["nodes"]:
+            attrs = dict(attrs)
+            graph.add_node(attrs.pop("id"), **attrs)
+        edges.extend(part["edges"])
+    for attrs in edges:
+        attrs = dict(attrs)
+        source, target = attrs.pop("source"), attrs.pop("target")
+        if graph.has_node(source) and graph.has_node(target):
+            graph.add_edge(source, target, **attrs)
+    nx.set_node_attributes(graph, {n: pr for n, pr in manifest.get("pagerank", {}).items() if graph.has_node(n)}, "pagerank")
+    return graph
+
+
+async def load_graph_partitions(tenant_id, kb_id, manifest: dict, partitions: list[int] | None = None) -> nx.Graph:
+    """
+    Load the given partitions of a partitioned graph, all of them by default. Readers interested in
+    some nodes only load the partitions graph_partition_of them.
+    """
+    parts = manifest["partitions"]
+    ids = [parts[i]["id"] for i in (range(len(parts)) if partitions is None else partitions)]
+    contents = []
+    for b in range(0, len(ids), GRAPH_PARTITION_FETCH_SIZE):
+        batch = ids[b: b + GRAPH_PARTITION_FETCH_SIZE]
+        docs = await thread_pool_exec_in(THREAD_POOL_DOC_STORE, settings.docStoreConn.mget, batch,
+                                         search.index_name(tenant_id), [kb_id])
+        for pid in batch:
+            if pid not in docs:
+                raise Exception(f"Graph partition {pid} of kb {kb_id} is missing.")
+            contents.append(docs[pid]["content_with_weight"])
+    graph = graph_from_partitions(manifest, contents)
+    if partitions is None:
+        _graph_partitions[graph] = parts
+    return graph
+
+
+async def get_graph_overview(tenant_id, kb_id, manifest: dict, max_nodes: int = GRAPH_OVERVIEW_NODES) -> dict:
+    """
+    The node-link data of the `max_nodes` nodes of highest pagerank, which is what graph views show. It
+    is read from the manifest, and partitions are only loaded for manifests saved without an overview
+    or a larger `max_nodes`, to be drilled down into.
+    """
+    overview = manifest.get("overview")
+    if overview is not None:
+        num_nodes = sum(p["nodes"] for p in manifest["partitions"])
+        if len(overview["nodes"]) == min(max_nodes, num_nodes):
+            return overview
+        if len(overview["nodes"]) > max_nodes:
+            return graph_overview(json_graph.node_link_graph(overview, edges="edges"), max_nodes)
+
+    pagerank = manifest.get("pagerank", {})
+    top = sorted(pagerank, key=lambda n: pagerank[n], reverse=True)[:max_nodes]
+    num_partitions = len(manifest["partitions"])
+    partitions = sorted({graph_partition_of(n, num_partitions) for n in top}) if top else None
+    graph = await load_graph_partitions(tenant_id, kb_id, manifest, partitions)
+    return json_graph.node_link_data(graph, edges="edges")
+
+
 async def get_graph(tenant_id, kb_id, exclude_rebuild=None):
     conds = {"fields": ["content_with_weight", "removed_kwd", "source_id"], "size": 1, "knowledge_graph_kwd": ["graph"]}
     res = await settings.retriever.search(conds, search.index_name(tenant_id), [kb_id])
@@ -423,8 +645,17 @@ async def get_graph(tenant_id, kb_id, exclude_rebuild=None):
         for id in res.ids:
             try:
                 if res.field[id]["removed_kwd"] == "N":
-                    g = json_graph.node_link_graph(json.loads(res.field[id]["content_with_weight"]), edges="edges")
-                    if "source_id" not in g.graph:
+                    content = json.loads(res.field[id]["content_with_weight"])
+                    if content.get("format") == GRAPH_FORMAT_PARTITIONED:
+                        try:
+                            g = await load_graph_partitions(tenant_id, kb_id, content)
+                        except Exception:
+                            logging.exception(f"Failed to load the graph partitions of kb {kb_id}, rebuilding it from subgraphs")
+                            g = await rebuild_graph(tenant_id, kb_id, exclude_rebuild)
+                    else:
+                        # A graph saved as a single node-link blob; set_graph or migrate_graph rewrite it partitioned.
+                        g = json_graph.node_link_graph(content, edges="edges")
+                    if g is not None and "source_id" not in g.graph:
                         g.graph["source_id"] = res.field[id]["source_id"]
                 else:
                     g = await rebuild_graph(tenant_id, kb_id, exclude_rebuild)
@@ -435,19 +666,121 @@ async def get_graph(tenant_id, kb_id, exclude_rebuild=None):
     return result
 
 
+async def graph_manifest_chunks(tenant_id: str, kb_id: str, graph: nx.Graph) -> tuple[list[dict], list[dict]]:
+    """
+    The manifest chunk and the chunks of the partitions changed since `graph` was loaded or saved, having
+    deleted the partition chunks they replace. Returns them with the partitions to remember once inserted.
+    """
+    manifest, contents = graph_partitions(kb_id, graph)
+    partitions = manifest["partitions"]
+    if graph in _graph_partitions:
+        old_hashes = {p["id"]: p["hash"] for p in _graph_partitions[graph]}
+        new_ids = {p["id"] for p in partitions}
+        stale = [pid for pid in old_hashes if pid not in new_ids]
+        stale += [p["id"] for p in partitions if p["id"] in old_hashes and old_hashes[p["id"]] != p["hash"]]
+        if stale:
+            await thread_pool_exec_in(THREAD_POOL_DOC_STORE, settings.docStoreConn.delete, {"id": stale},
+                                      search.index_name(tenant_id), kb_id)
+    else:
+        old_hashes = {}
+        await thread_pool_exec_in(THREAD_POOL_DOC_STORE, settings.docStoreConn.delete,
+                                  {"knowledge_graph_kwd": ["graph_partition"]}, search.index_name(tenant_id), kb_id)
+
+    chunks = [
+        {
+            "id": get_uuid(),
+            "content_with_weight": json.dumps(manifest, ensure_ascii=False),
+            "knowledge_graph_kwd": "graph",
+            "kb_id": kb_id,
+            "source_id": graph.graph.get("source_id", []),
+            "available_int": 0,
+            "removed_kwd": "N",
+        }
+    ]
+    for p, content in zip(partitions, contents):
+        if old_hashes.get(p["id"]) == p["hash"]:
+            continue
+        chunks.append(
+            {
+                "id": p["id"],
+                "content_with_weight": content,
+                "knowledge_graph_kwd": "graph_partition",
+                "kb_id": kb_id,
+                "available_int": 0,
+                "removed_kwd": "N",
+            }
+        )
+    return chunks, partitions
+
+
+async def migrate_graph(tenant_id: str, kb_id: str, callback=None) -> bool:
+    """
+    Rewrite a KB graph saved as a single node-link blob into the partitioned layout, leaving entities,
+    relations and subgraphs as they are. set_graph does the same on its next write. Returns whether
+    there was a graph to migrate.
+    """
+    conds = {"fields": ["content_with_weight", "removed_kwd", "source_id"], "size": 1, "knowledge_graph_kwd": ["graph"]}
+    res = await settings.retriever.search(conds, search.index_name(tenant_id), [kb_id])
+    for id in res.ids:
+        if res.field[id]["removed_kwd"] != "N":
+            return False
+        content = json.loads(res.field[id]["content_with_weight"])
+        if content.get("format") == GRAPH_FORMAT_PARTITIONED:
+            return False
+        graph = json_graph.node_link_graph(content, edges="edges")
+        if "source_id" not in graph.graph:
+            graph.graph["source_id"] = res.field[id].get("source_id", [])
+        chunks, partitions = await graph_manifest_chunks(tenant_id, kb_id, graph)
+        await thread_pool_exec_in(THREAD_POOL_DOC_STORE, settings.docStoreConn.insert, chunks[1:],
+                                  search.index_name(tenant_id), kb_id)
+        await thread_pool_exec_in(THREAD_POOL_DOC_STORE, settings.docStoreConn.delete,
+                                  {"knowledge_graph_kwd": ["graph"]}, search.index_name(tenant_id), kb_id)
+        await thread_pool_exec_in(THREAD_POOL_DOC_STORE, settings.docStoreConn.insert, chunks[:1],
+                                  search.index_name(tenant_id), kb_id)
+        if callback:
+            callback(msg=f"Migrated the graph of kb {kb_id} into {len(partitions)} partitions.")
+        return True
+    return False
+
+
 async def set_graph(tenant_id: str, kb_id: str, embd_mdl, graph: nx.Graph, change: GraphChange, callback):
     global chat_limiter
     start = asyncio.get_running_loop().time()
 
-    await thread_pool_exec(
+    # Removals may leave any subgraph stale, otherwise only those of sources of changed nodes and edges are.
+    affected_sources = None
+    if not change.removed_nodes and not change.removed_edges:
+        affected_sources = set()
+        for node_name in change.added_updated_nodes:
+            if graph.has_node(node_name):
+                affected_sources.update(graph.nodes[node_name].get("source_id", []))
+        for from_node, to_node in change.added_updated_edges:
+            for node_name in [from_node, to_node]:
+                if graph.has_node(node_name):
+                    affected_sources.update(graph.nodes[node_name].get("source_id", []))
+
+    await thread_pool_exec_in(
+        THREAD_POOL_DOC_STORE,
         settings.docStoreConn.delete,
-        {"knowledge_graph_kwd": ["graph", "subgraph"]},
+        {"knowledge_graph_kwd": ["graph"]},
         search.index_name(tenant_id),
         kb_id
     )
+    if affected_sources is None or affected_sources:
+        condition = {"knowledge_graph_kwd": ["subgraph"]}
+        if affected_sources is not None:
+            condition["source_id"] = sorted(affected_sources)
+        await thread_pool_exec_in(
+            THREAD_POOL_DOC_STORE,
+            settings.docStoreConn.delete,
+            condition,
+            search.index_name(tenant_id),
+            kb_id
+        )
 
     if change.removed_nodes:
-        await thread_pool_exec(
+        await thread_pool_exec_in(
+            THREAD_POOL_DOC_STORE,
             settings.docStoreConn.delete,
             {"knowledge_graph_kwd": ["entity"], "entity_kwd": sorted(change.removed_nodes)},
             search.index_name(tenant_id),
@@ -458,7 +791,8 @@ async def set_graph(tenant_id: str, kb_id: str, embd_mdl, graph: nx.Graph, chang
 
         async def del_edges(from_node, to_node):
             async with chat_limiter:
-                await thread_pool_exec(
+                await thread_pool_exec_in(
+                    THREAD_POOL_DOC_STORE,
                     settings.docStoreConn.delete,
                     {"knowledge_graph_kwd": ["relation"], "from_entity_kwd": from_node, "to_entity_kwd": to_node},
                     search.index_name(tenant_id),
@@ -483,21 +817,17 @@ async def set_graph(tenant_id: str, kb_id: str, embd_mdl, graph: nx.Graph, chang
         callback(msg=f"set_graph removed {len(change.removed_nodes)} nodes and {len(change.removed_edges)} edges from index in {now - start:.2f}s.")
     start = now
 
-    chunks = [
-        {
-            "id": get_uuid(),
-            "content_with_weight": json.dumps(nx.node_link_data(graph, edges="edges"), ensure_ascii=False),
-            "knowledge_graph_kwd": "graph",
-            "kb_id": kb_id,
-            "source_id": graph.graph.get("source_id", []),
-            "available_int": 0,
-            "removed_kwd": "N",
-        }
-    ]
+    chunks, partitions = await graph_manifest_chunks(tenant_id, kb_id, graph)
 
     # generate updated subgraphs
-    for source in graph.graph["source_id"]:
-        subgraph = graph.subgraph([n for n in graph.nodes if source in graph.nodes[n]["source_id"]]).copy()
+    source_nodes = defaultdict(list)
+    for n, source_ids in graph.nodes(data="source_id", default=[]):
+        for source in source_ids:
+            source_nodes[source].append(n)
+    for source in dict.fromkeys(graph.graph["source_id"]):
+        if affected_sources is not None and source not in affected_sources:
+            continue
+        subgraph = graph.subgraph(source_nodes.get(source, [])).copy()
         subgraph.graph["source_id"] = [source]
         for n in subgraph.nodes:
             subgraph.nodes[n]["source_id"] = [source]
@@ -513,68 +843,55 @@ async def set_graph(tenant_id: str, kb_id: str, embd_mdl, graph: nx.Graph, chang
             }
         )
 
-    tasks = []
-    for ii, node in enumerate(change.added_updated_nodes):
-        node_attrs = graph.nodes[node]
-        tasks.append(asyncio.create_task(
-            graph_node_to_chunk(kb_id, embd_mdl, node, node_attrs, chunks)
-        ))
-        if ii % 100 == 9 and callback:
-            callback(msg=f"Get embedding of nodes: {ii}/{len(change.added_updated_nodes)}")
-    try:
-        await asyncio.gather(*tasks, return_exceptions=False)
-    except Exception as e:
-        logging.error(f"Error in get_embedding_of_nodes: {e}")
-        for t in tasks:
-            t.cancel()
-        await asyncio.gather(*tasks, return_exceptions=True)
-        raise
-
-    tasks = []
-    for ii, (from_node, to_node) in enumerate(change.added_updated_edges):
+    # Entities and relations are embedded together, in batches.
+    graph_chunks, keys, txts = [], [], []
+    for node in change.added_updated_nodes:
+        graph_chunks.append(graph_node_chunk(kb_id, node, graph.nodes[node]))
+        keys.append(node)
+        txts.append(node)
+    for from_node, to_node in change.added_updated_edges:
         edge_attrs = graph.get_edge_data(from_node, to_node)
         if not edge_attrs:
             continue
-        tasks.append(asyncio.create_task(
-            graph_edge_to_chunk(kb_id, embd_mdl, from_node, to_node, edge_attrs, chunks)
-        ))
-        if ii % 100 == 9 and callback:
-            callback(msg=f"Get embedding of edges: {ii}/{len(change.added_updated_edges)}")
-    try:
-        await asyncio.gather(*tasks, return_exceptions=False)
-    except Exception as e:
-        logging.error(f"Error in get_embedding_of_edges: {e}")
-        for t in tasks:
-            t.cancel()
-        await asyncio.gather(*tasks, return_exceptions=True)
-        raise
+        graph_chunks.append(graph_edge_chunk(kb_id, from_node, to_node, edge_attrs))
+        key, txt = graph_edge_embedding_text(from_node, to_node, edge_attrs)
+        keys.append(key)
+        txts.append(txt)
+    ebds = await embed_graph_texts(embd_mdl, keys, txts, callback)
+    for chunk, ebd in zip(graph_chunks, ebds):
+        chunk["q_%d_vec" % len(ebd)] = ebd
+    chunks.extend(graph_chunks)
 
     now = asyncio.get_running_loop().time()
     if callback:
-        callback(msg=f"set_graph converted graph change to {len(chunks)} chunks in {now - start:.2f}s.")
+        callback(msg=f"set_graph converted graph change to {len(chunks)} chunks, embedding {len(keys)} entities and relations, "
+                     f"in {now - start:.2f}s ({len(keys) / max(now - start, 1e-6):.1f}/s).")
     start = now
 
     enable_timeout_assertion = os.environ.get("ENABLE_TIMEOUT_ASSERTION")
-    es_bulk_size = 4
-    for b in range(0, len(chunks), es_bulk_size):
+    bulk_size = max(1, settings.DOC_BULK_SIZE)
+    for b in range(0, len(chunks), bulk_size):
         timeout = 3 if enable_timeout_assertion else 30000000
         doc_store_result = await asyncio.wait_for(
-            thread_pool_exec(
+            thread_pool_exec_in(
+                THREAD_POOL_DOC_STORE,
                 settings.docStoreConn.insert,
-                chunks[b : b + es_bulk_size],
+                chunks[b : b + bulk_size],
                 search.index_name(tenant_id),
                 kb_id
             ),
             timeout=timeout
         )
-        if b % 100 == es_bulk_size and callback:
+        if b // bulk_size % 100 == 1 and callback:
             callback(msg=f"Insert chunks: {b}/{len(chunks)}")
         if doc_store_result:
             error_message = f"Insert chunk error: {doc_store_result}, please check log file and Elasticsearch/Infinity status!"
             raise Exception(error_message)
+    _graph_partitions[graph] = partitions
     now = asyncio.get_running_loop().time()
     if callback:
-        callback(msg=f"set_graph added/updated {len(change.added_updated_nodes)} nodes and {len(change.added_updated_edges)} edges from index in {now - start:.2f}s.")
+        callback(msg=f"set_graph added/updated {len(change.added_updated_nodes)} nodes and {len(change.added_updated_edges)} edges from index, "
+                     f"inserting {len(chunks)} chunks in {now - start:.2f}s ({len(chunks) / max(now - start, 1e-6):.1f}/s).")
 
 
 def is_continuous_subsequence(subseq, seq):
@@ -653,7 +970,8 @@ async def rebuild_graph(tenant_id, kb_id, exclude_rebuild=None):
     flds = ["knowledge_graph_kwd", "content_with_weight", "source_id"]
     bs = 256
     for i in range(0, 1024 * bs, bs):
-        es_res = await thread_pool_exec(
+        es_res = await thread_pool_exec_in(
+            THREAD_POOL_DOC_STORE,
             settings.docStoreConn.search,
             flds, [], {"kb_id": kb_id, "knowledge_graph_kwd": ["subgraph"]},
             [], OrderByExpr(), i, bs, search.index_name(tenant_id), [kb_id]
@@ -21,6 +21,7 @@ from common.query_base import QueryBase
 from common.doc_store.doc_store_base import MatchDenseExpr, MatchTextExpr
 from common.float_utils import get_float
 from rag.nlp import rag_tokenizer, term_weight, synonym
+from rag.utils.query_vector_cache import QUERY_VECTOR_CACHE
 
 
 def get_vector(txt, emb_mdl, topk=10, similarity=0.1):
@@ -30,7 +31,7 @@ def get_vector(txt, emb_mdl, topk=10, similarity=0.1):
         except Exception as e:
             logging.warning(f"Convert similarity '{similarity}' to float failed: {e}. Using default 0.1")
             similarity = 0.1
-    qv, _ = emb_mdl.encode_queries(txt)
+    qv = QUERY_VECTOR_CACHE.encode(emb_mdl, txt)
     shape = np.array(qv).shape
     if len(shape) > 1:
         raise Exception(
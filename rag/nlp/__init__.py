@@ -273,6 +273,20 @@ def tokenize(d, txt, eng):
     d["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(d["content_ltks"])
 
 
+def tokenize_batch(ds, txts, eng):
+    """
+    Same as `tokenize` for every (d, txt) pair, with the tokenizer batch API, which
+    tokenizes repeated texts once and uses the tokenizer process pool, if configured.
+    """
+    from . import rag_tokenizer
+    ts = [re.sub(r"</?(table|td|caption|tr|th)( [^<>]{0,12})?>", " ", txt) for txt in txts]
+    tks = rag_tokenizer.tokenize_batch(ts, fine_grained=True, processes=rag_tokenizer.TOKENIZER_PROCESSES)
+    for d, txt, (ltks, sm_ltks) in zip(ds, txts, tks):
+        d["content_with_weight"] = txt
+        d["content_ltks"] = ltks
+        d["content_sm_ltks"] = sm_ltks
+
+
 def split_with_pattern(d, pattern: str, content: str, eng) -> list:
     docs = []
 
@@ -301,6 +315,7 @@ def split_with_pattern(d, pattern: str, content: str, eng) -> list:
 
 def tokenize_chunks(chunks, doc, eng, pdf_parser=None, child_delimiters_pattern=None):
     res = []
+    pending = []
     # wrap up as es documents
     for ii, ck in enumerate(chunks):
         if len(ck.strip()) == 0:
@@ -322,8 +337,10 @@ def tokenize_chunks(chunks, doc, eng, pdf_parser=None, child_delimiters_pattern=
             res.extend(split_with_pattern(d, child_delimiters_pattern, ck, eng))
             continue
 
-        tokenize(d, ck, eng)
         res.append(d)
+        pending.append((d, ck))
+    if pending:
+        tokenize_batch([d for d, _ in pending], [ck for _, ck in pending], eng)
     return res
 
 
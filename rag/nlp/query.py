@@ -19,6 +19,8 @@ import json
 import re
 from collections import defaultdict
 
+import numpy as np
+
 from common.query_base import QueryBase
 from common.doc_store.doc_store_base import MatchTextExpr
 from rag.nlp import rag_tokenizer, term_weight, synonym
@@ -174,28 +176,69 @@ class FulltextQueryer(QueryBase):
         return None, keywords
 
     def hybrid_similarity(self, avec, bvecs, atks, btkss, tkweight=0.3, vtweight=0.7):
-        from sklearn.metrics.pairwise import cosine_similarity
-        import numpy as np
-
-        sims = cosine_similarity([avec], bvecs)
+        sims = self.vector_similarity(avec, bvecs)
         tksim = self.token_similarity(atks, btkss)
-        if np.sum(sims[0]) == 0:
-            return np.array(tksim), tksim, sims[0]
-        return np.array(sims[0]) * vtweight + np.array(tksim) * tkweight, tksim, sims[0]
+        if np.sum(sims) == 0:
+            return tksim, tksim, sims
+        return sims * vtweight + tksim * tkweight, tksim, sims
+
+    @staticmethod
+    def vector_similarity(avec, bvecs):
+        """
+        Cosine similarity of `avec` to every row of `bvecs`, in one matrix product.
+        Zero vectors get 0, like sklearn's cosine_similarity.
+        """
+        a = np.asarray(avec, dtype=np.float32).ravel()
+        b = np.asarray(bvecs, dtype=np.float32)
+        if len(b) == 0:
+            return np.zeros(0)
+        b = b.reshape(len(b), -1)
+        norms = np.linalg.norm(b, axis=1) * np.linalg.norm(a)
+        sims = np.divide(b @ a, norms, out=np.zeros(len(b), dtype=np.float32), where=norms > 0)
+        return sims.astype(np.float64)
+
+    @staticmethod
+    def vector_similarity_matrix(avecs, bvecs):
+        """
+        Cosine similarity of every row of `avecs` to every row of `bvecs`, in one matrix product.
+        Zero vectors get 0.
+        """
+        a = np.asarray(avecs, dtype=np.float32)
+        b = np.asarray(bvecs, dtype=np.float32)
+        if len(a) == 0 or len(b) == 0:
+            return np.zeros((len(a), len(b)))
+        a = a.reshape(len(a), -1)
+        b = b.reshape(len(b), -1)
+        norms = np.outer(np.linalg.norm(a, axis=1), np.linalg.norm(b, axis=1))
+        sims = np.divide(a @ b.T, norms, out=np.zeros(norms.shape, dtype=np.float32), where=norms > 0)
+        return sims.astype(np.float64)
 
     def token_similarity(self, atks, btkss):
-        def to_dict(tks):
+        """
+        `similarity` of the query tokens to each candidate's tokens.
+
+        `similarity` only adds up query term weights, so the candidates are never
+        weighted: the query tokens get term ids, each candidate is reduced to the
+        ids of the query tokens it contains, and the scores are one weighted bincount.
+        """
+        if isinstance(atks, str):
+            atks = atks.split()
+        qtwt = defaultdict(int)
+        for t, c in self.tw.weights(atks, preprocess=False):
+            qtwt[t] += c
+        term_ids = {t: i for i, t in enumerate(qtwt.keys())}
+        wts = np.fromiter(qtwt.values(), dtype=np.float64, count=len(qtwt))
+
+        rows, cols = [], []
+        for i, tks in enumerate(btkss):
             if isinstance(tks, str):
                 tks = tks.split()
-            d = defaultdict(int)
-            wts = self.tw.weights(tks, preprocess=False)
-            for i, (t, c) in enumerate(wts):
-                d[t] += c
-            return d
-
-        atks = to_dict(atks)
-        btkss = [to_dict(tks) for tks in btkss]
-        return [self.similarity(atks, btks) for btks in btkss]
+            for j in {term_ids[t] for t in tks if t in term_ids}:
+                rows.append(i)
+                cols.append(j)
+        s = np.bincount(np.asarray(rows, dtype=np.int64), weights=wts[np.asarray(cols, dtype=np.int64)],
+                        minlength=len(btkss))
+        return (s + 1e-9) / (np.sum(wts) + 1e-9)
 
     def similarity(self, qtwt, dtwt):
         if isinstance(dtwt, type("")):
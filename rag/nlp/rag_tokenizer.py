@@ -14,23 +14,105 @@
 #  limitations under the License.
 #
 
+import functools
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
 import infinity.rag_tokenizer
 from common import settings
 
+# Strings up to TOKENIZER_CACHE_MAX_LEN characters (titles, keywords, questions, query terms)
+# are memoized; longer ones are tokenized every time.
+TOKENIZER_CACHE_SIZE = int(os.environ.get("TOKENIZER_CACHE_SIZE", 65536))
+TOKENIZER_CACHE_MAX_LEN = int(os.environ.get("TOKENIZER_CACHE_MAX_LEN", 256))
+# Worker processes used by the batch API when asked to, 0 keeps everything in-process.
+TOKENIZER_PROCESSES = int(os.environ.get("TOKENIZER_PROCESSES", 0))
+# Batches with less text than this are not worth shipping to the process pool.
+TOKENIZER_PROCESS_MIN_CHARS = int(os.environ.get("TOKENIZER_PROCESS_MIN_CHARS", 200000))
+
 
 class RagTokenizer(infinity.rag_tokenizer.RagTokenizer):
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cached_tokenize = functools.lru_cache(maxsize=TOKENIZER_CACHE_SIZE)(super().tokenize)
+        self._cached_fine_grained_tokenize = functools.lru_cache(maxsize=TOKENIZER_CACHE_SIZE)(
+            super().fine_grained_tokenize)
+
     def tokenize(self, line: str) -> str:
         if settings.DOC_ENGINE_INFINITY:
             return line
-        else:
-            return super().tokenize(line)
+        if len(line) <= TOKENIZER_CACHE_MAX_LEN:
+            return self._cached_tokenize(line)
+        return super().tokenize(line)
 
     def fine_grained_tokenize(self, tks: str) -> str:
         if settings.DOC_ENGINE_INFINITY:
             return tks
+        if len(tks) <= TOKENIZER_CACHE_MAX_LEN:
+            return self._cached_fine_grained_tokenize(tks)
+        return super().fine_grained_tokenize(tks)
+
+    def tokenize_batch(self, lines: list[str], fine_grained: bool = False, processes: int = 0):
+        """
+        Tokenize a list of strings, each distinct string once.
+
+        Returns the list of `tokenize` results or, with `fine_grained`, a list of
+        (tokens, fine grained tokens) pairs. With `processes` > 1 a large batch is
+        spread over a pool of worker processes, which is meant for ingestion.
+        """
+        if settings.DOC_ENGINE_INFINITY:
+            return [(line, line) if fine_grained else line for line in lines]
+        uniq = list(dict.fromkeys(lines))
+        if processes > 1 and len(uniq) > 1 and sum(len(line) for line in uniq) >= TOKENIZER_PROCESS_MIN_CHARS:
+            pool = _process_pool(processes)
+            chunksize = max(1, len(uniq) // (processes * 4))
+            res = list(pool.map(_tokenize_in_worker, uniq, [fine_grained] * len(uniq), chunksize=chunksize))
         else:
-            return super().fine_grained_tokenize(tks)
+            res = []
+            for line in uniq:
+                tks = self.tokenize(line)
+                res.append((tks, self.fine_grained_tokenize(tks)) if fine_grained else tks)
+        res = dict(zip(uniq, res))
+        return [res[line] for line in lines]
+
+    def fine_grained_tokenize_batch(self, tks_list: list[str]) -> list[str]:
+        res = {tks: self.fine_grained_tokenize(tks) for tks in dict.fromkeys(tks_list)}
+        return [res[tks] for tks in tks_list]
+
+    def cache_stats(self) -> dict:
+        return {
+            "tokenize": self._cached_tokenize.cache_info()._asdict(),
+            "fine_grained_tokenize": self._cached_fine_grained_tokenize.cache_info()._asdict(),
+        }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_worker_tokenizer = None
+
+
+def _process_pool(processes: int) -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            logging.info(f"Start {processes} tokenizer processes")
+            _pool = ProcessPoolExecutor(max_workers=processes)
+        return _pool
+
+
+def _tokenize_in_worker(line: str, fine_grained: bool):
+    # Workers never see DOC_ENGINE_INFINITY, which the caller already checked,
+    # so they run the base tokenizer directly.
+    global _worker_tokenizer
+    if _worker_tokenizer is None:
+        _worker_tokenizer = infinity.rag_tokenizer.RagTokenizer()
+    tks = _worker_tokenizer.tokenize(line)
+    if fine_grained:
+        return tks, _worker_tokenizer.fine_grained_tokenize(tks)
+    return tks
 
 
 def is_chinese(s):
@@ -52,6 +134,8 @@ def naive_qie(txt):
 tokenizer = RagTokenizer()
 tokenize = tokenizer.tokenize
 fine_grained_tokenize = tokenizer.fine_grained_tokenize
+tokenize_batch = tokenizer.tokenize_batch
+fine_grained_tokenize_batch = tokenizer.fine_grained_tokenize_batch
 tag = tokenizer.tag
 freq = tokenizer.freq
 tradi2simp = tokenizer._tradi2simp
@@ -17,7 +17,7 @@ import json
 import logging
 import re
 import math
-from collections import OrderedDict, defaultdict
+from collections import defaultdict
 from dataclasses import dataclass
 
 from rag.prompts.generator import relevant_chunks_with_toc
@@ -29,12 +29,31 @@ from common.float_utils import get_float
 from common.constants import PAGERANK_FLD, TAG_FLD
 from common import settings
 
-from common.misc_utils import thread_pool_exec
+from common.misc_utils import thread_pool_exec_in, THREAD_POOL_DOC_STORE
+from rag.utils.query_vector_cache import QUERY_VECTOR_CACHE
+from rag.utils.retrieval_cache import RETRIEVAL_CACHE
 
 def index_name(uid): return f"ragflow_{uid}"
 
 
+def parse_vector(vector: str) -> np.ndarray:
+    """
+    Parse a tab separated vector as stored by some doc engines.
+    """
+    try:
+        return np.array(vector.split("\t"), dtype=np.float32)
+    except ValueError:
+        return np.array([get_float(v) for v in vector.split("\t")], dtype=np.float32)
+
+
 class Dealer:
+    SEARCH_FIELDS = ["docnm_kwd", "content_ltks", "kb_id", "img_id", "title_tks", "important_kwd", "position_int",
+                     "doc_id", "page_num_int", "top_int", "create_timestamp_flt", "knowledge_graph_kwd",
+                     "question_kwd", "question_tks", "doc_type_kwd",
+                     "available_int", "content_with_weight", "mom_id", PAGERANK_FLD, TAG_FLD]
+    # Fields read only by the ranking in Python, left out of lean searches that don't rank there.
+    RANKING_FIELDS = ["content_ltks", "title_tks", "question_tks", TAG_FLD]
+
     def __init__(self, dataStore: DocStoreConnection):
         self.qryr = query.FulltextQueryer()
         self.dataStore = dataStore
@@ -51,7 +70,11 @@ class Dealer:
         group_docs: list[list] | None = None
 
     async def get_vector(self, txt, emb_mdl, topk=10, similarity=0.1):
-        qv, _ = await thread_pool_exec(emb_mdl.encode_queries, txt)
+        qv = await QUERY_VECTOR_CACHE.async_encode(emb_mdl, txt)
+        return self._match_dense(qv, topk, similarity)
+
+    @staticmethod
+    def _match_dense(qv, topk=10, similarity=0.1):
         shape = np.array(qv).shape
         if len(shape) > 1:
             raise Exception(
@@ -89,11 +112,7 @@ class Dealer:
         ps = int(req.get("size", topk))
         offset, limit = pg * ps, ps
 
-        src = req.get("fields",
-                      ["docnm_kwd", "content_ltks", "kb_id", "img_id", "title_tks", "important_kwd", "position_int",
-                       "doc_id", "page_num_int", "top_int", "create_timestamp_flt", "knowledge_graph_kwd",
-                       "question_kwd", "question_tks", "doc_type_kwd",
-                       "available_int", "content_with_weight", "mom_id", PAGERANK_FLD, TAG_FLD])
+        src = list(req.get("fields", self.SEARCH_FIELDS))
         kwds = set([])
 
         qst = req.get("question", "")
@@ -115,20 +134,20 @@ class Dealer:
             matchText, keywords = self.qryr.question(qst, min_match=0.3)
             if emb_mdl is None:
                 matchExprs = [matchText]
-                res = await thread_pool_exec(self.dataStore.search, src, highlightFields, filters, matchExprs, orderBy, offset, limit,
+                res = await thread_pool_exec_in(THREAD_POOL_DOC_STORE, self.dataStore.search, src, highlightFields, filters, matchExprs, orderBy, offset, limit,
                                             idx_names, kb_ids, rank_feature=rank_feature)
                 total = self.dataStore.get_total(res)
                 logging.debug("Dealer.search TOTAL: {}".format(total))
             else:
                 matchDense = await self.get_vector(qst, emb_mdl, topk, req.get("similarity", 0.1))
                 q_vec = matchDense.embedding_data
-                if not settings.DOC_ENGINE_INFINITY:
+                if req.get("vector", True) and not settings.DOC_ENGINE_INFINITY:
                     src.append(f"q_{len(q_vec)}_vec")
 
                 fusionExpr = FusionExpr("weighted_sum", topk, {"weights": "0.05,0.95"})
                 matchExprs = [matchText, matchDense, fusionExpr]
 
-                res = await thread_pool_exec(self.dataStore.search, src, highlightFields, filters, matchExprs, orderBy, offset, limit,
+                res = await thread_pool_exec_in(THREAD_POOL_DOC_STORE, self.dataStore.search, src, highlightFields, filters, matchExprs, orderBy, offset, limit,
                                             idx_names, kb_ids, rank_feature=rank_feature)
                 total = self.dataStore.get_total(res)
                 logging.debug("Dealer.search TOTAL: {}".format(total))
@@ -136,27 +155,36 @@ class Dealer:
                 # If result is empty, try again with lower min_match
                 if total == 0:
                     if filters.get("doc_id"):
-                        res = await thread_pool_exec(self.dataStore.search, src, [], filters, [], orderBy, offset, limit, idx_names, kb_ids)
+                        res = await thread_pool_exec_in(THREAD_POOL_DOC_STORE, self.dataStore.search, src, [], filters, [], orderBy, offset, limit, idx_names, kb_ids)
                         total = self.dataStore.get_total(res)
                     else:
                         matchText, _ = self.qryr.question(qst, min_match=0.1)
                         matchDense.extra_options["similarity"] = 0.17
-                        res = await thread_pool_exec(self.dataStore.search, src, highlightFields, filters, [matchText, matchDense, fusionExpr],
+                        res = await thread_pool_exec_in(THREAD_POOL_DOC_STORE, self.dataStore.search, src, highlightFields, filters, [matchText, matchDense, fusionExpr],
                                                     orderBy, offset, limit, idx_names, kb_ids,
                                                     rank_feature=rank_feature)
                         total = self.dataStore.get_total(res)
                     logging.debug("Dealer.search 2 TOTAL: {}".format(total))
 
-            for k in keywords:
-                kwds.add(k)
-                for kk in rag_tokenizer.fine_grained_tokenize(k).split():
-                    if len(kk) < 2:
-                        continue
-                    if kk in kwds:
-                        continue
-                    kwds.add(kk)
+            kwds = self._expand_keywords(keywords)
 
         logging.debug(f"TOTAL: {total}")
+        return self._search_result(res, total, src, q_vec, kwds)
+
+    @staticmethod
+    def _expand_keywords(keywords) -> set:
+        kwds = set([])
+        for k, sm_k in zip(keywords, rag_tokenizer.fine_grained_tokenize_batch(keywords)):
+            kwds.add(k)
+            for kk in sm_k.split():
+                if len(kk) < 2:
+                    continue
+                if kk in kwds:
+                    continue
+                kwds.add(kk)
+        return kwds
+
+    def _search_result(self, res, total, src, q_vec, kwds):
         ids = self.dataStore.get_doc_ids(res)
         keywords = list(kwds)
         highlight = self.dataStore.get_highlight(res, keywords, "content_with_weight")
@@ -171,6 +199,66 @@ class Dealer:
             keywords=keywords
         )
 
+    async def batch_search(self, reqs: list[dict], idx_names: str | list[str], kb_ids: list[str], emb_mdl,
+                           highlight: bool | list | None = None, rank_feature: dict | list[dict] | None = None):
+        """
+        `search` of several questions at once: they are embedded together and searched in one
+        doc store msearch round trip. Questions without any hit are searched again with the match
+        relaxed as `search` does, together in one more msearch. `rank_feature` is either shared or
+        one per request.
+        """
+        rank_features = rank_feature if isinstance(rank_feature, list) else [rank_feature] * len(reqs)
+        if emb_mdl is None:
+            return [await self.search(req, idx_names, kb_ids, emb_mdl, highlight, rank_feature=rf)
+                    for req, rf in zip(reqs, rank_features)]
+        highlightFields = ["content_ltks", "title_tks"]
+        if not highlight:
+            highlightFields = []
+        elif isinstance(highlight, list):
+            highlightFields = highlight
+        qvs = await QUERY_VECTOR_CACHE.async_encode_batch(emb_mdl, [req["question"] for req in reqs])
+
+        searches, prepared = [], []
+        for req, qv, rf in zip(reqs, qvs, rank_features):
+            topk = int(req.get("topk", 1024))
+            ps = int(req.get("size", topk))
+            offset = (int(req.get("page", 1)) - 1) * ps
+            src = list(req.get("fields", self.SEARCH_FIELDS))
+            matchText, keywords = self.qryr.question(req["question"], min_match=0.3)
+            matchDense = self._match_dense(qv, topk, req.get("similarity", 0.1))
+            if req.get("vector", True) and not settings.DOC_ENGINE_INFINITY:
+                src.append(f"q_{len(matchDense.embedding_data)}_vec")
+            fusionExpr = FusionExpr("weighted_sum", topk, {"weights": "0.05,0.95"})
+            filters = self.get_filters(req)
+            searches.append([src, highlightFields, filters, [matchText, matchDense, fusionExpr],
+                             OrderByExpr(), offset, ps, idx_names, kb_ids, [], rf])
+            prepared.append((src, matchDense, keywords))
+
+        results = await thread_pool_exec_in(THREAD_POOL_DOC_STORE, self.dataStore.msearch, searches)
+        totals = [self.dataStore.get_total(res) for res in results]
+
+        # Retry the searches without any hit with a lower min_match, as `search` does
+        empty = [i for i, total in enumerate(totals) if total == 0]
+        if empty:
+            retries = []
+            for i in empty:
+                src, highlightFields, filters, (_, matchDense, fusionExpr), orderBy, offset, ps = searches[i][:7]
+                if filters.get("doc_id"):
+                    retries.append([src, [], filters, [], orderBy, offset, ps, idx_names, kb_ids, [], None])
+                else:
+                    matchText, _ = self.qryr.question(reqs[i]["question"], min_match=0.1)
+                    matchDense.extra_options["similarity"] = 0.17
+                    retries.append([src, highlightFields, filters, [matchText, matchDense, fusionExpr], orderBy, offset, ps,
+                                    idx_names, kb_ids, [], searches[i][10]])
+            retried = await thread_pool_exec_in(THREAD_POOL_DOC_STORE, self.dataStore.msearch, retries)
+            for i, res in zip(empty, retried):
+                results[i] = res
+                totals[i] = self.dataStore.get_total(res)
+                logging.debug("Dealer.batch_search 2 TOTAL: {}".format(totals[i]))
+
+        return [self._search_result(res, total, src, matchDense.embedding_data, self._expand_keywords(keywords))
+                for res, total, (src, matchDense, keywords) in zip(results, totals, prepared)]
+
     @staticmethod
     def trans2floats(txt):
         return [get_float(t) for t in txt.split("\t")]
@@ -227,24 +315,28 @@ class Dealer:
         assert len(ans_v[0]) == len(chunk_v[0]), "The dimension of query and chunk do not match: {} vs. {}".format(
             len(ans_v[0]), len(chunk_v[0]))
 
-        chunks_tks = [rag_tokenizer.tokenize(self.qryr.rmWWW(ck)).split()
-                      for ck in chunks]
+        # One sentence x chunk similarity matrix serves every threshold. Chunks come as the tokens of
+        # the retrieval step, which are only split here, and pieces are tokenized only when token
+        # similarity counts: with a token weight, or for pieces whose vector similarities are all 0.
+        vtsim = self.qryr.vector_similarity_matrix(ans_v, chunk_v)
+        no_vtsim = np.sum(vtsim, axis=1) == 0
+        sim = vtsim * vtweight
+        if tkweight > 0 or no_vtsim.any():
+            chunks_tks = [ck.split() if isinstance(ck, str) else ck for ck in chunks]
+            pieces_tks = [tks.split() for tks in rag_tokenizer.tokenize_batch([self.qryr.rmWWW(p) for p in pieces_])]
+            tksim = np.array([self.qryr.token_similarity(tks, chunks_tks) for tks in pieces_tks])
+            sim = np.where(no_vtsim[:, None], tksim, sim + tksim * tkweight)
+        mx = np.max(sim, axis=1) * 0.99
+        logging.debug("{} SIM: {}".format(pieces_, mx))
+
         cites = {}
         thr = 0.63
-        while thr > 0.3 and len(cites.keys()) == 0 and pieces_ and chunks_tks:
-            for i, a in enumerate(pieces_):
-                sim, tksim, vtsim = self.qryr.hybrid_similarity(ans_v[i],
-                                                                chunk_v,
-                                                                rag_tokenizer.tokenize(
-                                                                    self.qryr.rmWWW(pieces_[i])).split(),
-                                                                chunks_tks,
-                                                                tkweight, vtweight)
-                mx = np.max(sim) * 0.99
-                logging.debug("{} SIM: {}".format(pieces_[i], mx))
-                if mx < thr:
-                    continue
-                cites[idx[i]] = list(
-                    set([str(ii) for ii in range(len(chunk_v)) if sim[ii] > mx]))[:4]
+        while thr > 0.3:
+            cited = np.flatnonzero(mx >= thr)
+            if len(cited):
+                for i in cited:
+                    cites[idx[i]] = [str(ii) for ii in np.flatnonzero(sim[i] > mx[i])][:4]
+                break
             thr *= 0.8
 
         res = ""
@@ -299,26 +391,25 @@ class Dealer:
         _, keywords = self.qryr.question(query)
         vector_size = len(sres.query_vector)
         vector_column = f"q_{vector_size}_vec"
-        zero_vector = [0.0] * vector_size
-        ins_embd = []
-        for chunk_id in sres.ids:
-            vector = sres.field[chunk_id].get(vector_column, zero_vector)
-            if isinstance(vector, str):
-                vector = [get_float(v) for v in vector.split("\t")]
-            ins_embd.append(vector)
-        if not ins_embd:
+        if not sres.ids:
             return [], [], []
+        ins_embd = np.zeros((len(sres.ids), vector_size), dtype=np.float32)
+        for i, chunk_id in enumerate(sres.ids):
+            vector = sres.field[chunk_id].get(vector_column)
+            if vector is None:
+                continue
+            ins_embd[i] = parse_vector(vector) if isinstance(vector, str) else vector
 
         for i in sres.ids:
             if isinstance(sres.field[i].get("important_kwd", []), str):
                 sres.field[i]["important_kwd"] = [sres.field[i]["important_kwd"]]
+        # Only which tokens a chunk has matters to token_similarity, not how often.
         ins_tw = []
         for i in sres.ids:
-            content_ltks = list(OrderedDict.fromkeys(sres.field[i][cfield].split()))
-            title_tks = [t for t in sres.field[i].get("title_tks", "").split() if t]
-            question_tks = [t for t in sres.field[i].get("question_tks", "").split() if t]
-            important_kwd = sres.field[i].get("important_kwd", [])
-            tks = content_ltks + title_tks * 2 + important_kwd * 5 + question_tks * 6
+            tks = set(sres.field[i][cfield].split())
+            tks.update(sres.field[i].get("title_tks", "").split())
+            tks.update(sres.field[i].get("important_kwd", []))
+            tks.update(sres.field[i].get("question_tks", "").split())
             ins_tw.append(tks)
 
         ## For rank feature(tag_fea) scores.
@@ -376,14 +467,101 @@ class Dealer:
             rerank_mdl=None,
             highlight=False,
             rank_feature: dict | None = {PAGERANK_FLD: 10},
+            lean=False,
     ):
-        ranks = {"total": 0, "chunks": [], "doc_aggs": {}}
+        """
+        With `lean`, chunks come without `vector` and `content_ltks`, and the doc store is only asked
+        for the vectors and tokens the ranking reads. `fill_citation_fields` fetches them for the
+        returned chunks when citations are inserted.
+        """
+        if isinstance(tenant_ids, str):
+            tenant_ids = tenant_ids.split(",")
+        cache_key = None
+        if RETRIEVAL_CACHE.enabled and question and getattr(embd_mdl, "llm_name", None):
+            cache_key = RETRIEVAL_CACHE.key(tenant_ids, kb_ids, question, {
+                "doc_ids": sorted(doc_ids) if doc_ids else None,
+                "page": page,
+                "page_size": page_size,
+                "similarity_threshold": similarity_threshold,
+                "vector_similarity_weight": vector_similarity_weight,
+                "top": top,
+                "aggs": aggs,
+                "highlight": highlight,
+                "rank_feature": rank_feature,
+                "embd_mdl": embd_mdl.llm_name,
+                "rerank_mdl": getattr(rerank_mdl, "llm_name", None) if rerank_mdl else None,
+                "lean": lean,
+            })
+            if cache_key:
+                ranks = RETRIEVAL_CACHE.get(cache_key)
+                if ranks is not None:
+                    return ranks
+
+        ranks = await self._retrieval(question, embd_mdl, tenant_ids, kb_ids, page, page_size, similarity_threshold,
+                                      vector_similarity_weight, top, doc_ids, aggs, rerank_mdl, highlight, rank_feature,
+                                      lean)
+        if cache_key:
+            RETRIEVAL_CACHE.put(cache_key, ranks)
+        return ranks
+
+    async def _retrieval(self, question, embd_mdl, tenant_ids, kb_ids, page, page_size, similarity_threshold,
+                         vector_similarity_weight, top, doc_ids, aggs, rerank_mdl, highlight, rank_feature, lean=False):
         if not question:
-            return ranks
+            return {"total": 0, "chunks": [], "doc_aggs": []}
+
+        req = self._retrieval_request(question, kb_ids, page, page_size, similarity_threshold, top, doc_ids,
+                                      rerank_mdl, lean)
+        sres = await self.search(req, [index_name(tid) for tid in tenant_ids], kb_ids, embd_mdl, highlight,
+                           rank_feature=rank_feature)
+        return self._ranks(sres, question, page, page_size, similarity_threshold, vector_similarity_weight, aggs,
+                           rerank_mdl, highlight, rank_feature, lean)
+
+    async def batch_retrieval(
+            self,
+            questions: list[str],
+            embd_mdl,
+            tenant_ids,
+            kb_ids,
+            page,
+            page_size,
+            similarity_threshold=0.2,
+            vector_similarity_weight=0.3,
+            top=1024,
+            doc_ids=None,
+            aggs=True,
+            rerank_mdl=None,
+            highlight=False,
+            rank_feature: dict | list[dict] | None = {PAGERANK_FLD: 10},
+            lean=False,
+    ) -> list[dict]:
+        """
+        `retrieval` of several questions against the same knowledge bases, with one embedding
+        step and one doc store round trip for all of them. `rank_feature` is either shared or
+        one per question. Returns one result per question.
+        """
+        if isinstance(tenant_ids, str):
+            tenant_ids = tenant_ids.split(",")
+        rank_features = rank_feature if isinstance(rank_feature, list) else [rank_feature] * len(questions)
+        todo = [i for i, q in enumerate(questions) if q]
+        reqs = [self._retrieval_request(questions[i], kb_ids, page, page_size, similarity_threshold, top, doc_ids,
+                                        rerank_mdl, lean) for i in todo]
+        sreses = await self.batch_search(reqs, [index_name(tid) for tid in tenant_ids], kb_ids, embd_mdl, highlight,
+                                         rank_feature=[rank_features[i] for i in todo])
+        res = [{"total": 0, "chunks": [], "doc_aggs": []} for _ in questions]
+        for i, sres in zip(todo, sreses):
+            res[i] = self._ranks(sres, questions[i], page, page_size, similarity_threshold, vector_similarity_weight,
+                                 aggs, rerank_mdl, highlight, rank_features[i], lean)
+        return res
 
+    @staticmethod
+    def _rerank_limit(page_size):
         # Ensure RERANK_LIMIT is multiple of page_size
         RERANK_LIMIT = math.ceil(64 / page_size) * page_size if page_size > 1 else 1
-        RERANK_LIMIT = max(30, RERANK_LIMIT)
+        return max(30, RERANK_LIMIT)
+
+    def _retrieval_request(self, question, kb_ids, page, page_size, similarity_threshold, top, doc_ids,
+                           rerank_mdl=None, lean=False) -> dict:
+        RERANK_LIMIT = self._rerank_limit(page_size)
         req = {
             "kb_ids": kb_ids,
             "doc_ids": doc_ids,
@@ -395,12 +573,20 @@ class Dealer:
             "similarity": similarity_threshold,
             "available_int": 1,
         }
-
-        if isinstance(tenant_ids, str):
-            tenant_ids = tenant_ids.split(",")
-
-        sres = await self.search(req, [index_name(tid) for tid in tenant_ids], kb_ids, embd_mdl, highlight,
-                           rank_feature=rank_feature)
+        if lean:
+            # Only the hybrid rerank below needs the vectors of all candidates; the reranking model
+            # needs their tokens, and Infinity fuses the scores itself and needs neither.
+            req["vector"] = not rerank_mdl and not settings.DOC_ENGINE_INFINITY
+            if rerank_mdl:
+                req["fields"] = [f for f in self.SEARCH_FIELDS if f != "question_tks"]
+            elif settings.DOC_ENGINE_INFINITY:
+                req["fields"] = [f for f in self.SEARCH_FIELDS if f not in self.RANKING_FIELDS]
+        return req
+
+    def _ranks(self, sres, question, page, page_size, similarity_threshold, vector_similarity_weight, aggs,
+               rerank_mdl, highlight, rank_feature, lean=False) -> dict:
+        ranks = {"total": 0, "chunks": [], "doc_aggs": {}}
+        RERANK_LIMIT = self._rerank_limit(page_size)
 
         if rerank_mdl and sres.total > 0:
             sim, tsim, vsim = self.rerank_by_model(
@@ -462,7 +648,7 @@ class Dealer:
             position_int = chunk.get("position_int", [])
             d = {
                 "chunk_id": id,
-                "content_ltks": chunk["content_ltks"],
+                "content_ltks": chunk.get("content_ltks", ""),
                 "content_with_weight": chunk["content_with_weight"],
                 "doc_id": did,
                 "docnm_kwd": dnm,
@@ -477,6 +663,9 @@ class Dealer:
                 "doc_type_kwd": chunk.get("doc_type_kwd", ""),
                 "mom_id": chunk.get("mom_id", ""),
             }
+            if lean:
+                del d["content_ltks"]
+                del d["vector"]
             if highlight and sres.highlight:
                 if id in sres.highlight:
                     d["highlight"] = remove_redundant_spaces(sres.highlight[id])
@@ -510,6 +699,32 @@ class Dealer:
 
         return ranks
 
+    def fill_citation_fields(self, chunks: list[dict], tenant_ids: str | list[str]) -> list[dict]:
+        """
+        Fetch by id the `content_ltks` and `vector` that insert_citations needs for chunks of a lean
+        retrieval. Chunks having both are left untouched; if the fetch fails, they get empty ones.
+        """
+        if isinstance(tenant_ids, str):
+            tenant_ids = tenant_ids.split(",")
+        missing = [ck for ck in chunks if ck.get("chunk_id") and ("vector" not in ck or "content_ltks" not in ck)]
+        if not missing:
+            return chunks
+        kb_ids = list(dict.fromkeys(ck["kb_id"] for ck in missing if ck.get("kb_id")))
+        try:
+            docs = self.dataStore.mget([ck["chunk_id"] for ck in missing], [index_name(tid) for tid in tenant_ids],
+                                       kb_ids)
+        except Exception:
+            logging.exception("Dealer.fill_citation_fields got exception")
+            docs = {}
+        for ck in missing:
+            doc = docs.get(ck["chunk_id"]) or {}
+            ck.setdefault("content_ltks", doc.get("content_ltks", ""))
+            vector = next((doc[k] for k in sorted(doc) if re.fullmatch(r"q_[0-9]+_vec", k)), None)
+            if isinstance(vector, str):
+                vector = parse_vector(vector)
+            ck.setdefault("vector", [] if vector is None else [get_float(v) for v in vector])
+        return chunks
+
     def sql_retrieval(self, sql, fetch_size=128, format="json"):
         tbl = self.dataStore.sql(sql, fetch_size, format)
         return tbl
@@ -678,7 +893,8 @@ class Dealer:
             chunk = self.dataStore.get(id, idx_nms, [ck["kb_id"] for ck in cks])
             d = {
                 "chunk_id": id,
-                "content_ltks": " ".join([ck["content_ltks"] for ck in cks]),
+                "content_ltks": " ".join([ck["content_ltks"] for ck in cks])
+                if all("content_ltks" in ck for ck in cks) else chunk.get("content_ltks", ""),
                 "content_with_weight": chunk["content_with_weight"],
                 "doc_id": chunk["doc_id"],
                 "docnm_kwd": chunk.get("docnm_kwd", ""),
@@ -14,15 +14,20 @@
 #  limitations under the License.
 #
 
+import functools
 import logging
 import math
 import json
 import re
 import os
+import time
 import numpy as np
 from rag.nlp import rag_tokenizer
 from common.file_utils import get_project_base_directory
 
+TERM_WEIGHT_CACHE_SIZE = int(os.environ.get("TERM_WEIGHT_CACHE_SIZE", 100000))
+TERM_WEIGHT_PRECOMPUTE = os.environ.get("TERM_WEIGHT_PRECOMPUTE", "0").lower() in ["1", "true", "yes"]
+
 
 class Dealer:
     def __init__(self):
@@ -89,6 +94,16 @@ class Dealer:
         except Exception:
             logging.warning("Load term.freq FAIL!")
 
+        self._num_pattern = re.compile(r"[0-9,.]{2,}$")
+        self._short_letter_pattern = re.compile(r"[a-z]{1,2}$")
+        self._num_space_pattern = re.compile(r"[0-9. -]{2,}$")
+        self._letter_pattern = re.compile(r"[a-z. -]+$")
+        # A token's weight before normalization only depends on the token.
+        self._cached_token_weight = functools.lru_cache(maxsize=TERM_WEIGHT_CACHE_SIZE)(self._compute_token_weight)
+        self._vocab_ids, self._vocab_wts, self._vocab_hits = {}, None, 0
+        if TERM_WEIGHT_PRECOMPUTE:
+            self.precompute_vocabulary()
+
     def pretoken(self, txt, num=False, stpwd=True):
         patt = [
             r"[~—\t @#%!<>,\.\?\":;'\{\}\[\]_=\(\)\|，。？》•●○↓《；‘’：“”【¥ 】…￥！、·（）×`&\\/「」\\]"
@@ -160,87 +175,112 @@ class Dealer:
                 tks.append(t)
         return tks
 
-    def weights(self, tks, preprocess=True):
-        num_pattern = re.compile(r"[0-9,.]{2,}$")
-        short_letter_pattern = re.compile(r"[a-z]{1,2}$")
-        num_space_pattern = re.compile(r"[0-9. -]{2,}$")
-        letter_pattern = re.compile(r"[a-z. -]+$")
-
-        def ner(t):
-            if num_pattern.match(t):
-                return 2
-            if short_letter_pattern.match(t):
-                return 0.01
-            if not self.ne or t not in self.ne:
-                return 1
-            m = {"toxic": 2, "func": 1, "corp": 3, "loca": 3, "sch": 3, "stock": 3,
-                 "firstnm": 1}
-            return m[self.ne[t]]
-
-        def postag(t):
-            t = rag_tokenizer.tag(t)
-            if t in set(["r", "c", "d"]):
-                return 0.3
-            if t in set(["ns", "nt"]):
-                return 3
-            if t in set(["n"]):
-                return 2
-            if re.match(r"[0-9-]+", t):
-                return 2
+    def _ner_weight(self, t):
+        if self._num_pattern.match(t):
+            return 2
+        if self._short_letter_pattern.match(t):
+            return 0.01
+        if not self.ne or t not in self.ne:
             return 1
+        m = {"toxic": 2, "func": 1, "corp": 3, "loca": 3, "sch": 3, "stock": 3,
+             "firstnm": 1}
+        return m[self.ne[t]]
+
+    @staticmethod
+    def _postag_weight(t):
+        t = rag_tokenizer.tag(t)
+        if t in set(["r", "c", "d"]):
+            return 0.3
+        if t in set(["ns", "nt"]):
+            return 3
+        if t in set(["n"]):
+            return 2
+        if re.match(r"[0-9-]+", t):
+            return 2
+        return 1
+
+    def _freq(self, t):
+        if self._num_space_pattern.match(t):
+            return 3
+        s = rag_tokenizer.freq(t)
+        if not s and self._letter_pattern.match(t):
+            return 300
+        if not s:
+            s = 0
 
-        def freq(t):
-            if num_space_pattern.match(t):
-                return 3
-            s = rag_tokenizer.freq(t)
-            if not s and letter_pattern.match(t):
-                return 300
-            if not s:
+        if not s and len(t) >= 4:
+            s = [tt for tt in rag_tokenizer.fine_grained_tokenize(t).split() if len(tt) > 1]
+            if len(s) > 1:
+                s = np.min([self._freq(tt) for tt in s]) / 6.
+            else:
                 s = 0
 
-            if not s and len(t) >= 4:
-                s = [tt for tt in rag_tokenizer.fine_grained_tokenize(t).split() if len(tt) > 1]
-                if len(s) > 1:
-                    s = np.min([freq(tt) for tt in s]) / 6.
-                else:
-                    s = 0
-
-            return max(s, 10)
-
-        def df(t):
-            if num_space_pattern.match(t):
-                return 5
-            if t in self.df:
-                return self.df[t] + 3
-            elif letter_pattern.match(t):
-                return 300
-            elif len(t) >= 4:
-                s = [tt for tt in rag_tokenizer.fine_grained_tokenize(t).split() if len(tt) > 1]
-                if len(s) > 1:
-                    return max(3, np.min([df(tt) for tt in s]) / 6.)
+        return max(s, 10)
 
-            return 3
+    def _df(self, t):
+        if self._num_space_pattern.match(t):
+            return 5
+        if t in self.df:
+            return self.df[t] + 3
+        elif self._letter_pattern.match(t):
+            return 300
+        elif len(t) >= 4:
+            s = [tt for tt in rag_tokenizer.fine_grained_tokenize(t).split() if len(tt) > 1]
+            if len(s) > 1:
+                return max(3, np.min([self._df(tt) for tt in s]) / 6.)
 
+        return 3
+
+    def _compute_token_weight(self, t):
         def idf(s, N):
             return math.log10(10 + ((N - s + 0.5) / (s + 0.5)))
 
+        return (0.3 * idf(self._freq(t), 10000000) + 0.7 * idf(self._df(t), 1000000000)) * \
+            (self._ner_weight(t) * self._postag_weight(t))
+
+    def token_weight(self, t):
+        """
+        The weight of a token before normalization, looked up in the vocabulary
+        table if it was precomputed, else in the LRU cache.
+        """
+        if self._vocab_ids:
+            i = self._vocab_ids.get(t)
+            if i is not None:
+                self._vocab_hits += 1
+                return self._vocab_wts[i]
+        return self._cached_token_weight(t)
+
+    def precompute_vocabulary(self):
+        """
+        Weight every token of the term frequency dictionary into an array, so that
+        the common vocabulary never goes through the LRU cache.
+        """
+        st = time.time()
+        vocab = list(self.df.keys()) if isinstance(self.df, dict) else list(self.df)
+        wts = np.fromiter((self._compute_token_weight(t) for t in vocab), dtype=np.float64, count=len(vocab))
+        self._vocab_wts = wts
+        self._vocab_ids = {t: i for i, t in enumerate(vocab)}
+        logging.info(f"Precomputed term weights of {len(vocab)} tokens in {time.time() - st:.2f}s")
+
+    def cache_stats(self) -> dict:
+        info = self._cached_token_weight.cache_info()
+        return {
+            "vocabulary_size": len(self._vocab_ids),
+            "vocabulary_hits": self._vocab_hits,
+            "hits": info.hits,
+            "misses": info.misses,
+            "size": info.currsize,
+            "max_size": info.maxsize,
+        }
+
+    def weights(self, tks, preprocess=True):
         tw = []
         if not preprocess:
-            idf1 = np.array([idf(freq(t), 10000000) for t in tks])
-            idf2 = np.array([idf(df(t), 1000000000) for t in tks])
-            wts = (0.3 * idf1 + 0.7 * idf2) * \
-                  np.array([ner(t) * postag(t) for t in tks])
-            wts = [s for s in wts]
-            tw = list(zip(tks, wts))
+            tw = [(t, self.token_weight(t)) for t in tks]
         else:
             for tk in tks:
                 tt = self.token_merge(self.pretoken(tk, True))
-                idf1 = np.array([idf(freq(t), 10000000) for t in tt])
-                idf2 = np.array([idf(df(t), 1000000000) for t in tt])
-                wts = (0.3 * idf1 + 0.7 * idf2) * \
-                      np.array([ner(t) * postag(t) for t in tt])
-                wts = [s for s in wts]
-                tw.extend(zip(tt, wts))
+                tw.extend((t, self.token_weight(t)) for t in tt)
 
         S = np.sum([s for _, s in tw])
         return [(t, s / S) for t, s in tw]
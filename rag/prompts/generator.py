@@ -158,6 +158,7 @@ CROSS_LANGUAGES_USER_PROMPT_TEMPLATE = load_prompt("cross_languages_user_prompt"
 FULL_QUESTION_PROMPT_TEMPLATE = load_prompt("full_question_prompt")
 KEYWORD_PROMPT_TEMPLATE = load_prompt("keyword_prompt")
 QUESTION_PROMPT_TEMPLATE = load_prompt("question_prompt")
+CHUNK_ENRICHMENT_BATCH_TEMPLATE = load_prompt("chunk_enrichment_batch")
 VISION_LLM_DESCRIBE_PROMPT = load_prompt("vision_llm_describe_prompt")
 VISION_LLM_FIGURE_DESCRIBE_PROMPT = load_prompt("vision_llm_figure_describe_prompt")
 VISION_LLM_FIGURE_DESCRIBE_PROMPT_WITH_CONTEXT = load_prompt("vision_llm_figure_describe_prompt_with_context")
@@ -215,6 +216,59 @@ async def question_proposal(chat_mdl, content, topn=3):
     return kwd
 
 
+async def batch_chunk_enrichment(chat_mdl, contents: list[str], keywords_topn=0, questions_topn=0) -> list[dict | None]:
+    """
+    Extract keywords and/or propose questions for several chunks in one request.
+
+    Returns one {"keywords": [...], "questions": [...]} per content (only the
+    enabled keys), or None where the answer has no usable entry for it.
+    """
+    res = [None] * len(contents)
+    template = PROMPT_JINJA_ENV.from_string(CHUNK_ENRICHMENT_BATCH_TEMPLATE)
+    rendered_prompt = template.render(contents=contents, keywords_topn=keywords_topn, questions_topn=questions_topn)
+
+    msg = [{"role": "system", "content": rendered_prompt}, {"role": "user", "content": "Output: "}]
+    _, msg = message_fit_in(msg, chat_mdl.max_length)
+    ans = await chat_mdl.async_chat(rendered_prompt, msg[1:], {"temperature": 0.2})
+    if isinstance(ans, tuple):
+        ans = ans[0]
+    ans = re.sub(r"(^.*</think>|```json\n|```\n*$)", "", ans, flags=re.DOTALL)
+    if ans.find("**ERROR**") >= 0:
+        return res
+    try:
+        items = json_repair.loads(ans)
+    except Exception:
+        logging.warning(f"batch_chunk_enrichment got invalid JSON: {ans}")
+        return res
+    if isinstance(items, dict):
+        items = [items]
+    if not isinstance(items, list):
+        return res
+
+    for i, item in enumerate(items):
+        if not isinstance(item, dict):
+            continue
+        try:
+            idx = int(item.get("id", i + 1)) - 1
+        except (TypeError, ValueError):
+            continue
+        if not 0 <= idx < len(contents) or res[idx] is not None:
+            continue
+        r = {}
+        for k, topn in [("keywords", keywords_topn), ("questions", questions_topn)]:
+            if not topn:
+                continue
+            v = item.get(k)
+            if isinstance(v, str):
+                v = [v]
+            if not isinstance(v, list):
+                break
+            r[k] = [str(x).strip() for x in v if str(x).strip()]
+        else:
+            res[idx] = r
+    return res
+
+
 async def full_question(tenant_id=None, llm_id=None, messages=[], language=None, chat_mdl=None):
     from common.constants import LLMType
     from api.db.services.llm_service import LLMBundle
@@ -19,7 +19,6 @@ import re
 
 import numpy as np
 import umap
-from sklearn.mixture import GaussianMixture
 
 from api.db.services.task_service import has_canceled
 from common.connection_utils import timeout
@@ -33,6 +32,7 @@ from graphrag.utils import (
     set_llm_cache,
 )
 from common.misc_utils import thread_pool_exec
+from rag.utils.raptor_clustering import GaussianMixtureSearch
 
 
 class RecursiveAbstractiveProcessing4TreeOrganizedRetrieval:
@@ -54,6 +54,7 @@ class RecursiveAbstractiveProcessing4TreeOrganizedRetrieval:
         self._max_token = max_token
         self._max_errors = max(1, max_errors)
         self._error_count = 0
+        self._cluster_search = GaussianMixtureSearch(max_cluster)
 
     @timeout(60 * 20)
     async def _chat(self, system, history, gen_conf):
@@ -91,20 +92,12 @@ class RecursiveAbstractiveProcessing4TreeOrganizedRetrieval:
         return embds
 
     def _get_optimal_clusters(self, embeddings: np.ndarray, random_state: int, task_id: str = ""):
-        max_clusters = min(self._max_cluster, len(embeddings))
-        n_clusters = np.arange(1, max_clusters)
-        bics = []
-        for n in n_clusters:
-            if task_id:
-                if has_canceled(task_id):
-                    logging.info(f"Task {task_id} cancelled during get optimal clusters.")
-                    raise TaskCanceledException(f"Task {task_id} was cancelled")
+        def check_canceled():
+            if task_id and has_canceled(task_id):
+                logging.info(f"Task {task_id} cancelled during get optimal clusters.")
+                raise TaskCanceledException(f"Task {task_id} was cancelled")
 
-            gm = GaussianMixture(n_components=n, random_state=random_state)
-            gm.fit(embeddings)
-            bics.append(gm.bic(embeddings))
-        optimal_clusters = n_clusters[np.argmin(bics)]
-        return optimal_clusters
+        return self._cluster_search.search(embeddings, random_state, should_stop=check_canceled)
 
     async def __call__(self, chunks, random_state, callback=None, task_id: str = ""):
         if len(chunks) <= 1:
@@ -189,12 +182,10 @@ class RecursiveAbstractiveProcessing4TreeOrganizedRetrieval:
                 n_components=min(12, len(embeddings) - 2),
                 metric="cosine",
             ).fit_transform(embeddings)
-            n_clusters = self._get_optimal_clusters(reduced_embeddings, random_state, task_id=task_id)
+            n_clusters, gm = self._get_optimal_clusters(reduced_embeddings, random_state, task_id=task_id)
             if n_clusters == 1:
                 lbls = [0 for _ in range(len(reduced_embeddings))]
             else:
-                gm = GaussianMixture(n_components=n_clusters, random_state=random_state)
-                gm.fit(reduced_embeddings)
                 probs = gm.predict_proba(reduced_embeddings)
                 lbls = [np.where(prob > self._threshold)[0] for prob in probs]
                 lbls = [lbl[0] if isinstance(lbl, np.ndarray) else lbl for lbl in lbls]
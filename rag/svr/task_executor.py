@@ -16,13 +16,13 @@
 import time
 
 
-from common.misc_utils import thread_pool_exec
+from common.misc_utils import thread_pool_exec, thread_pool_exec_in, get_thread_pool, thread_pool_stats, shutdown_thread_pools, \
+    THREAD_POOL_CPU, THREAD_POOL_DOC_STORE, THREAD_POOL_MODEL, THREAD_POOL_STORAGE
 
 start_ts = time.time()
 
 import asyncio
 import socket
-import concurrent
 # from beartype import BeartypeConf
 # from beartype.claw import beartype_all  # <-- you didn't sign up for this
 # beartype_all(conf=BeartypeConf(violation_type=UserWarning))    # <-- emit warnings from all code
@@ -37,13 +37,14 @@ from api.db.joint_services.memory_message_service import handle_save_to_memory_t
 from common.connection_utils import timeout
 from common.metadata_utils import update_metadata_to, metadata_schema
 from rag.utils.base64_image import image2id
+from rag.utils.embedding_cache import EmbeddingBuffer, EmbeddingCache, dedup_texts, vectors_for_doc_store
 from rag.utils.raptor_utils import should_skip_raptor, get_skip_reason
 from common.log_utils import init_root_logger
 from common.config_utils import show_configs
 from graphrag.general.index import run_graphrag_for_kb
-from graphrag.utils import get_llm_cache, set_llm_cache, get_tags_from_cache, set_tags_to_cache
+from graphrag.utils import get_llm_cache_batch, set_llm_cache_batch, get_tags_from_cache, set_tags_to_cache
 from rag.prompts.generator import keyword_extraction, question_proposal, content_tagging, run_toc_from_text, \
-    gen_metadata
+    gen_metadata, batch_chunk_enrichment
 import logging
 import os
 from datetime import datetime
@@ -62,7 +63,8 @@ from peewee import DoesNotExist
 from common.constants import LLMType, ParserType, PipelineTaskType
 from api.db.services.document_service import DocumentService
 from api.db.services.llm_service import LLMBundle
-from api.db.services.task_service import TaskService, has_canceled, CANVAS_DEBUG_DOC_ID, GRAPH_RAPTOR_FAKE_DOC_ID
+from api.db.services.task_service import TaskService, ChunkIdLedger, has_canceled, trim_header_by_lines, \
+    CANVAS_DEBUG_DOC_ID, GRAPH_RAPTOR_FAKE_DOC_ID, PROGRESS_WRITE_RETRIES
 from api.db.services.file2document_service import File2DocumentService
 from common.versions import get_ragflow_version
 from api.db.db_models import close_connection
@@ -122,6 +124,12 @@ CURRENT_TASKS = {}
 MAX_CONCURRENT_TASKS = int(os.environ.get('MAX_CONCURRENT_TASKS', "5"))
 MAX_CONCURRENT_CHUNK_BUILDERS = int(os.environ.get('MAX_CONCURRENT_CHUNK_BUILDERS', "1"))
 MAX_CONCURRENT_MINIO = int(os.environ.get('MAX_CONCURRENT_MINIO', '10'))
+INGESTION_SEGMENT_SIZE = int(os.environ.get('INGESTION_SEGMENT_SIZE', '128'))
+INGESTION_QUEUE_SIZE = int(os.environ.get('INGESTION_QUEUE_SIZE', '2'))
+CANCEL_CHECK_INTERVAL = float(os.environ.get('CANCEL_CHECK_INTERVAL', '1'))
+ENRICHMENT_BATCH_SIZE = int(os.environ.get('ENRICHMENT_BATCH_SIZE', '8'))
+ENRICHMENT_BATCH_TOKENS = int(os.environ.get('ENRICHMENT_BATCH_TOKENS', '1024'))
+PROGRESS_FLUSH_INTERVAL = float(os.environ.get('PROGRESS_FLUSH_INTERVAL', '2'))
 task_limiter = asyncio.Semaphore(MAX_CONCURRENT_TASKS)
 chunk_limiter = asyncio.Semaphore(MAX_CONCURRENT_CHUNK_BUILDERS)
 embed_limiter = asyncio.Semaphore(MAX_CONCURRENT_CHUNK_BUILDERS)
@@ -134,10 +142,99 @@ stop_event = threading.Event()
 def signal_handler(sig, frame):
     logging.info("Received interrupt signal, shutting down...")
     stop_event.set()
+    PROGRESS_AGGREGATOR.flush(force=True)
+    shutdown_thread_pools()
     time.sleep(1)
     sys.exit(0)
 
 
+class ProgressAggregator:
+    """
+    Buffers progress messages per task in memory and writes them to the task row
+    in one conditional UPDATE, at most every `interval` seconds or right away on a
+    state transition (first message, failure, completion, cancel).
+
+    The task's progress message is read once and then kept here, so a flush needs
+    no read and no lock; if someone else changed the row meanwhile, it is re-read.
+    """
+
+    def __init__(self, interval: float = PROGRESS_FLUSH_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._tasks = {}
+
+    def add(self, task_id, msg, prog=None, flush=False):
+        with self._lock:
+            state = self._tasks.get(task_id)
+            if state is None:
+                state = self._tasks[task_id] = {"lock": threading.Lock(), "msgs": [], "prog": None,
+                                                "flushed_at": 0, "progress_msg": None, "begin_at": None}
+                flush = True
+            if msg:
+                state["msgs"].append(msg)
+            if prog is not None:
+                if prog == -1 or state["prog"] is None or state["prog"] == -1:
+                    state["prog"] = -1 if -1 in (prog, state["prog"]) else prog
+                else:
+                    state["prog"] = max(state["prog"], prog)
+            flush = flush or (prog is not None and (prog < 0 or prog >= 1)) or \
+                time.time() - state["flushed_at"] >= self.interval
+        if flush:
+            self._flush(task_id, state)
+
+    def flush(self, force=False):
+        now = time.time()
+        with self._lock:
+            due = [(task_id, state) for task_id, state in self._tasks.items()
+                   if (state["msgs"] or state["prog"] is not None)
+                   and (force or now - state["flushed_at"] >= self.interval)]
+        for task_id, state in due:
+            try:
+                self._flush(task_id, state)
+            except Exception:
+                logging.exception(f"ProgressAggregator.flush({task_id}) got exception")
+        close_connection()
+
+    def close(self, task_id):
+        with self._lock:
+            state = self._tasks.get(task_id)
+        if state is None:
+            return
+        try:
+            self._flush(task_id, state)
+        finally:
+            with self._lock:
+                self._tasks.pop(task_id, None)
+            close_connection()
+
+    def _flush(self, task_id, state):
+        # The per-task lock keeps concurrent flushes of one task in order.
+        with state["lock"]:
+            with self._lock:
+                msgs, prog = state["msgs"], state["prog"]
+                state["msgs"], state["prog"] = [], None
+                state["flushed_at"] = time.time()
+            if not msgs and prog is None:
+                return
+            msg = "\n".join(msgs)
+            for _ in range(PROGRESS_WRITE_RETRIES):
+                if state["progress_msg"] is None:
+                    task = TaskService.model.get_by_id(task_id)
+                    state["progress_msg"], state["begin_at"] = task.progress_msg or "", task.begin_at
+                progress_msg = state["progress_msg"]
+                if msg:
+                    progress_msg = trim_header_by_lines(progress_msg + "\n" + msg, 3000)
+                process_duration = (datetime.now() - state["begin_at"]).total_seconds() if state["begin_at"] else None
+                if TaskService.write_progress(task_id, state["progress_msg"], progress_msg, prog, process_duration):
+                    state["progress_msg"] = progress_msg
+                    return
+                state["progress_msg"] = None
+            logging.warning(f"ProgressAggregator: task {task_id} kept changing, progress is dropped")
+
+
+PROGRESS_AGGREGATOR = ProgressAggregator()
+
+
 def set_progress(task_id, from_page=0, to_page=-1, prog=None, msg="Processing..."):
     try:
         if prog is not None and prog < 0:
@@ -154,11 +251,8 @@ def set_progress(task_id, from_page=0, to_page=-1, prog=None, msg="Processing...
                     msg = f"Page({from_page + 1}~{to_page + 1}): " + msg
         if msg:
             msg = datetime.now().strftime("%H:%M:%S") + " " + msg
-        d = {"progress_msg": msg}
-        if prog is not None:
-            d["progress"] = prog
 
-        TaskService.update_progress(task_id, d)
+        PROGRESS_AGGREGATOR.add(task_id, msg, prog, flush=cancel)
 
         close_connection()
         if cancel:
@@ -170,6 +264,18 @@ def set_progress(task_id, from_page=0, to_page=-1, prog=None, msg="Processing...
         logging.exception(f"set_progress({task_id}), progress: {prog}, progress_msg: {msg}, got exception: {e}")
 
 
+async def flush_progress():
+    """
+    Periodically writes buffered progress messages of running tasks
+    """
+    while not stop_event.is_set():
+        await asyncio.sleep(PROGRESS_AGGREGATOR.interval)
+        try:
+            await thread_pool_exec(PROGRESS_AGGREGATOR.flush)
+        except Exception:
+            logging.exception("flush_progress got exception")
+
+
 async def collect():
     global CONSUMER_NAME, DONE_TASKS, FAILED_TASKS
     global UNACKED_ITERATOR
@@ -235,7 +341,7 @@ async def collect():
 
 
 async def get_storage_binary(bucket, name):
-    return await thread_pool_exec(settings.STORAGE_IMPL.get, bucket, name)
+    return await thread_pool_exec_in(THREAD_POOL_STORAGE, settings.STORAGE_IMPL.get, bucket, name)
 
 
 @timeout(60 * 80, 1)
@@ -266,7 +372,8 @@ async def build_chunks(task, progress_callback):
 
     try:
         async with chunk_limiter:
-            cks = await thread_pool_exec(
+            cks = await thread_pool_exec_in(
+                THREAD_POOL_CPU,
                 chunker.chunk,
                 task["name"],
                 binary=binary,
@@ -335,108 +442,156 @@ async def build_chunks(task, progress_callback):
 
     el = timer() - st
     logging.info("MINIO PUT({}) cost {:.3f} s".format(task["name"], el))
+    return docs
 
-    if task["parser_config"].get("auto_keywords", 0):
-        st = timer()
-        progress_callback(msg="Start to generate keywords for every chunk ...")
-        chat_mdl = LLMBundle(task["tenant_id"], LLMType.CHAT, llm_name=task["llm_id"], lang=task["language"])
 
-        async def doc_keyword_extraction(chat_mdl, d, topn):
-            cached = get_llm_cache(chat_mdl.llm_name, d["content_with_weight"], "keywords", {"topn": topn})
-            if not cached:
-                if has_canceled(task["id"]):
-                    progress_callback(-1, msg="Task has been canceled.")
-                    return
-                async with chat_limiter:
-                    cached = await keyword_extraction(chat_mdl, d["content_with_weight"], topn)
-                set_llm_cache(chat_mdl.llm_name, d["content_with_weight"], cached, "keywords", {"topn": topn})
-            if cached:
-                d["important_kwd"] = cached.split(",")
-                d["important_tks"] = rag_tokenizer.tokenize(" ".join(d["important_kwd"]))
-            return
+class EnrichmentStats:
+    """
+    Throughput counters of one chunk enrichment, reported through the progress callback.
+    """
 
-        tasks = []
-        for d in docs:
-            tasks.append(
-                asyncio.create_task(doc_keyword_extraction(chat_mdl, d, task["parser_config"]["auto_keywords"])))
-        try:
-            await asyncio.gather(*tasks, return_exceptions=False)
-        except Exception as e:
-            logging.error("Error in doc_keyword_extraction: {}".format(e))
-            for t in tasks:
-                t.cancel()
-            await asyncio.gather(*tasks, return_exceptions=True)
-            raise
-        progress_callback(msg="Keywords generation {} chunks completed in {:.2f}s".format(len(docs), timer() - st))
+    def __init__(self, name, chunks):
+        self.name = name
+        self.chunks = chunks
+        self.cached = 0
+        self.llm_calls = 0
+        self.st = timer()
 
-    if task["parser_config"].get("auto_questions", 0):
-        st = timer()
-        progress_callback(msg="Start to generate questions for every chunk ...")
-        chat_mdl = LLMBundle(task["tenant_id"], LLMType.CHAT, llm_name=task["llm_id"], lang=task["language"])
+    def __str__(self):
+        elapsed = timer() - self.st
+        return "{} {} chunks completed in {:.2f}s ({:.1f} chunks/s), {} cached, {} LLM requests".format(
+            self.name, self.chunks, elapsed, self.chunks / elapsed if elapsed > 0 else 0, self.cached, self.llm_calls)
 
-        async def doc_question_proposal(chat_mdl, d, topn):
-            cached = get_llm_cache(chat_mdl.llm_name, d["content_with_weight"], "question", {"topn": topn})
-            if not cached:
-                if has_canceled(task["id"]):
-                    progress_callback(-1, msg="Task has been canceled.")
-                    return
-                async with chat_limiter:
-                    cached = await question_proposal(chat_mdl, d["content_with_weight"], topn)
-                set_llm_cache(chat_mdl.llm_name, d["content_with_weight"], cached, "question", {"topn": topn})
-            if cached:
-                d["question_kwd"] = cached.split("\n")
-                d["question_tks"] = rag_tokenizer.tokenize("\n".join(d["question_kwd"]))
 
-        tasks = []
-        for d in docs:
-            tasks.append(
-                asyncio.create_task(doc_question_proposal(chat_mdl, d, task["parser_config"]["auto_questions"])))
-        try:
-            await asyncio.gather(*tasks, return_exceptions=False)
-        except Exception as e:
-            logging.error("Error in doc_question_proposal", exc_info=e)
-            for t in tasks:
-                t.cancel()
-            await asyncio.gather(*tasks, return_exceptions=True)
-            raise
-        progress_callback(msg="Question generation {} chunks completed in {:.2f}s".format(len(docs), timer() - st))
+def pack_enrichment_batches(texts, idxs, max_tokens=ENRICHMENT_BATCH_TOKENS, max_size=ENRICHMENT_BATCH_SIZE):
+    """
+    Group consecutive chunks into LLM requests of at most `max_size` chunks and
+    `max_tokens` tokens; a chunk longer than that goes alone.
+    """
+    batches, batch, batch_tks = [], [], 0
+    for i in idxs:
+        tks = num_tokens_from_string(texts[i])
+        if batch and (batch_tks + tks > max_tokens or len(batch) >= max_size):
+            batches.append(batch)
+            batch, batch_tks = [], 0
+        batch.append(i)
+        batch_tks += tks
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+async def gather_enrichment(tasks, name):
+    try:
+        await asyncio.gather(*tasks, return_exceptions=False)
+    except Exception as e:
+        logging.error("Error in {}".format(name), exc_info=e)
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+async def enrich_chunks(task, docs, progress_callback):
+    """
+    Generate keywords, questions, metadata and tags for the chunks, as configured.
+
+    Cached results are looked up and stored in bulk. Keywords and questions are
+    asked for together, for several short chunks per LLM request.
+    """
+    contents = [d["content_with_weight"] for d in docs]
+    keywords_topn = task["parser_config"].get("auto_keywords", 0)
+    questions_topn = task["parser_config"].get("auto_questions", 0)
+    if keywords_topn or questions_topn:
+        stats = EnrichmentStats("Keywords/questions generation", len(docs))
+        progress_callback(msg="Start to generate keywords/questions for every chunk ...")
+        chat_mdl = LLMBundle(task["tenant_id"], LLMType.CHAT, llm_name=task["llm_id"], lang=task["language"])
+        keywords_conf, questions_conf = {"topn": keywords_topn}, {"topn": questions_topn}
+        # None means to be generated, "" that it is not asked for.
+        keywords = get_llm_cache_batch(chat_mdl.llm_name, contents, "keywords", keywords_conf) \
+            if keywords_topn else [""] * len(docs)
+        questions = get_llm_cache_batch(chat_mdl.llm_name, contents, "question", questions_conf) \
+            if questions_topn else [""] * len(docs)
+        keywords_missing = [i for i, v in enumerate(keywords) if v is None]
+        questions_missing = [i for i, v in enumerate(questions) if v is None]
+        todo = sorted(set(keywords_missing) | set(questions_missing))
+        stats.cached = len(docs) - len(todo)
+
+        async def doc_keyword_question_proposal(idxs):
+            if has_canceled(task["id"]):
+                progress_callback(-1, msg="Task has been canceled.")
+                return
+            if len(idxs) > 1:
+                stats.llm_calls += 1
+                async with chat_limiter:
+                    res = await batch_chunk_enrichment(chat_mdl, [contents[i] for i in idxs],
+                                                       keywords_topn if any(keywords[i] is None for i in idxs) else 0,
+                                                       questions_topn if any(questions[i] is None for i in idxs) else 0)
+                for i, r in zip(idxs, res):
+                    if r is None:
+                        continue
+                    if keywords[i] is None and "keywords" in r:
+                        keywords[i] = ",".join(r["keywords"])
+                    if questions[i] is None and "questions" in r:
+                        questions[i] = "\n".join(r["questions"])
+            # Chunks too long to be packed, or which the batched answer missed.
+            for i in idxs:
+                if keywords[i] is None:
+                    stats.llm_calls += 1
+                    async with chat_limiter:
+                        keywords[i] = await keyword_extraction(chat_mdl, contents[i], keywords_topn)
+                if questions[i] is None:
+                    stats.llm_calls += 1
+                    async with chat_limiter:
+                        questions[i] = await question_proposal(chat_mdl, contents[i], questions_topn)
+
+        tasks = [asyncio.create_task(doc_keyword_question_proposal(idxs))
+                 for idxs in pack_enrichment_batches(contents, todo)]
+        await gather_enrichment(tasks, "doc_keyword_question_proposal")
+
+        keywords_missing = [i for i in keywords_missing if keywords[i] is not None]
+        set_llm_cache_batch(chat_mdl.llm_name, [contents[i] for i in keywords_missing],
+                            [keywords[i] for i in keywords_missing], "keywords", keywords_conf)
+        questions_missing = [i for i in questions_missing if questions[i] is not None]
+        set_llm_cache_batch(chat_mdl.llm_name, [contents[i] for i in questions_missing],
+                            [questions[i] for i in questions_missing], "question", questions_conf)
+        important_tks = iter(rag_tokenizer.tokenize_batch([kwd for kwd in keywords if kwd]))
+        question_tks = iter(rag_tokenizer.tokenize_batch([qst for qst in questions if qst]))
+        for d, kwd, qst in zip(docs, keywords, questions):
+            if kwd:
+                d["important_kwd"] = kwd.split(",")
+                d["important_tks"] = next(important_tks)
+            if qst:
+                d["question_kwd"] = qst.split("\n")
+                d["question_tks"] = next(question_tks)
+        progress_callback(msg=str(stats))
 
     if task["parser_config"].get("enable_metadata", False) and task["parser_config"].get("metadata"):
-        st = timer()
+        stats = EnrichmentStats("Meta-data generation", len(docs))
         progress_callback(msg="Start to generate meta-data for every chunk ...")
         chat_mdl = LLMBundle(task["tenant_id"], LLMType.CHAT, llm_name=task["llm_id"], lang=task["language"])
+        metadata_conf = task["parser_config"]["metadata"]
+        metadata_objs = get_llm_cache_batch(chat_mdl.llm_name, contents, "metadata", metadata_conf)
+        metadata_missing = [i for i, v in enumerate(metadata_objs) if v is None]
+        stats.cached = len(docs) - len(metadata_missing)
 
-        async def gen_metadata_task(chat_mdl, d):
-            cached = get_llm_cache(chat_mdl.llm_name, d["content_with_weight"], "metadata",
-                                   task["parser_config"]["metadata"])
-            if not cached:
-                if has_canceled(task["id"]):
-                    progress_callback(-1, msg="Task has been canceled.")
-                    return
-                async with chat_limiter:
-                    cached = await gen_metadata(chat_mdl,
-                                                metadata_schema(task["parser_config"]["metadata"]),
-                                                d["content_with_weight"])
-                set_llm_cache(chat_mdl.llm_name, d["content_with_weight"], cached, "metadata",
-                              task["parser_config"]["metadata"])
-            if cached:
-                d["metadata_obj"] = cached
+        async def gen_metadata_task(chat_mdl, i):
+            if has_canceled(task["id"]):
+                progress_callback(-1, msg="Task has been canceled.")
+                return
+            stats.llm_calls += 1
+            async with chat_limiter:
+                metadata_objs[i] = await gen_metadata(chat_mdl, metadata_schema(metadata_conf), contents[i])
 
-        tasks = []
-        for d in docs:
-            tasks.append(asyncio.create_task(gen_metadata_task(chat_mdl, d)))
-        try:
-            await asyncio.gather(*tasks, return_exceptions=False)
-        except Exception as e:
-            logging.error("Error in doc_question_proposal", exc_info=e)
-            for t in tasks:
-                t.cancel()
-            await asyncio.gather(*tasks, return_exceptions=True)
-            raise
+        tasks = [asyncio.create_task(gen_metadata_task(chat_mdl, i)) for i in metadata_missing]
+        await gather_enrichment(tasks, "gen_metadata_task")
+
+        metadata_missing = [i for i in metadata_missing if metadata_objs[i] is not None]
+        set_llm_cache_batch(chat_mdl.llm_name, [contents[i] for i in metadata_missing],
+                            [metadata_objs[i] for i in metadata_missing], "metadata", metadata_conf)
         metadata = {}
-        for doc in docs:
-            metadata = update_metadata_to(metadata, doc["metadata_obj"])
-            del doc["metadata_obj"]
+        for obj in metadata_objs:
+            metadata = update_metadata_to(metadata, obj)
         if metadata:
             e, doc = DocumentService.get_by_id(task["doc_id"])
             if e:
@@ -444,7 +599,7 @@ async def build_chunks(task, progress_callback):
                     doc.meta_fields = json.loads(doc.meta_fields)
                 metadata = update_metadata_to(metadata, doc.meta_fields)
                 DocumentService.update_by_id(task["doc_id"], {"meta_fields": metadata})
-        progress_callback(msg="Question generation {} chunks completed in {:.2f}s".format(len(docs), timer() - st))
+        progress_callback(msg=str(stats))
 
     if task["kb_parser_config"].get("tag_kb_ids", []):
         progress_callback(msg="Start to tag for every chunk ...")
@@ -452,7 +607,7 @@ async def build_chunks(task, progress_callback):
         tenant_id = task["tenant_id"]
         topn_tags = task["kb_parser_config"].get("topn_tags", 3)
         S = 1000
-        st = timer()
+        stats = EnrichmentStats("Tagging", len(docs))
         examples = []
         all_tags = get_tags_from_cache(kb_ids)
         if not all_tags:
@@ -475,41 +630,40 @@ async def build_chunks(task, progress_callback):
             else:
                 docs_to_tag.append(d)
 
-        async def doc_content_tagging(chat_mdl, d, topn_tags):
-            cached = get_llm_cache(chat_mdl.llm_name, d["content_with_weight"], all_tags, {"topn": topn_tags})
-            if not cached:
-                if has_canceled(task["id"]):
-                    progress_callback(-1, msg="Task has been canceled.")
-                    return
-                picked_examples = random.choices(examples, k=2) if len(examples) > 2 else examples
-                if not picked_examples:
-                    picked_examples.append({"content": "This is an example", TAG_FLD: {'example': 1}})
-                async with chat_limiter:
-                    cached = await content_tagging(
-                        chat_mdl,
-                        d["content_with_weight"],
-                        all_tags,
-                        picked_examples,
-                        topn_tags,
-                    )
-                if cached:
-                    cached = json.dumps(cached)
+        tagging_conf = {"topn": topn_tags}
+        tags = get_llm_cache_batch(chat_mdl.llm_name, [d["content_with_weight"] for d in docs_to_tag], all_tags,
+                                   tagging_conf)
+        stats.cached = len(docs) - len(docs_to_tag) + sum(1 for v in tags if v is not None)
+
+        async def doc_content_tagging(chat_mdl, i, topn_tags):
+            if has_canceled(task["id"]):
+                progress_callback(-1, msg="Task has been canceled.")
+                return
+            picked_examples = random.choices(examples, k=2) if len(examples) > 2 else examples
+            if not picked_examples:
+                picked_examples.append({"content": "This is an example", TAG_FLD: {'example': 1}})
+            stats.llm_calls += 1
+            async with chat_limiter:
+                cached = await content_tagging(
+                    chat_mdl,
+                    docs_to_tag[i]["content_with_weight"],
+                    all_tags,
+                    picked_examples,
+                    topn_tags,
+                )
             if cached:
-                set_llm_cache(chat_mdl.llm_name, d["content_with_weight"], cached, all_tags, {"topn": topn_tags})
-                d[TAG_FLD] = json.loads(cached)
+                tags[i] = json.dumps(cached)
 
-        tasks = []
-        for d in docs_to_tag:
-            tasks.append(asyncio.create_task(doc_content_tagging(chat_mdl, d, topn_tags)))
-        try:
-            await asyncio.gather(*tasks, return_exceptions=False)
-        except Exception as e:
-            logging.error("Error tagging docs: {}".format(e))
-            for t in tasks:
-                t.cancel()
-            await asyncio.gather(*tasks, return_exceptions=True)
-            raise
-        progress_callback(msg="Tagging {} chunks completed in {:.2f}s".format(len(docs), timer() - st))
+        tasks = [asyncio.create_task(doc_content_tagging(chat_mdl, i, topn_tags))
+                 for i, v in enumerate(tags) if v is None]
+        await gather_enrichment(tasks, "doc_content_tagging")
+
+        tagged = [i for i, v in enumerate(tags) if v]
+        set_llm_cache_batch(chat_mdl.llm_name, [docs_to_tag[i]["content_with_weight"] for i in tagged],
+                            [tags[i] for i in tagged], all_tags, tagging_conf)
+        for i in tagged:
+            docs_to_tag[i][TAG_FLD] = json.loads(tags[i])
+        progress_callback(msg=str(stats))
 
     return docs
 
@@ -566,12 +720,47 @@ def init_kb(row, vector_size: int):
     return settings.docStoreConn.create_idx(idxnm, row.get("kb_id", ""), vector_size, parser_id)
 
 
-async def embedding(docs, mdl, parser_config=None, callback=None):
+async def encode_with_cache(mdl, txts, batch_encode, cache):
+    """
+    Encode a batch of truncated texts, only sending those missing from the embedding cache to the model.
+    """
+    vts = cache.get(txts)
+    missed = [i for i, v in enumerate(vts) if v is None]
+    tk_count = 0
+    if missed:
+        async with embed_limiter:
+            encoded, tk_count = await thread_pool_exec_in(THREAD_POOL_MODEL, batch_encode, [txts[i] for i in missed])
+        for i, v in zip(missed, encoded):
+            vts[i] = v
+        cache.put([txts[i] for i in missed], encoded)
+    return np.array(vts), tk_count
+
+
+async def encode_title(docs, mdl):
+    """
+    Embed the document name shared by the chunks, returning (title vector, token count).
+    """
+    if not docs:
+        return None, 0
+    vts, c = await thread_pool_exec_in(THREAD_POOL_MODEL, mdl.encode, [docs[0].get("docnm_kwd", "Title")])
+    return np.asarray(vts[0], dtype=np.float32), c
+
+
+async def embedding(docs, mdl, parser_config=None, callback=None, title=None, offset=0, total=None):
+    """
+    Embed the chunks into their q_N_vec field, mixing in the document name vector.
+
+    title is the (vector, token count) pair from `encode_title`; if it is not
+    given, the title is encoded here. offset and total place the docs within the
+    task's chunks, so that progress spans the whole task when it is embedded
+    segment by segment.
+    """
     if parser_config is None:
         parser_config = {}
-    tts, cnts = [], []
+    if total is None:
+        total = len(docs)
+    cnts = []
     for d in docs:
-        tts.append(d.get("docnm_kwd", "Title"))
         c = "\n".join(d.get("question_kwd", []))
         if not c:
             c = d["content_with_weight"]
@@ -581,45 +770,155 @@ async def embedding(docs, mdl, parser_config=None, callback=None):
         cnts.append(c)
 
     tk_count = 0
-    if len(tts) == len(cnts):
-        vts, c = await thread_pool_exec(mdl.encode, tts[0:1])
-        tts = np.tile(vts[0], (len(cnts), 1))
-        tk_count += c
+    if title is None:
+        title_vec, tk_count = await encode_title(docs, mdl)
+    else:
+        title_vec, _ = title
 
     @timeout(60)
     def batch_encode(txts):
         nonlocal mdl
-        return mdl.encode([truncate(c, mdl.max_length - 10) for c in txts])
-
-    cnts_ = np.array([])
-    for i in range(0, len(cnts), settings.EMBEDDING_BATCH_SIZE):
-        async with embed_limiter:
-            vts, c = await thread_pool_exec(batch_encode, cnts[i: i + settings.EMBEDDING_BATCH_SIZE])
-        if len(cnts_) == 0:
-            cnts_ = vts
-        else:
-            cnts_ = np.concatenate((cnts_, vts), axis=0)
+        return mdl.encode(txts)
+
+    cnts = [truncate(c, mdl.max_length - 10) for c in cnts]
+    uniq_cnts, cnt_index, duplicates = dedup_texts(cnts)
+    cache = EmbeddingCache.of_model(mdl)
+    buffer = EmbeddingBuffer(len(uniq_cnts))
+    for i in range(0, len(uniq_cnts), settings.EMBEDDING_BATCH_SIZE):
+        vts, c = await encode_with_cache(mdl, uniq_cnts[i: i + settings.EMBEDDING_BATCH_SIZE], batch_encode, cache)
+        buffer.append(vts)
         tk_count += c
-        callback(prog=0.7 + 0.2 * (i + 1) / len(cnts), msg="")
-    cnts = cnts_
+        done = offset + len(docs) * min(i + settings.EMBEDDING_BATCH_SIZE, len(uniq_cnts)) / len(uniq_cnts)
+        callback(prog=0.7 + 0.2 * done / max(total, 1), msg="")
+    vects = buffer.matrix[cnt_index] if duplicates else buffer.matrix
+    if duplicates:
+        saved_tks = sum(num_tokens_from_string(uniq_cnts[cnt_index[j]]) for j in duplicates)
+        callback(msg=f"Embedding skipped {len(duplicates)} duplicated chunks, saved {saved_tks} tokens")
     filename_embd_weight = parser_config.get("filename_embd_weight", 0.1)  # due to the db support none value
     if not filename_embd_weight:
         filename_embd_weight = 0.1
     title_w = float(filename_embd_weight)
-    if tts.ndim == 2 and cnts.ndim == 2 and tts.shape == cnts.shape:
-        vects = title_w * tts + (1 - title_w) * cnts
-    else:
-        vects = cnts
+    if title_vec is not None and title_vec.shape[0] == buffer.vector_size:
+        vects *= (1 - title_w)
+        vects += title_w * title_vec
 
     assert len(vects) == len(docs)
-    vector_size = 0
-    for i, d in enumerate(docs):
-        v = vects[i].tolist()
-        vector_size = len(v)
-        d["q_%d_vec" % len(v)] = v
+    if cache.enabled:
+        callback(msg=f"Embedding {str(cache)}")
+    vector_size = buffer.vector_size
+    vector_field = "q_%d_vec" % vector_size
+    for d, v in zip(docs, vectors_for_doc_store(vects, settings.DOC_ENGINE)):
+        d[vector_field] = v
     return tk_count, vector_size
 
 
+async def run_ingestion_pipeline(task, chunks, embedding_model, progress_callback, chunk_id_ledger, on_embedded=None):
+    """
+    Enrich, embed and index the chunks segment by segment.
+
+    The three stages run concurrently and are connected by bounded queues, so a
+    segment is indexed while the next one is embedded and the one after is enriched.
+    A full queue blocks the upstream stage, which bounds the chunks held in flight.
+
+    Returns:
+        (token_count, vector_size, inserted): inserted is False if the task was
+        canceled or indexing failed.
+    """
+    enriched_queue = asyncio.Queue(maxsize=INGESTION_QUEUE_SIZE)
+    embedded_queue = asyncio.Queue(maxsize=INGESTION_QUEUE_SIZE)
+    stage_stats = {stage: {"busy": 0.0, "blocked": 0.0} for stage in ["enrich", "embedding", "indexing"]}
+    token_count = 0
+    vector_size = 0
+
+    async def put(stage, queue, item):
+        st = timer()
+        await queue.put(item)
+        stage_stats[stage]["blocked"] += timer() - st
+
+    async def get(stage, queue):
+        st = timer()
+        item = await queue.get()
+        stage_stats[stage]["blocked"] += timer() - st
+        return item
+
+    title = None
+
+    async def enrich_stage():
+        for i in range(0, len(chunks), INGESTION_SEGMENT_SIZE):
+            st = timer()
+            segment = await enrich_chunks(task, chunks[i: i + INGESTION_SEGMENT_SIZE], progress_callback)
+            stage_stats["enrich"]["busy"] += timer() - st
+            if segment is None:
+                return False
+            await put("enrich", enriched_queue, segment)
+        await put("enrich", enriched_queue, None)
+        return True
+
+    async def embedding_stage():
+        nonlocal token_count, vector_size, title
+        offset = 0
+        while (segment := await get("embedding", enriched_queue)) is not None:
+            st = timer()
+            try:
+                if title is None:
+                    title = await encode_title(segment, embedding_model)
+                    token_count += title[1]
+                tk_count, vector_size = await embedding(segment, embedding_model, task["parser_config"], progress_callback,
+                                                        title=title, offset=offset, total=len(chunks))
+            except Exception as e:
+                error_message = "Generate embedding error:{}".format(str(e))
+                progress_callback(-1, error_message)
+                logging.exception(error_message)
+                raise
+            token_count += tk_count
+            offset += len(segment)
+            stage_stats["embedding"]["busy"] += timer() - st
+            await put("embedding", embedded_queue, segment)
+        if on_embedded:
+            on_embedded()
+        await put("embedding", embedded_queue, None)
+        return True
+
+    async def indexing_stage():
+        offset = 0
+        while (segment := await get("indexing", embedded_queue)) is not None:
+            if has_canceled(task["id"]):
+                progress_callback(-1, msg="Task has been canceled.")
+                return False
+            st = timer()
+            inserted = await insert_chunks(task["id"], task["tenant_id"], task["kb_id"], segment, progress_callback, chunk_id_ledger,
+                                           offset=offset, total=len(chunks))
+            offset += len(segment)
+            stage_stats["indexing"]["busy"] += timer() - st
+            if not inserted:
+                return False
+        return True
+
+    st = timer()
+    stages = [asyncio.create_task(enrich_stage()), asyncio.create_task(embedding_stage()), asyncio.create_task(indexing_stage())]
+    inserted = True
+    try:
+        pending = set(stages)
+        while pending and inserted:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                if t.exception():
+                    raise t.exception()
+                inserted = inserted and t.result()
+    finally:
+        for t in stages:
+            t.cancel()
+        await asyncio.gather(*stages, return_exceptions=True)
+
+    progress_message = "Ingestion pipeline ({:.2f}s): {}".format(
+        timer() - st,
+        ", ".join(f"{stage} {v['busy']:.2f}s (blocked {v['blocked']:.2f}s)" for stage, v in stage_stats.items()),
+    )
+    logging.info(f"{task['name']} {progress_message}")
+    progress_callback(msg=progress_message)
+    return token_count, vector_size, inserted
+
+
 async def run_dataflow(task: dict):
     from api.db.services.canvas_service import UserCanvasService
     from rag.flow.pipeline import Pipeline
@@ -672,28 +971,32 @@ async def run_dataflow(task: dict):
             @timeout(60)
             def batch_encode(txts):
                 nonlocal embedding_model
-                return embedding_model.encode([truncate(c, embedding_model.max_length - 10) for c in txts])
+                return embedding_model.encode(txts)
 
-            vects = np.array([])
-            texts = [o.get("questions", o.get("summary", o["text"])) for o in chunks]
+            cache = EmbeddingCache.of_model(embedding_model)
+            texts = [truncate(o.get("questions", o.get("summary", o["text"])), embedding_model.max_length - 10) for o in chunks]
+            texts, text_index, duplicates = dedup_texts(texts)
+            buffer = EmbeddingBuffer(len(texts))
             delta = 0.20 / (len(texts) // settings.EMBEDDING_BATCH_SIZE + 1)
             prog = 0.8
             for i in range(0, len(texts), settings.EMBEDDING_BATCH_SIZE):
-                async with embed_limiter:
-                    vts, c = await thread_pool_exec(batch_encode, texts[i: i + settings.EMBEDDING_BATCH_SIZE])
-                if len(vects) == 0:
-                    vects = vts
-                else:
-                    vects = np.concatenate((vects, vts), axis=0)
+                vts, c = await encode_with_cache(embedding_model, texts[i: i + settings.EMBEDDING_BATCH_SIZE], batch_encode, cache)
+                buffer.append(vts)
                 embedding_token_consumption += c
                 prog += delta
                 if i % (len(texts) // settings.EMBEDDING_BATCH_SIZE / 100 + 1) == 1:
                     set_progress(task_id, prog=prog, msg=f"{i + 1} / {len(texts) // settings.EMBEDDING_BATCH_SIZE}")
 
+            vects = buffer.matrix[text_index] if duplicates else buffer.matrix
             assert len(vects) == len(chunks)
-            for i, ck in enumerate(chunks):
-                v = vects[i].tolist()
-                ck["q_%d_vec" % len(v)] = v
+            if cache.enabled:
+                set_progress(task_id, prog=prog, msg=f"Embedding {str(cache)}")
+            if duplicates:
+                saved_tks = sum(num_tokens_from_string(texts[text_index[j]]) for j in duplicates)
+                set_progress(task_id, prog=prog, msg=f"Embedding skipped {len(duplicates)} duplicated chunks, saved {saved_tks} tokens")
+            vector_field = "q_%d_vec" % buffer.vector_size
+            for ck, v in zip(chunks, vectors_for_doc_store(vects, settings.DOC_ENGINE)):
+                ck[vector_field] = v
         except Exception as e:
             set_progress(task_id, prog=-1, msg=f"[ERROR]: {e}")
             PipelineOperationLogService.create(document_id=doc_id, pipeline_id=dataflow_id,
@@ -795,15 +1098,17 @@ async def run_raptor_for_kb(row, kb_parser_config, chat_mdl, embd_mdl, vector_si
         if row["pagerank"]:
             doc[PAGERANK_FLD] = int(row["pagerank"])
 
-        for content, vctr in chunks[original_length:]:
+        raptor_tks = rag_tokenizer.tokenize_batch([content for content, _ in chunks[original_length:]],
+                                                  fine_grained=True, processes=rag_tokenizer.TOKENIZER_PROCESSES)
+        for (content, vctr), (ltks, sm_ltks) in zip(chunks[original_length:], raptor_tks):
             d = copy.deepcopy(doc)
             d["id"] = xxhash.xxh64((content + str(fake_doc_id)).encode("utf-8")).hexdigest()
             d["create_time"] = str(datetime.now()).replace("T", " ")[:19]
             d["create_timestamp_flt"] = datetime.now().timestamp()
             d[vctr_nm] = vctr.tolist()
             d["content_with_weight"] = content
-            d["content_ltks"] = rag_tokenizer.tokenize(content)
-            d["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(d["content_ltks"])
+            d["content_ltks"] = ltks
+            d["content_sm_ltks"] = sm_ltks
             res.append(d)
             tk_count += num_tokens_from_string(content)
 
@@ -867,7 +1172,8 @@ async def delete_image(kb_id, chunk_id):
         raise
 
 
-async def insert_chunks(task_id, task_tenant_id, task_dataset_id, chunks, progress_callback):
+async def insert_chunks(task_id, task_tenant_id, task_dataset_id, chunks, progress_callback, chunk_id_ledger=None,
+                        offset=0, total=None):
     """
     Insert chunks into document store (Elasticsearch OR Infinity).
 
@@ -877,7 +1183,25 @@ async def insert_chunks(task_id, task_tenant_id, task_dataset_id, chunks, progre
         task_dataset_id: Dataset/knowledge base ID
         chunks: List of chunk dictionaries to insert
         progress_callback: Callback function for progress updates
+        chunk_id_ledger: ChunkIdLedger of the task, the ids of inserted chunks are appended to it.
+                         If not given, a ledger is created and compacted before returning.
+        offset: Position of the first chunk among the task's chunks, for progress reporting
+        total: Number of chunks of the task, defaults to len(chunks)
     """
+    if total is None:
+        total = len(chunks)
+    compact = chunk_id_ledger is None
+    if compact:
+        chunk_id_ledger = ChunkIdLedger(task_id)
+    last_cancel_check = timer()
+
+    def task_canceled(force=False):
+        nonlocal last_cancel_check
+        if not force and timer() - last_cancel_check < CANCEL_CHECK_INTERVAL:
+            return False
+        last_cancel_check = timer()
+        return has_canceled(task_id)
+
     mothers = []
     mother_ids = set([])
     for ck in chunks:
@@ -901,50 +1225,66 @@ async def insert_chunks(task_id, task_tenant_id, task_dataset_id, chunks, progre
         mothers.append(mom_ck)
 
     for b in range(0, len(mothers), settings.DOC_BULK_SIZE):
-        await thread_pool_exec(settings.docStoreConn.insert, mothers[b:b + settings.DOC_BULK_SIZE],
+        await thread_pool_exec_in(THREAD_POOL_DOC_STORE, settings.docStoreConn.insert, mothers[b:b + settings.DOC_BULK_SIZE],
                                 search.index_name(task_tenant_id), task_dataset_id, )
-        task_canceled = has_canceled(task_id)
-        if task_canceled:
+        if task_canceled():
             progress_callback(-1, msg="Task has been canceled.")
             return False
 
     for b in range(0, len(chunks), settings.DOC_BULK_SIZE):
-        doc_store_result = await thread_pool_exec(settings.docStoreConn.insert, chunks[b:b + settings.DOC_BULK_SIZE],
+        doc_store_result = await thread_pool_exec_in(THREAD_POOL_DOC_STORE, settings.docStoreConn.insert, chunks[b:b + settings.DOC_BULK_SIZE],
                                                    search.index_name(task_tenant_id), task_dataset_id, )
-        task_canceled = has_canceled(task_id)
-        if task_canceled:
+        if task_canceled():
             progress_callback(-1, msg="Task has been canceled.")
             return False
         if b % 128 == 0:
-            progress_callback(prog=0.8 + 0.1 * (b + 1) / len(chunks), msg="")
+            progress_callback(prog=0.8 + 0.1 * (offset + b + 1) / max(total, 1), msg="")
         if doc_store_result:
             error_message = f"Insert chunk error: {doc_store_result}, please check log file and Elasticsearch/Infinity status!"
             progress_callback(-1, msg=error_message)
             raise Exception(error_message)
-        chunk_ids = [chunk["id"] for chunk in chunks[:b + settings.DOC_BULK_SIZE]]
-        chunk_ids_str = " ".join(chunk_ids)
-        try:
-            TaskService.update_chunk_ids(task_id, chunk_ids_str)
-        except DoesNotExist:
-            logging.warning(f"do_handle_task update_chunk_ids failed since task {task_id} is unknown.")
-            doc_store_result = await thread_pool_exec(settings.docStoreConn.delete, {"id": chunk_ids},
-                                                       search.index_name(task_tenant_id), task_dataset_id, )
-            tasks = []
-            for chunk_id in chunk_ids:
-                tasks.append(asyncio.create_task(delete_image(task_dataset_id, chunk_id)))
-            try:
-                await asyncio.gather(*tasks, return_exceptions=False)
-            except Exception as e:
-                logging.error(f"delete_image failed: {e}")
-                for t in tasks:
-                    t.cancel()
-                await asyncio.gather(*tasks, return_exceptions=True)
-                raise
-            progress_callback(-1, msg=f"Chunk updates failed since task {task_id} is unknown.")
-            return False
+        chunk_id_ledger.append([chunk["id"] for chunk in chunks[b:b + settings.DOC_BULK_SIZE]])
+
+    if task_canceled(force=True):
+        progress_callback(-1, msg="Task has been canceled.")
+        return False
+    if compact:
+        return await compact_chunk_ids(task_id, task_tenant_id, task_dataset_id, chunk_id_ledger, progress_callback)
     return True
 
 
+async def compact_chunk_ids(task_id, task_tenant_id, task_dataset_id, chunk_id_ledger, progress_callback):
+    """
+    Record the ids in the ledger as the task's chunk ids.
+    If the task has been removed meanwhile, its chunks are removed from the document store.
+    """
+    try:
+        task_exists = chunk_id_ledger.compact()
+    except DoesNotExist:
+        task_exists = False
+    logging.info(f"Task {task_id} {chunk_id_ledger.write_amplification()}")
+    if task_exists:
+        return True
+
+    logging.warning(f"do_handle_task update_chunk_ids failed since task {task_id} is unknown.")
+    chunk_ids = chunk_id_ledger.chunk_ids
+    await thread_pool_exec_in(THREAD_POOL_DOC_STORE, settings.docStoreConn.delete, {"id": chunk_ids},
+                              search.index_name(task_tenant_id), task_dataset_id, )
+    tasks = []
+    for chunk_id in chunk_ids:
+        tasks.append(asyncio.create_task(delete_image(task_dataset_id, chunk_id)))
+    try:
+        await asyncio.gather(*tasks, return_exceptions=False)
+    except Exception as e:
+        logging.error(f"delete_image failed: {e}")
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    progress_callback(-1, msg=f"Chunk updates failed since task {task_id} is unknown.")
+    return False
+
+
 @timeout(60 * 60 * 3, 1)
 async def do_handle_task(task):
     task_type = task.get("task_type", "")
@@ -971,7 +1311,7 @@ async def do_handle_task(task):
     task_parser_config = task["parser_config"]
     task_start_ts = timer()
     toc_thread = None
-    executor = concurrent.futures.ThreadPoolExecutor()
+    executor = get_thread_pool(THREAD_POOL_MODEL)
 
     # prepare the progress callback function
     progress_callback = partial(set_progress, task_id, task_from_page, task_to_page)
@@ -1094,6 +1434,7 @@ async def do_handle_task(task):
                 callback=progress_callback,
                 with_resolution=with_resolution,
                 with_community=with_community,
+                batch_merge=graphrag_conf.get("batch_merge", True),
             )
             logging.info(f"GraphRAG task result for task {task}:\n{result}")
         progress_callback(prog=1.0, msg="Knowledge Graph done ({:.2f}s)".format(timer() - start_ts))
@@ -1111,33 +1452,32 @@ async def do_handle_task(task):
             progress_callback(1., msg=f"No chunk built from {task_document_name}")
             return
         progress_callback(msg="Generate {} chunks".format(len(chunks)))
-        start_ts = timer()
-        try:
-            token_count, vector_size = await embedding(chunks, embedding_model, task_parser_config, progress_callback)
-        except Exception as e:
-            error_message = "Generate embedding error:{}".format(str(e))
-            progress_callback(-1, error_message)
-            logging.exception(error_message)
-            token_count = 0
-            raise
-        progress_message = "Embedding chunks ({:.2f}s)".format(timer() - start_ts)
-        logging.info(progress_message)
-        progress_callback(msg=progress_message)
-        if task["parser_id"].lower() == "naive" and task["parser_config"].get("toc_extraction", False):
-            toc_thread = executor.submit(build_TOC, task, chunks, progress_callback)
 
     chunk_count = len(set([chunk["id"] for chunk in chunks]))
+    chunk_id_ledger = ChunkIdLedger(task_id)
     start_ts = timer()
 
     async def _maybe_insert_chunks(_chunks):
         if has_canceled(task_id):
             return True
-        insert_result = await insert_chunks(task_id, task_tenant_id, task_dataset_id, _chunks, progress_callback)
+        insert_result = await insert_chunks(task_id, task_tenant_id, task_dataset_id, _chunks, progress_callback, chunk_id_ledger)
         return bool(insert_result)
 
+    def _start_toc():
+        nonlocal toc_thread
+        if task["parser_id"].lower() == "naive" and task["parser_config"].get("toc_extraction", False):
+            toc_thread = executor.submit(build_TOC, task, chunks, progress_callback)
+
     try:
-        if not await _maybe_insert_chunks(chunks):
-            return
+        if task_type == "raptor":
+            if not await _maybe_insert_chunks(chunks):
+                return
+        else:
+            token_count, vector_size, inserted = await run_ingestion_pipeline(task, chunks, embedding_model,
+                                                                              progress_callback, chunk_id_ledger,
+                                                                              on_embedded=_start_toc)
+            if not inserted:
+                return
 
         logging.info(
             "Indexing doc({}), page({}-{}), chunks({}), elapsed: {:.2f}".format(
@@ -1156,6 +1496,9 @@ async def do_handle_task(task):
                     return
                 DocumentService.increment_chunk_num(task_doc_id, task_dataset_id, 0, 1, 0)
 
+        if not await compact_chunk_ids(task_id, task_tenant_id, task_dataset_id, chunk_id_ledger, progress_callback):
+            return
+
         if has_canceled(task_id):
             progress_callback(-1, msg="Task has been canceled.")
             return
@@ -1171,13 +1514,15 @@ async def do_handle_task(task):
     finally:
         if has_canceled(task_id):
             try:
-                exists = await thread_pool_exec(
+                exists = await thread_pool_exec_in(
+                    THREAD_POOL_DOC_STORE,
                     settings.docStoreConn.index_exist,
                     search.index_name(task_tenant_id),
                     task_dataset_id,
                 )
                 if exists:
-                    await thread_pool_exec(
+                    await thread_pool_exec_in(
+                        THREAD_POOL_DOC_STORE,
                         settings.docStoreConn.delete,
                         {"doc_id": task_doc_id},
                         search.index_name(task_tenant_id),
@@ -1220,6 +1565,10 @@ async def handle_task():
             pass
         logging.exception(f"handle_task got exception for task {json.dumps(task)}")
     finally:
+        try:
+            await thread_pool_exec(PROGRESS_AGGREGATOR.close, task_id)
+        except Exception:
+            logging.exception(f"handle_task failed to flush progress of task {task_id}")
         task_document_ids = []
         if task_type in ["graphrag", "raptor", "mindmap"]:
             task_document_ids = task["doc_ids"]
@@ -1275,6 +1624,7 @@ async def report_status():
             "done": DONE_TASKS,
             "failed": FAILED_TASKS,
             "current": current,
+            "thread_pools": thread_pool_stats(),
         })
 
         # Report heartbeat to Redis
@@ -1366,6 +1716,7 @@ async def main():
     signal.signal(signal.SIGTERM, signal_handler)
 
     report_task = asyncio.create_task(report_status())
+    progress_task = asyncio.create_task(flush_progress())
     tasks = []
 
     logging.info(f"RAGFlow ingestion is ready after {time.time() - start_ts}s initialization.")
@@ -1379,7 +1730,8 @@ async def main():
             t.cancel()
         await asyncio.gather(*tasks, return_exceptions=True)
         report_task.cancel()
-        await asyncio.gather(report_task, return_exceptions=True)
+        progress_task.cancel()
+        await asyncio.gather(report_task, progress_task, return_exceptions=True)
     logging.error("BUG!!! You should not reach here!!!")
 
 
@@ -0,0 +1,183 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Helpers for embedding chunks at ingestion time.
+
+The content-addressed cache keys vectors by the embedding model (factory, base
+URL and model name, so same-named models served from different endpoints do not
+share vectors) and the xxhash of the text actually sent to the model, and stores
+them in Redis as raw float32 bytes (base64 wrapped, since the shared Redis client
+decodes responses). Every hit refreshes the entry's TTL, so entries which keep
+being re-used survive while cold ones expire. The cache shares Redis with task
+queues and locks, so it is off unless EMBEDDING_CACHE_ENABLED is set.
+"""
+
+import base64
+import logging
+import os
+
+import numpy as np
+import xxhash
+
+EMBEDDING_CACHE_ENABLED = os.environ.get("EMBEDDING_CACHE_ENABLED", "0").lower() in ["1", "true", "yes"]
+EMBEDDING_CACHE_TTL = int(os.environ.get("EMBEDDING_CACHE_TTL", 24 * 3600))
+EMBEDDING_CACHE_PREFIX = "embd_cache:"
+
+
+def embedding_cache_key(llm_name: str, txt: str, llm_factory: str = "", api_base: str = "") -> str:
+    hasher = xxhash.xxh3_128()
+    for part in [llm_factory, api_base, llm_name]:
+        hasher.update(str(part or "").encode("utf-8"))
+        hasher.update(b"\x00")
+    hasher.update(str(txt).encode("utf-8", "surrogatepass"))
+    return EMBEDDING_CACHE_PREFIX + hasher.hexdigest()
+
+
+def pack_vector(vector) -> str:
+    return base64.b64encode(np.asarray(vector, dtype=np.float32).tobytes()).decode("ascii")
+
+
+def unpack_vector(value) -> np.ndarray:
+    if isinstance(value, str):
+        value = value.encode("ascii")
+    return np.frombuffer(base64.b64decode(value), dtype=np.float32)
+
+
+def dedup_texts(texts: list[str]) -> tuple[list[str], np.ndarray, list[int]]:
+    """
+    Collapse repeated texts so each distinct one is embedded only once.
+
+    Returns the distinct texts in first-seen order, the position of every input
+    text among them (to scatter vectors back with `vectors[index]`), and the
+    input positions which repeat an earlier text.
+    """
+    positions = {}
+    index = np.empty(len(texts), dtype=np.int64)
+    duplicates = []
+    for i, t in enumerate(texts):
+        j = positions.get(t)
+        if j is None:
+            j = positions[t] = len(positions)
+        else:
+            duplicates.append(i)
+        index[i] = j
+    return list(positions.keys()), index, duplicates
+
+
+class EmbeddingCache:
+    """
+    Bulk get/put of embeddings for one embedding model, counting hits and misses.
+    """
+
+    def __init__(self, llm_name: str, conn=None, ttl: int = EMBEDDING_CACHE_TTL, enabled: bool = EMBEDDING_CACHE_ENABLED,
+                 llm_factory: str = "", api_base: str = ""):
+        if conn is None and enabled:
+            from rag.utils.redis_conn import REDIS_CONN
+            conn = REDIS_CONN
+        self.llm_name = llm_name
+        self.llm_factory = llm_factory
+        self.api_base = api_base
+        self.conn = conn
+        self.ttl = ttl
+        self.enabled = enabled and conn is not None and ttl > 0
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def of_model(cls, mdl, **kwargs):
+        return cls(mdl.llm_name, llm_factory=getattr(mdl, "llm_factory", ""), api_base=getattr(mdl, "api_base", ""), **kwargs)
+
+    def _key(self, txt: str) -> str:
+        return embedding_cache_key(self.llm_name, txt, self.llm_factory, self.api_base)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get(self, texts: list[str]) -> list[np.ndarray | None]:
+        if not self.enabled or not texts:
+            self.misses += len(texts)
+            return [None] * len(texts)
+        keys = [self._key(t) for t in texts]
+        res = [None] * len(texts)
+        hit_keys = []
+        try:
+            values = self.conn.mget(keys) or []
+            for i, v in enumerate(values):
+                if not v:
+                    continue
+                res[i] = unpack_vector(v)
+                hit_keys.append(keys[i])
+            self.conn.mexpire(hit_keys, self.ttl)
+        except Exception as e:
+            logging.warning(f"EmbeddingCache.get got exception: {e}")
+        self.hits += len(hit_keys)
+        self.misses += len(texts) - len(hit_keys)
+        return res
+
+    def put(self, texts: list[str], vectors):
+        if not self.enabled or not texts:
+            return
+        mapping = {self._key(t): pack_vector(v) for t, v in zip(texts, vectors)}
+        try:
+            self.conn.mset(mapping, self.ttl)
+        except Exception as e:
+            logging.warning(f"EmbeddingCache.put got exception: {e}")
+
+    def __str__(self):
+        return "embedding cache hits {}/{} ({:.1%})".format(self.hits, self.hits + self.misses, self.hit_rate)
+
+
+class EmbeddingBuffer:
+    """
+    A float32 matrix with one row per text, allocated once the vector size is known
+    and filled in place batch by batch, instead of growing it with np.concatenate.
+    """
+
+    def __init__(self, rows: int):
+        self.rows = rows
+        self.filled = 0
+        self.matrix = np.empty((rows, 0), dtype=np.float32)
+
+    def append(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(vectors) == 0:
+            return
+        if self.filled == 0:
+            self.matrix = np.empty((self.rows, vectors.shape[1]), dtype=np.float32)
+        if self.filled + len(vectors) > self.rows:
+            raise ValueError(f"EmbeddingBuffer overflow: {self.filled + len(vectors)} > {self.rows} rows")
+        self.matrix[self.filled: self.filled + len(vectors)] = vectors
+        self.filled += len(vectors)
+
+    @property
+    def vector_size(self) -> int:
+        return self.matrix.shape[1]
+
+
+def vectors_for_doc_store(matrix: np.ndarray, doc_engine: str) -> list:
+    """
+    Split a vector matrix into per-chunk values for the doc store writers.
+
+    The Elasticsearch and OpenSearch clients serialize numpy arrays themselves, so
+    they get row views of the matrix; other engines get plain lists, converted in
+    one call rather than row by row.
+    """
+    if doc_engine.lower() in ["elasticsearch", "opensearch"]:
+        return list(matrix)
+    return matrix.tolist()
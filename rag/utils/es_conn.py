@@ -24,6 +24,7 @@ from elastic_transport import ConnectionTimeout
 from common.decorator import singleton
 from common.doc_store.doc_store_base import MatchTextExpr, OrderByExpr, MatchExpr, MatchDenseExpr, FusionExpr
 from common.doc_store.es_conn_base import ESConnectionBase
+from rag.utils.retrieval_cache import invalidates_retrieval_cache
 from common.float_utils import get_float
 from common.constants import PAGERANK_FLD, TAG_FLD
 
@@ -55,6 +56,37 @@ class ESConnection(ESConnectionBase):
         if isinstance(index_names, str):
             index_names = index_names.split(",")
         assert isinstance(index_names, list) and len(index_names) > 0
+        q = self._search_query(select_fields, highlight_fields, condition, match_expressions, order_by, offset, limit,
+                               knowledgebase_ids, agg_fields, rank_feature)
+        self.logger.debug(f"ESConnection.search {str(index_names)} query: " + json.dumps(q))
+
+        for i in range(ATTEMPT_TIME):
+            try:
+                # print(json.dumps(q, ensure_ascii=False))
+                res = self.es.search(index=index_names,
+                                     body=q,
+                                     timeout="600s",
+                                     # search_type="dfs_query_then_fetch",
+                                     track_total_hits=True)
+                if str(res.get("timed_out", "")).lower() == "true":
+                    raise Exception("Es Timeout.")
+                self.logger.debug(f"ESConnection.search {str(index_names)} res: " + str(res))
+                return res
+            except ConnectionTimeout:
+                self.logger.exception("ES request timeout")
+                self._connect()
+                continue
+            except Exception as e:
+                self.logger.exception(f"ESConnection.search {str(index_names)} query: " + str(q) + str(e))
+                raise e
+
+        self.logger.error(f"ESConnection.search timeout for {ATTEMPT_TIME} times!")
+        raise Exception("ESConnection.search timeout.")
+
+    def _search_query(self, select_fields: list[str], highlight_fields: list[str], condition: dict,
+                      match_expressions: list[MatchExpr],
+                      order_by: OrderByExpr, offset: int, limit: int, knowledgebase_ids: list[str],
+                      agg_fields: list[str] | None = None, rank_feature: dict | None = None) -> dict:
         assert "_id" not in condition
 
         bool_query = Q("bool", must=[])
@@ -119,6 +151,9 @@ class ESConnection(ESConnectionBase):
 
         if bool_query:
             s = s.query(bool_query)
+        # Only the selected fields are returned; highlighting still reads the whole stored source.
+        if select_fields:
+            s = s.source(list(dict.fromkeys(select_fields)))
         for field in highlight_fields:
             s = s.highlight(field)
 
@@ -141,33 +176,53 @@ class ESConnection(ESConnectionBase):
 
         if limit > 0:
             s = s[offset:offset + limit]
-        q = s.to_dict()
-        self.logger.debug(f"ESConnection.search {str(index_names)} query: " + json.dumps(q))
+        return s.to_dict()
+
+    def msearch(self, searches: list[list]) -> list:
+        """
+        Run several searches, each given as the positional arguments of `search`, in one round trip.
+        Refers to https://www.elastic.co/guide/en/elasticsearch/reference/current/search-multi-search.html
+        """
+        if not searches:
+            return []
+        body = []
+        for args in searches:
+            index_names = args[7]
+            if isinstance(index_names, str):
+                index_names = index_names.split(",")
+            assert isinstance(index_names, list) and len(index_names) > 0
+            q = self._search_query(*args[0:7], *args[8:])
+            q["track_total_hits"] = True
+            q["timeout"] = "600s"
+            body.extend([{"index": index_names}, q])
+        self.logger.debug(f"ESConnection.msearch {len(searches)} queries")
 
         for i in range(ATTEMPT_TIME):
             try:
-                # print(json.dumps(q, ensure_ascii=False))
-                res = self.es.search(index=index_names,
-                                     body=q,
-                                     timeout="600s",
-                                     # search_type="dfs_query_then_fetch",
-                                     track_total_hits=True,
-                                     _source=True)
-                if str(res.get("timed_out", "")).lower() == "true":
-                    raise Exception("Es Timeout.")
-                self.logger.debug(f"ESConnection.search {str(index_names)} res: " + str(res))
-                return res
+                res = self.es.msearch(searches=body)
+                responses = res["responses"]
+                for r in responses:
+                    if "error" in r:
+                        raise Exception(f"ESConnection.msearch error: {r['error']}")
+                    if str(r.get("timed_out", "")).lower() == "true":
+                        raise Exception("Es Timeout.")
+                return responses
             except ConnectionTimeout:
                 self.logger.exception("ES request timeout")
                 self._connect()
                 continue
             except Exception as e:
-                self.logger.exception(f"ESConnection.search {str(index_names)} query: " + str(q) + str(e))
+                self.logger.exception(f"ESConnection.msearch {len(searches)} queries: " + str(e))
                 raise e
 
-        self.logger.error(f"ESConnection.search timeout for {ATTEMPT_TIME} times!")
-        raise Exception("ESConnection.search timeout.")
+        self.logger.error(f"ESConnection.msearch timeout for {ATTEMPT_TIME} times!")
+        raise Exception("ESConnection.msearch timeout.")
+
+    @invalidates_retrieval_cache
+    def delete_idx(self, index_name: str, dataset_id: str):
+        return super().delete_idx(index_name, dataset_id)
 
+    @invalidates_retrieval_cache
     def insert(self, documents: list[dict], index_name: str, knowledgebase_id: str = None) -> list[str]:
         # Refers to https://www.elastic.co/guide/en/elasticsearch/reference/current/docs-bulk.html
         operations = []
@@ -206,6 +261,7 @@ class ESConnection(ESConnectionBase):
 
         return res
 
+    @invalidates_retrieval_cache
     def update(self, condition: dict, new_value: dict, index_name: str, knowledgebase_id: str) -> bool:
         doc = copy.deepcopy(new_value)
         doc.pop("id", None)
@@ -300,6 +356,7 @@ class ESConnection(ESConnectionBase):
                 break
         return False
 
+    @invalidates_retrieval_cache
     def delete(self, condition: dict, index_name: str, knowledgebase_id: str) -> int:
         assert "_id" not in condition
         condition["kb_id"] = knowledgebase_id
@@ -24,6 +24,7 @@ import pandas as pd
 from common.constants import PAGERANK_FLD, TAG_FLD
 from common.doc_store.doc_store_base import MatchExpr, MatchTextExpr, MatchDenseExpr, FusionExpr, OrderByExpr
 from common.doc_store.infinity_conn_base import InfinityConnectionBase
+from rag.utils.retrieval_cache import invalidates_retrieval_cache
 
 
 @singleton
@@ -298,6 +299,39 @@ class InfinityConnection(InfinityConnectionBase):
         res_fields = self.get_fields(res, list(fields))
         return res_fields.get(chunk_id, None)
 
+    def mget(self, chunk_ids: list[str], index_names: str | list[str], knowledgebase_ids: list[str]) -> dict[str, dict]:
+        if isinstance(index_names, str):
+            index_names = index_names.split(",")
+        if not chunk_ids:
+            return {}
+        inf_conn = self.connPool.get_conn()
+        db_instance = inf_conn.get_database(self.dbName)
+        df_list = list()
+        id_list = ", ".join(f"'{chunk_id}'" for chunk_id in chunk_ids)
+        for index_name in index_names:
+            for knowledgebaseId in knowledgebase_ids:
+                table_name = f"{index_name}_{knowledgebaseId}"
+                try:
+                    table_instance = db_instance.get_table(table_name)
+                except Exception:
+                    continue
+                kb_res, _ = table_instance.output(["*"]).filter(f"id IN ({id_list})").to_df()
+                self.logger.debug(f"INFINITY mget table: {table_name}, result: {str(kb_res)}")
+                df_list.append(kb_res)
+        self.connPool.release_conn(inf_conn)
+        res = self.concat_dataframes(df_list, ["id"])
+        fields = set(res.columns.tolist())
+        for field in ["docnm_kwd", "title_tks", "title_sm_tks", "important_kwd", "important_tks", "question_kwd",
+                      "question_tks", "content_with_weight", "content_ltks", "content_sm_ltks", "authors_tks",
+                      "authors_sm_tks"]:
+            fields.add(field)
+        return self.get_fields(res, list(fields))
+
+    @invalidates_retrieval_cache
+    def delete_idx(self, index_name: str, dataset_id: str):
+        return super().delete_idx(index_name, dataset_id)
+
+    @invalidates_retrieval_cache
     def insert(self, documents: list[dict], index_name: str, knowledgebase_id: str = None) -> list[str]:
         inf_conn = self.connPool.get_conn()
         db_instance = inf_conn.get_database(self.dbName)
@@ -429,6 +463,7 @@ class InfinityConnection(InfinityConnectionBase):
         self.logger.debug(f"INFINITY inserted into {table_name} {str_ids}.")
         return []
 
+    @invalidates_retrieval_cache
     def update(self, condition: dict, new_value: dict, index_name: str, knowledgebase_id: str) -> bool:
         # if 'position_int' in newValue:
         #     logger.info(f"update position_int: {newValue['position_int']}")
@@ -546,6 +581,10 @@ class InfinityConnection(InfinityConnectionBase):
         self.connPool.release_conn(inf_conn)
         return True
 
+    @invalidates_retrieval_cache
+    def delete(self, condition: dict, index_name: str, knowledgebase_id: str) -> int:
+        return super().delete(condition, index_name, knowledgebase_id)
+
     """
     Helper functions for search result
     """
@@ -40,6 +40,7 @@ from common.float_utils import get_float
 from common.doc_store.doc_store_base import DocStoreConnection, MatchExpr, OrderByExpr, FusionExpr, MatchTextExpr, \
     MatchDenseExpr
 from rag.nlp import rag_tokenizer
+from rag.utils.retrieval_cache import invalidates_retrieval_cache
 
 ATTEMPT_TIME = 2
 OB_QUERY_TIMEOUT = int(os.environ.get("OB_QUERY_TIMEOUT", "100_000_000"))
@@ -614,6 +615,7 @@ class OBConnection(DocStoreConnection):
             # always refresh metadata to make sure it contains the latest table structure
             self.client.refresh_metadata([indexName])
 
+    @invalidates_retrieval_cache
     def delete_idx(self, indexName: str, knowledgebaseId: str):
         if len(knowledgebaseId) > 0:
             # The index need to be alive after any kb deletion since all kb under this tenant are in one index.
@@ -1332,6 +1334,7 @@ class OBConnection(DocStoreConnection):
             logger.error(f"Error getting chunk {chunkId}: {str(e)}")
             raise
 
+    @invalidates_retrieval_cache
     def insert(self, documents: list[dict], indexName: str, knowledgebaseId: str = None) -> list[str]:
         if not documents:
             return []
@@ -1407,6 +1410,7 @@ class OBConnection(DocStoreConnection):
             res.append(str(e))
         return res
 
+    @invalidates_retrieval_cache
     def update(self, condition: dict, newValue: dict, indexName: str, knowledgebaseId: str) -> bool:
         if not self._check_table_exists_cached(indexName):
             return True
@@ -1458,6 +1462,7 @@ class OBConnection(DocStoreConnection):
             logger.error(f"OBConnection.update error: {str(e)}")
         return False
 
+    @invalidates_retrieval_cache
     def delete(self, condition: dict, indexName: str, knowledgebaseId: str) -> int:
         if not self._check_table_exists_cached(indexName):
             return 0
@@ -31,6 +31,7 @@ from common.doc_store.doc_store_base import DocStoreConnection, MatchExpr, Order
 from rag.nlp import is_english, rag_tokenizer
 from common.constants import PAGERANK_FLD, TAG_FLD
 from common import settings
+from rag.utils.retrieval_cache import invalidates_retrieval_cache
 
 ATTEMPT_TIME = 2
 
@@ -101,6 +102,7 @@ class OSConnection(DocStoreConnection):
         except Exception:
             logger.exception("OSConnection.createIndex error %s" % (indexName))
 
+    @invalidates_retrieval_cache
     def delete_idx(self, indexName: str, knowledgebaseId: str):
         if len(knowledgebaseId) > 0:
             # The index need to be alive after any kb deletion since all kb under this tenant are in one index.
@@ -144,10 +146,36 @@ class OSConnection(DocStoreConnection):
         """
         Refers to https://github.com/opensearch-project/opensearch-py/blob/main/guides/dsl.md
         """
-        use_knn = False
         if isinstance(indexNames, str):
             indexNames = indexNames.split(",")
         assert isinstance(indexNames, list) and len(indexNames) > 0
+        q = self._search_query(selectFields, highlightFields, condition, matchExprs, orderBy, offset, limit,
+                               knowledgebaseIds, aggFields, rank_feature)
+        logger.debug(f"OSConnection.search {str(indexNames)} query: " + json.dumps(q))
+
+        for i in range(ATTEMPT_TIME):
+            try:
+                res = self.os.search(index=indexNames,
+                                     body=q,
+                                     timeout=600,
+                                     # search_type="dfs_query_then_fetch",
+                                     track_total_hits=True)
+                if str(res.get("timed_out", "")).lower() == "true":
+                    raise Exception("OpenSearch Timeout.")
+                logger.debug(f"OSConnection.search {str(indexNames)} res: " + str(res))
+                return res
+            except Exception as e:
+                logger.exception(f"OSConnection.search {str(indexNames)} query: " + str(q))
+                if str(e).find("Timeout") > 0:
+                    continue
+                raise e
+        logger.error(f"OSConnection.search timeout for {ATTEMPT_TIME} times!")
+        raise Exception("OSConnection.search timeout.")
+
+    def _search_query(self, selectFields: list[str], highlightFields: list[str], condition: dict, matchExprs: list[MatchExpr],
+                      orderBy: OrderByExpr, offset: int, limit: int, knowledgebaseIds: list[str],
+                      aggFields: list[str] | None = None, rank_feature: dict | None = None) -> dict:
+        use_knn = False
         assert "_id" not in condition
 
         bqry = Q("bool", must=[])
@@ -216,6 +244,9 @@ class OSConnection(DocStoreConnection):
 
         if bqry:
             s = s.query(bqry)
+        # Only the selected fields are returned; force_source highlighting still reads the whole stored source.
+        if selectFields:
+            s = s.source(list(dict.fromkeys(selectFields)))
         for field in highlightFields:
             s = s.highlight(field, force_source=True, no_match_size=30, require_field_match=False)
 
@@ -233,37 +264,51 @@ class OSConnection(DocStoreConnection):
                 orders.append({field: order_info})
             s = s.sort(*orders)
 
-        for fld in aggFields:
+        for fld in aggFields or []:
             s.aggs.bucket(f'aggs_{fld}', 'terms', field=fld, size=1000000)
 
         if limit > 0:
             s = s[offset:offset + limit]
         q = s.to_dict()
-        logger.debug(f"OSConnection.search {str(indexNames)} query: " + json.dumps(q))
-
         if use_knn:
             del q["query"]
             q["query"] = {"knn": knn_query}
+        return q
+
+    def msearch(self, searches: list[list]) -> list:
+        """
+        Run several searches, each given as the positional arguments of `search`, in one round trip.
+        """
+        if not searches:
+            return []
+        body = []
+        for args in searches:
+            indexNames = args[7]
+            if isinstance(indexNames, str):
+                indexNames = indexNames.split(",")
+            assert isinstance(indexNames, list) and len(indexNames) > 0
+            q = self._search_query(*args[0:7], *args[8:])
+            q["track_total_hits"] = True
+            q["timeout"] = "600s"
+            body.extend([{"index": indexNames}, q])
+        logger.debug(f"OSConnection.msearch {len(searches)} queries")
 
         for i in range(ATTEMPT_TIME):
             try:
-                res = self.os.search(index=indexNames,
-                                     body=q,
-                                     timeout=600,
-                                     # search_type="dfs_query_then_fetch",
-                                     track_total_hits=True,
-                                     _source=True)
-                if str(res.get("timed_out", "")).lower() == "true":
-                    raise Exception("OpenSearch Timeout.")
-                logger.debug(f"OSConnection.search {str(indexNames)} res: " + str(res))
-                return res
+                responses = self.os.msearch(body=body)["responses"]
+                for r in responses:
+                    if "error" in r:
+                        raise Exception(f"OSConnection.msearch error: {r['error']}")
+                    if str(r.get("timed_out", "")).lower() == "true":
+                        raise Exception("OpenSearch Timeout.")
+                return responses
             except Exception as e:
-                logger.exception(f"OSConnection.search {str(indexNames)} query: " + str(q))
+                logger.exception(f"OSConnection.msearch {len(searches)} queries")
                 if str(e).find("Timeout") > 0:
                     continue
                 raise e
-        logger.error(f"OSConnection.search timeout for {ATTEMPT_TIME} times!")
-        raise Exception("OSConnection.search timeout.")
+        logger.error(f"OSConnection.msearch timeout for {ATTEMPT_TIME} times!")
+        raise Exception("OSConnection.msearch timeout.")
 
     def get(self, chunkId: str, indexName: str, knowledgebaseIds: list[str]) -> dict | None:
         for i in range(ATTEMPT_TIME):
@@ -285,6 +330,31 @@ class OSConnection(DocStoreConnection):
         logger.error(f"OSConnection.get timeout for {ATTEMPT_TIME} times!")
         raise Exception("OSConnection.get timeout.")
 
+    def mget(self, chunkIds: list[str], indexNames: str | list[str], knowledgebaseIds: list[str]) -> dict[str, dict]:
+        if isinstance(indexNames, str):
+            indexNames = indexNames.split(",")
+        if not chunkIds:
+            return {}
+        docs = [{"_index": indexName, "_id": chunkId} for indexName in indexNames for chunkId in chunkIds]
+        for i in range(ATTEMPT_TIME):
+            try:
+                res = self.os.mget(body={"docs": docs})
+                chunks = {}
+                for d in res["docs"]:
+                    if d.get("found") and d["_id"] not in chunks:
+                        chunk = d["_source"]
+                        chunk["id"] = d["_id"]
+                        chunks[d["_id"]] = chunk
+                return chunks
+            except Exception as e:
+                logger.exception(f"OSConnection.mget({len(chunkIds)} ids) got exception")
+                if str(e).find("Timeout") > 0:
+                    continue
+                raise e
+        logger.error(f"OSConnection.mget timeout for {ATTEMPT_TIME} times!")
+        raise Exception("OSConnection.mget timeout.")
+
+    @invalidates_retrieval_cache
     def insert(self, documents: list[dict], indexName: str, knowledgebaseId: str = None) -> list[str]:
         # Refers to https://opensearch.org/docs/latest/api-reference/document-apis/bulk/
         operations = []
@@ -321,6 +391,7 @@ class OSConnection(DocStoreConnection):
                     continue
         return res
 
+    @invalidates_retrieval_cache
     def update(self, condition: dict, newValue: dict, indexName: str, knowledgebaseId: str) -> bool:
         doc = copy.deepcopy(newValue)
         doc.pop("id", None)
@@ -404,6 +475,7 @@ class OSConnection(DocStoreConnection):
                 break
         return False
 
+    @invalidates_retrieval_cache
     def delete(self, condition: dict, indexName: str, knowledgebaseId: str) -> int:
         assert "_id" not in condition
         condition["kb_id"] = knowledgebaseId
@@ -512,7 +584,10 @@ class OSConnection(DocStoreConnection):
                 ans[d["_id"]] = txt
                 continue
 
-            txt = d["_source"][fieldnm]
+            txt = d["_source"].get(fieldnm)
+            if not txt:
+                ans[d["_id"]] = "...".join([a for a in list(hlts.items())[0][1]])
+                continue
             txt = re.sub(r"[\r\n]", " ", txt, flags=re.IGNORECASE | re.MULTILINE)
             txts = []
             for t in re.split(r"[.?!;\n]", txt):
@@ -0,0 +1,190 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Cache of query embeddings for retrieval.
+
+Chats, agents and the MCP server keep asking the same questions, and every
+`encode_queries` call costs a model round trip plus a token usage write. Query
+vectors are kept in a per-process LRU and, with QUERY_VECTOR_CACHE_REDIS on, in
+Redis as well so that all workers share them. Entries are keyed by tenant, the
+embedding model (factory, base URL and model name, as for the embedding cache)
+and the whitespace-normalized query, which is also the text actually embedded.
+"""
+
+import asyncio
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import xxhash
+
+from common.misc_utils import thread_pool_exec_in, THREAD_POOL_MODEL
+from rag.utils.embedding_cache import pack_vector, unpack_vector
+
+QUERY_VECTOR_CACHE_SIZE = int(os.environ.get("QUERY_VECTOR_CACHE_SIZE", 4096))
+QUERY_VECTOR_CACHE_REDIS = os.environ.get("QUERY_VECTOR_CACHE_REDIS", "0").lower() in ["1", "true", "yes"]
+QUERY_VECTOR_CACHE_TTL = int(os.environ.get("QUERY_VECTOR_CACHE_TTL", 3600))
+QUERY_VECTOR_CACHE_PREFIX = "qvec_cache:"
+
+
+def normalize_query(txt) -> str:
+    return re.sub(r"\s+", " ", str(txt)).strip()
+
+
+def query_vector_cache_key(tenant_id, llm_name, txt, llm_factory="", api_base="") -> str:
+    hasher = xxhash.xxh3_128()
+    for part in [tenant_id, llm_factory or "", api_base or "", llm_name, txt]:
+        hasher.update(str(part).encode("utf-8", "surrogatepass"))
+        hasher.update(b"\x00")
+    return QUERY_VECTOR_CACHE_PREFIX + hasher.hexdigest()
+
+
+class QueryVectorCache:
+    """
+    A thread safe LRU of query vectors with an optional Redis tier, counting hits and misses.
+    """
+
+    def __init__(self, max_size: int = QUERY_VECTOR_CACHE_SIZE, conn=None, use_redis: bool = QUERY_VECTOR_CACHE_REDIS,
+                 ttl: int = QUERY_VECTOR_CACHE_TTL):
+        if conn is None and use_redis:
+            from rag.utils.redis_conn import REDIS_CONN
+            conn = REDIS_CONN
+        self.max_size = max_size
+        self.conn = conn
+        self.use_redis = use_redis and conn is not None and ttl > 0
+        self.ttl = ttl
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key_of(emb_mdl, txt) -> str | None:
+        llm_name = getattr(emb_mdl, "llm_name", None)
+        if not llm_name:
+            return None
+        return query_vector_cache_key(getattr(emb_mdl, "tenant_id", ""), llm_name, txt,
+                                      getattr(emb_mdl, "llm_factory", ""), getattr(emb_mdl, "api_base", ""))
+
+    def _get_memory(self, key):
+        with self._lock:
+            v = self._lru.get(key)
+            if v is not None:
+                self._lru.move_to_end(key)
+                self.memory_hits += 1
+            return v
+
+    def _put_memory(self, key, vector):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._lru[key] = vector
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.max_size:
+                self._lru.popitem(last=False)
+
+    def _get_redis(self, key):
+        if not self.use_redis:
+            return None
+        try:
+            v = self.conn.get(key)
+            if v:
+                with self._lock:
+                    self.redis_hits += 1
+                return unpack_vector(v)
+        except Exception as e:
+            logging.warning(f"QueryVectorCache redis get got exception: {e}")
+        return None
+
+    def _put_redis(self, key, vector):
+        if not self.use_redis:
+            return
+        try:
+            self.conn.set(key, pack_vector(vector), self.ttl)
+        except Exception as e:
+            logging.warning(f"QueryVectorCache redis set got exception: {e}")
+
+    def encode(self, emb_mdl, txt) -> np.ndarray:
+        """
+        The query vector of `txt`, from the cache or else from `emb_mdl.encode_queries`.
+        """
+        txt = normalize_query(txt)
+        key = self.key_of(emb_mdl, txt)
+        if key is None:
+            qv, _ = emb_mdl.encode_queries(txt)
+            return qv
+        v = self._get_memory(key)
+        if v is not None:
+            return v
+        v = self._get_redis(key)
+        if v is None:
+            with self._lock:
+                self.misses += 1
+            qv, _ = emb_mdl.encode_queries(txt)
+            v = np.array(qv)
+            self._put_redis(key, v)
+        v.setflags(write=False)
+        self._put_memory(key, v)
+        return v
+
+    async def async_encode(self, emb_mdl, txt) -> np.ndarray:
+        """
+        Same as encode, answering in-process hits without leaving the event loop.
+        """
+        key = self.key_of(emb_mdl, normalize_query(txt))
+        if key is not None:
+            v = self._get_memory(key)
+            if v is not None:
+                return v
+        return await thread_pool_exec_in(THREAD_POOL_MODEL, self.encode, emb_mdl, txt)
+
+    async def async_encode_batch(self, emb_mdl, txts: list[str]) -> list[np.ndarray]:
+        """
+        The query vectors of several texts. Each distinct text missing from the cache is embedded
+        with its own `encode_queries` call, since many models embed queries unlike documents, and
+        those calls run concurrently.
+        """
+        uniq = list(dict.fromkeys(normalize_query(txt) for txt in txts))
+        vectors = await asyncio.gather(*[self.async_encode(emb_mdl, txt) for txt in uniq])
+        vectors = dict(zip(uniq, vectors))
+        return [vectors[normalize_query(txt)] for txt in txts]
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.memory_hits + self.redis_hits + self.misses
+        return (self.memory_hits + self.redis_hits) / total if total else 0.0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._lru),
+                "memory_hits": self.memory_hits,
+                "redis_hits": self.redis_hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hit_rate, 4),
+            }
+
+    def clear(self):
+        with self._lock:
+            self._lru.clear()
+
+
+QUERY_VECTOR_CACHE = QueryVectorCache()
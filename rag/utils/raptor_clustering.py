@@ -0,0 +1,122 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Choice of the number of clusters for RAPTOR.
+
+RAPTOR clusters each layer with the Gaussian mixture of lowest BIC. Rather than fitting a
+mixture for every number of clusters, a coarse grid of numbers is fitted first, then the
+best bracket of the grid is narrowed by golden-section search. The grid also holds the
+number the previous layer would suggest at the same ratio of clusters to points. Fits of a
+round can run in a process pool, and the mixture chosen is returned so it is not refitted.
+
+RAPTOR_CLUSTER_SEARCH=linear fits every number as before.
+"""
+
+import logging
+import math
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable
+
+import numpy as np
+from sklearn.mixture import GaussianMixture
+
+RAPTOR_CLUSTER_SEARCH = os.environ.get("RAPTOR_CLUSTER_SEARCH", "golden")
+RAPTOR_CLUSTER_GRID = int(os.environ.get("RAPTOR_CLUSTER_GRID", 8))
+RAPTOR_CLUSTER_PROCESSES = int(os.environ.get("RAPTOR_CLUSTER_PROCESSES", 0))
+
+INVPHI = (math.sqrt(5) - 1) / 2
+
+
+def fit_gaussian_mixture(embeddings: np.ndarray, n: int, random_state: int) -> tuple[float, GaussianMixture]:
+    gm = GaussianMixture(n_components=n, random_state=random_state)
+    gm.fit(embeddings)
+    return gm.bic(embeddings), gm
+
+
+class GaussianMixtureSearch:
+    """
+    Finds the number of clusters, up to `max_cluster` - 1, whose Gaussian mixture has the lowest BIC.
+    One instance is meant to serve all layers of a RAPTOR tree.
+    """
+
+    def __init__(self, max_cluster: int, search: str = RAPTOR_CLUSTER_SEARCH, grid: int = RAPTOR_CLUSTER_GRID,
+                 processes: int = RAPTOR_CLUSTER_PROCESSES):
+        self.max_cluster = max_cluster
+        self.search_method = search
+        self.grid = max(3, grid)
+        self.processes = processes
+        self.fits = {}
+        self._ratio = None
+
+    def _fit(self, embeddings: np.ndarray, ns, random_state: int, should_stop: Callable | None):
+        todo = [n for n in dict.fromkeys(ns) if n not in self.fits]
+        if not todo:
+            return
+        if should_stop:
+            should_stop()
+        if self.processes > 0 and len(todo) > 1:
+            pool = _process_pool(self.processes)
+            results = pool.map(fit_gaussian_mixture, [embeddings] * len(todo), todo, [random_state] * len(todo))
+        else:
+            results = (fit_gaussian_mixture(embeddings, n, random_state) for n in todo)
+        self.fits.update(zip(todo, results))
+
+    def search(self, embeddings: np.ndarray, random_state: int,
+               should_stop: Callable | None = None) -> tuple[int, GaussianMixture]:
+        """
+        The number of clusters and its fitted mixture. `should_stop` is called before each round of fits
+        and may raise to abort.
+        """
+        self.fits = {}
+        hi = max(1, min(self.max_cluster, len(embeddings)) - 1)
+        if self.search_method == "linear" or hi <= self.grid:
+            self._fit(embeddings, range(1, hi + 1), random_state, should_stop)
+        else:
+            grid = sorted(set(np.linspace(1, hi, self.grid).round().astype(int).tolist()))
+            if self._ratio is not None:
+                grid = sorted(set(grid) | {min(hi, max(1, round(self._ratio * len(embeddings))))})
+            self._fit(embeddings, grid, random_state, should_stop)
+            i = min(range(len(grid)), key=lambda j: (self.fits[grid[j]][0], grid[j]))
+            a, b = grid[max(0, i - 1)], grid[min(len(grid) - 1, i + 1)]
+            while b - a > 2:
+                c = b - round((b - a) * INVPHI)
+                d = max(c + 1, a + round((b - a) * INVPHI))
+                self._fit(embeddings, [c, d], random_state, should_stop)
+                if self.fits[c][0] <= self.fits[d][0]:
+                    b = d
+                else:
+                    a = c
+            self._fit(embeddings, range(a, b + 1), random_state, should_stop)
+        n = min(self.fits, key=lambda k: (self.fits[k][0], k))
+        self._ratio = n / len(embeddings)
+        logging.debug(f"GaussianMixtureSearch chose {n} clusters of {len(embeddings)} points with {len(self.fits)} fits")
+        return n, self.fits[n][1]
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _process_pool(processes: int) -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            logging.info(f"Start {processes} RAPTOR clustering processes")
+            _pool = ProcessPoolExecutor(max_workers=processes)
+        return _pool
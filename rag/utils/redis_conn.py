@@ -188,6 +188,86 @@ class RedisDB:
             logging.warning("RedisDB.get " + str(k) + " got exception: " + str(e))
             self.__open__()
 
+    def mget(self, keys: list[str]) -> list | None:
+        """
+        The values of keys, None for missing ones. Returns None if they could not be read.
+        """
+        if not keys:
+            return []
+        if not self.REDIS:
+            return None
+        try:
+            return self.REDIS.mget(keys)
+        except Exception as e:
+            logging.warning("RedisDB.mget " + str(len(keys)) + " keys got exception: " + str(e))
+            self.__open__()
+        return None
+
+    def mset(self, mapping: dict, exp=3600) -> bool:
+        if not mapping:
+            return True
+        try:
+            pipeline = self.REDIS.pipeline(transaction=False)
+            for k, v in mapping.items():
+                pipeline.set(k, v, exp)
+            pipeline.execute()
+            return True
+        except Exception as e:
+            logging.warning("RedisDB.mset " + str(len(mapping)) + " keys got exception: " + str(e))
+            self.__open__()
+        return False
+
+    def mexpire(self, keys: list[str], exp=3600) -> bool:
+        if not keys:
+            return True
+        try:
+            pipeline = self.REDIS.pipeline(transaction=False)
+            for k in keys:
+                pipeline.expire(k, exp)
+            pipeline.execute()
+            return True
+        except Exception as e:
+            logging.warning("RedisDB.mexpire " + str(len(keys)) + " keys got exception: " + str(e))
+            self.__open__()
+        return False
+
+    def mincr(self, keys: list[str], exp=3600) -> bool:
+        if not self.REDIS or not keys:
+            return not keys
+        try:
+            pipeline = self.REDIS.pipeline(transaction=False)
+            for k in keys:
+                pipeline.incr(k)
+                pipeline.expire(k, exp)
+            pipeline.execute()
+            return True
+        except Exception as e:
+            logging.warning("RedisDB.mincr " + str(len(keys)) + " keys got exception: " + str(e))
+            self.__open__()
+        return False
+
+    def rpush(self, key: str, values: list, exp=3600) -> bool:
+        if not values:
+            return True
+        try:
+            pipeline = self.REDIS.pipeline(transaction=True)
+            pipeline.rpush(key, *values)
+            pipeline.expire(key, exp)
+            pipeline.execute()
+            return True
+        except Exception as e:
+            logging.warning("RedisDB.rpush " + str(key) + " got exception: " + str(e))
+            self.__open__()
+        return False
+
+    def lrange(self, key: str, start: int = 0, end: int = -1) -> list:
+        try:
+            return self.REDIS.lrange(key, start, end) or []
+        except Exception as e:
+            logging.warning("RedisDB.lrange " + str(key) + " got exception: " + str(e))
+            self.__open__()
+        return []
+
     def set_obj(self, k, obj, exp=3600):
         try:
             self.REDIS.set(k, json.dumps(obj, ensure_ascii=False), exp)
@@ -0,0 +1,217 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Short lived cache of retrieval results.
+
+Bots and MCP clients often send the same question against the same knowledge
+bases a few seconds apart. With RETRIEVAL_CACHE_ENABLED on, `Dealer.retrieval`
+results are kept in Redis for RETRIEVAL_CACHE_TTL seconds, keyed by everything
+the result depends on.
+
+Every knowledge base has a generation counter in Redis, which each doc store
+write to it bumps (see `invalidates_retrieval_cache`). The generations of the
+searched knowledge bases are part of the key, so entries become unreachable as
+soon as any of their knowledge bases changes.
+
+Elasticsearch and OpenSearch only make written chunks searchable at the next
+index refresh (refresh_interval is 1000ms in conf/mapping.json). A retrieval in
+between would still find the former chunks and cache them under the new
+generation, so each bump also marks the knowledge base as written for
+RETRIEVAL_CACHE_REFRESH_WINDOW seconds, during which its retrievals bypass the
+cache.
+"""
+
+import functools
+import inspect
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+import xxhash
+
+from rag.utils.query_vector_cache import normalize_query
+
+RETRIEVAL_CACHE_ENABLED = os.environ.get("RETRIEVAL_CACHE_ENABLED", "0").lower() in ["1", "true", "yes"]
+RETRIEVAL_CACHE_TTL = int(os.environ.get("RETRIEVAL_CACHE_TTL", 30))
+RETRIEVAL_CACHE_PREFIX = "retrieval_cache:"
+KB_GENERATION_PREFIX = "retrieval_gen:"
+KB_WRITTEN_PREFIX = "retrieval_written:"
+# Whole seconds covering the doc store refresh interval after a write.
+RETRIEVAL_CACHE_REFRESH_WINDOW = int(os.environ.get("RETRIEVAL_CACHE_REFRESH_WINDOW", 2))
+# Generations must outlive every entry that was keyed with them.
+KB_GENERATION_TTL = 7 * 24 * 3600
+
+
+def kb_generation_key(kb_id) -> str:
+    return KB_GENERATION_PREFIX + str(kb_id)
+
+
+def kb_written_key(kb_id) -> str:
+    return KB_WRITTEN_PREFIX + str(kb_id)
+
+
+def bump_kb_generations(kb_ids, conn=None) -> bool:
+    kb_ids = sorted(set(str(kb_id) for kb_id in kb_ids if kb_id))
+    if not kb_ids:
+        return True
+    if conn is None:
+        from rag.utils.redis_conn import REDIS_CONN
+        conn = REDIS_CONN
+    # Mark the knowledge bases as written before bumping, so that no retrieval sees the new generation unmarked.
+    written = RETRIEVAL_CACHE_REFRESH_WINDOW <= 0 or conn.mset({kb_written_key(kb_id): 1 for kb_id in kb_ids},
+                                                                RETRIEVAL_CACHE_REFRESH_WINDOW)
+    bumped = conn.mincr([kb_generation_key(kb_id) for kb_id in kb_ids], KB_GENERATION_TTL)
+    if not written or not bumped:
+        logging.error(f"Failed to bump retrieval cache generations of {kb_ids}, "
+                      f"cached retrievals may be stale for up to {RETRIEVAL_CACHE_TTL}s")
+        return False
+    return True
+
+
+def _written_kb_ids(params, args, kwargs) -> list:
+    # The dataset is the last parameter of insert/update/delete/delete_idx; inserts may
+    # leave it out, then the rows carry it.
+    bound = dict(zip(params, args))
+    bound.update(kwargs)
+    kb_id = bound.get(params[-1])
+    if kb_id:
+        return kb_id if isinstance(kb_id, list) else [kb_id]
+    rows = bound.get(params[1])
+    if isinstance(rows, list):
+        return [kb for row in rows if isinstance(row, dict) for kb in
+                (row.get("kb_id") if isinstance(row.get("kb_id"), list) else [row.get("kb_id")])]
+    return []
+
+
+def invalidates_retrieval_cache(func):
+    """
+    Decorator for the write methods of doc store connections, bumping the generation
+    of the knowledge base written to once the write returns or fails.
+    """
+    params = list(inspect.signature(func).parameters)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            try:
+                bump_kb_generations(_written_kb_ids(params, args, kwargs))
+            except Exception as e:
+                logging.warning(f"Bump retrieval cache generations got exception: {e}")
+
+    return wrapper
+
+
+def _json_default(o):
+    if isinstance(o, np.ndarray):
+        return o.tolist()
+    if isinstance(o, np.generic):
+        return o.item()
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+class RetrievalCache:
+    """
+    Get/put of `Dealer.retrieval` results in Redis, counting hits and misses.
+    """
+
+    def __init__(self, conn=None, ttl: int = RETRIEVAL_CACHE_TTL, enabled: bool = RETRIEVAL_CACHE_ENABLED):
+        if conn is None and enabled:
+            from rag.utils.redis_conn import REDIS_CONN
+            conn = REDIS_CONN
+        self.conn = conn
+        self.ttl = ttl
+        self.enabled = enabled and conn is not None and ttl > 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.skips = 0
+        self.errors = 0
+
+    def _count(self, stat: str):
+        with self._lock:
+            setattr(self, stat, getattr(self, stat) + 1)
+
+    def key(self, tenant_ids, kb_ids, question, params: dict) -> str | None:
+        """
+        The cache key of a retrieval, or None if the knowledge base generations can't be read or one of
+        the knowledge bases was written to within the refresh window.
+        """
+        kb_ids = sorted(set(str(kb_id) for kb_id in kb_ids or []))
+        try:
+            values = self.conn.mget([kb_generation_key(kb_id) for kb_id in kb_ids] +
+                                    [kb_written_key(kb_id) for kb_id in kb_ids])
+        except Exception as e:
+            values = None
+            logging.warning(f"RetrievalCache.key got exception: {e}")
+        if values is None or len(values) != 2 * len(kb_ids):
+            self._count("errors")
+            return None
+        generations, written = values[:len(kb_ids)], values[len(kb_ids):]
+        if any(written):
+            self._count("skips")
+            return None
+        hasher = xxhash.xxh3_128()
+        hasher.update(json.dumps([
+            sorted(str(tid) for tid in tenant_ids),
+            list(zip(kb_ids, [str(g or 0) for g in generations])),
+            normalize_query(question),
+            params,
+        ], ensure_ascii=False, sort_keys=True, default=str).encode("utf-8", "surrogatepass"))
+        return RETRIEVAL_CACHE_PREFIX + hasher.hexdigest()
+
+    def get(self, key: str) -> dict | None:
+        try:
+            v = self.conn.get(key)
+            if v:
+                self._count("hits")
+                return json.loads(v)
+        except Exception as e:
+            self._count("errors")
+            logging.warning(f"RetrievalCache.get got exception: {e}")
+        self._count("misses")
+        return None
+
+    def put(self, key: str, ranks: dict):
+        try:
+            self.conn.set(key, json.dumps(ranks, ensure_ascii=False, default=_json_default), self.ttl)
+        except Exception as e:
+            self._count("errors")
+            logging.warning(f"RetrievalCache.put got exception: {e}")
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "skips": self.skips,
+                "errors": self.errors,
+                "hit_rate": round(self.hit_rate, 4),
+            }
+
+
+RETRIEVAL_CACHE = RetrievalCache()
@@ -0,0 +1,102 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Concurrent retrieval from independent sources.
+
+A chat turn may read the knowledge bases, a web search and the knowledge graph.
+None of them needs another's result, so they are started together and the turn
+waits for the slowest one rather than for their sum. Optional sources have a
+timeout, and one that times out or fails is dropped instead of failing the turn.
+Results come back keyed by source name in the order the sources were added, so
+callers merge them the same way whatever order they finish in.
+"""
+
+import asyncio
+import logging
+import os
+from timeit import default_timer as timer
+
+RETRIEVAL_WEB_TIMEOUT = float(os.environ.get("RETRIEVAL_WEB_TIMEOUT", 20))
+RETRIEVAL_KG_TIMEOUT = float(os.environ.get("RETRIEVAL_KG_TIMEOUT", 30))
+
+
+class RetrievalOrchestrator:
+    """
+    Runs named retrieval coroutines concurrently, recording how long each took and how it ended.
+    """
+
+    def __init__(self):
+        self._sources = {}
+        self.timings = {}
+        self.status = {}
+
+    def add(self, name: str, func, *args, timeout: float | None = None, required: bool = False, **kwargs):
+        """
+        Register `func(*args, **kwargs)`, a coroutine function, as source `name`.
+
+        Errors and timeouts of a required source are raised from `run`, while those of
+        an optional one are logged and give None.
+        """
+        self._sources[name] = (func, args, kwargs, timeout, required)
+
+    async def _run_one(self, name):
+        func, args, kwargs, timeout, required = self._sources[name]
+        st = timer()
+        try:
+            res = await asyncio.wait_for(func(*args, **kwargs), timeout=timeout if timeout and timeout > 0 else None)
+            self.status[name] = "ok"
+            return res
+        except asyncio.TimeoutError:
+            self.status[name] = "timeout"
+            if required:
+                raise
+            logging.warning(f"Retrieval from {name} timed out after {timeout}s, skipped.")
+        except Exception as e:
+            self.status[name] = "error"
+            if required:
+                raise
+            logging.exception(f"Retrieval from {name} failed, skipped: {e}")
+        finally:
+            self.timings[name] = round((timer() - st) * 1000, 1)
+        return None
+
+    async def run(self) -> dict:
+        names = list(self._sources.keys())
+        tasks = [asyncio.create_task(self._run_one(name)) for name in names]
+        try:
+            results = await asyncio.gather(*tasks)
+        except BaseException:
+            for t in tasks:
+                t.cancel()
+            raise
+        return dict(zip(names, results))
+
+    def elapsed(self, details: dict | None = None, indent: str = "    ") -> str:
+        """
+        One "Time elapsed" line per source, with the optional per-source `details` appended.
+        """
+        lines = []
+        for name in self._sources.keys():
+            if name not in self.timings:
+                continue
+            line = f"{indent}- {name}: {self.timings[name]:.1f}ms"
+            if self.status.get(name, "ok") != "ok":
+                line += f" ({self.status[name]})"
+            if details and details.get(name):
+                line += f" ({details[name]})"
+            lines.append(line + "\n")
+        return "".join(lines)
@@ -0,0 +1,89 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Benchmark OCR page by page against OCR.batch, which recognizes the text lines
+of several pages in shared batches.
+
+Run from the repo root:
+
+    PYTHONPATH=. python test/benchmark/ocr_batch.py --inputs test/benchmark/test_docs --window 16
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+import pdfplumber
+
+from common.file_utils import traversal_files
+from deepdoc.vision import OCR
+
+
+def pdf_pages(fnm, zoomin=3):
+    with pdfplumber.open(fnm) as pdf:
+        return [np.array(p.to_image(resolution=72 * zoomin).original) for p in pdf.pages]
+
+
+def main(args):
+    ocr = OCR()
+    docs = [args.inputs] if os.path.isfile(args.inputs) else sorted(f for f in traversal_files(args.inputs) if f.lower().endswith(".pdf"))
+
+    print(f"{'document':<24}{'pages':>6}{'lines':>8}{'per page(s)':>14}{'batched(s)':>12}{'pages/s before':>16}{'pages/s after':>15}"
+          f"{'speedup':>9}{'same text':>11}")
+    total_pages, total_single, total_batch = 0, 0.0, 0.0
+    for fnm in docs:
+        pages = pdf_pages(fnm, args.zoomin)
+        if args.max_pages:
+            pages = pages[:args.max_pages]
+
+        st = time.time()
+        single = [ocr(img) for img in pages]
+        single = [res if isinstance(res, list) else [] for res in single]
+        single_cost = time.time() - st
+
+        st = time.time()
+        batched = []
+        for s in range(0, len(pages), args.window):
+            batched.extend(ocr.batch(pages[s:s + args.window]))
+        batch_cost = time.time() - st
+
+        single_txt = [t for res in single for _, (t, _) in res]
+        batch_txt = [t for res in batched for _, (t, _) in res]
+        same = sum(1 for a, b in zip(single_txt, batch_txt) if a == b) / max(len(single_txt), 1)
+        total_pages += len(pages)
+        total_single += single_cost
+        total_batch += batch_cost
+        print(f"{os.path.basename(fnm):<24}{len(pages):>6}{len(single_txt):>8}{single_cost:>14.2f}{batch_cost:>12.2f}"
+              f"{len(pages) / max(single_cost, 1e-9):>16.2f}{len(pages) / max(batch_cost, 1e-9):>15.2f}"
+              f"{single_cost / max(batch_cost, 1e-9):>8.2f}x{same:>11.1%}")
+
+    print(f"{'total':<24}{total_pages:>6}{'':>8}{total_single:>14.2f}{total_batch:>12.2f}"
+          f"{total_pages / max(total_single, 1e-9):>16.2f}{total_pages / max(total_batch, 1e-9):>15.2f}"
+          f"{total_single / max(total_batch, 1e-9):>8.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--inputs',
+                        help="Directory of PDFs, or a single PDF. Default: test/benchmark/test_docs",
+                        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_docs"))
+    parser.add_argument('--window', help="Pages per OCR.batch call. Default: 16", type=int, default=16)
+    parser.add_argument('--zoomin', help="Rendering zoom, as in the PDF parser. Default: 3", type=int, default=3)
+    parser.add_argument('--max_pages', help="Only OCR the first N pages of each document. Default: all", type=int, default=0)
+    args = parser.parse_args()
+    main(args)
@@ -13,9 +13,11 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 #
+import asyncio
 import uuid
 import hashlib
-from common.misc_utils import get_uuid, download_img, hash_str2int, convert_bytes
+from common.misc_utils import get_uuid, download_img, hash_str2int, convert_bytes, get_thread_pool, \
+    thread_pool_exec, thread_pool_exec_in, thread_pool_stats, shutdown_thread_pools, THREAD_POOL_DEFAULT
 
 
 class TestGetUuid:
@@ -353,3 +355,53 @@ class TestConvertBytes:
         # Ensure we don't exceed available units
         huge_value = 100 * 1125899906842624  # 100 PB (still within PB range)
         assert "PB" in convert_bytes(huge_value)
+
+
+class TestThreadPool:
+    """Test cases for the process-wide named thread pools"""
+
+    def setup_method(self):
+        shutdown_thread_pools(wait=True)
+
+    def teardown_method(self):
+        shutdown_thread_pools(wait=True)
+
+    def test_pool_is_shared(self):
+        """The same pool is returned for the same name"""
+        assert get_thread_pool() is get_thread_pool(THREAD_POOL_DEFAULT)
+        assert get_thread_pool("storage") is get_thread_pool("storage")
+        assert get_thread_pool("storage") is not get_thread_pool()
+
+    def test_thread_pool_exec_reuses_pool(self):
+        """Repeated offloads do not create new executors"""
+        async def run():
+            results = []
+            for i in range(5):
+                results.append(await thread_pool_exec(lambda x, y=0: x + y, i, y=1))
+            return results
+
+        assert asyncio.run(run()) == [1, 2, 3, 4, 5]
+        stats = thread_pool_stats()
+        assert list(stats.keys()) == [THREAD_POOL_DEFAULT]
+        assert stats[THREAD_POOL_DEFAULT]["completed"] == 5
+        assert stats[THREAD_POOL_DEFAULT]["active"] == 0
+
+    def test_thread_pool_exec_in_named_pool(self):
+        """Work goes to the requested pool"""
+        assert asyncio.run(thread_pool_exec_in("doc_store", sum, [1, 2, 3])) == 6
+        assert thread_pool_stats()["doc_store"]["completed"] == 1
+
+    def test_pool_size_from_env(self, monkeypatch):
+        """Pool sizes can be overridden per workload class"""
+        monkeypatch.setenv("THREAD_POOL_MODEL_MAX_WORKERS", "3")
+        monkeypatch.setenv("THREAD_POOL_MAX_WORKERS", "invalid")
+        assert thread_pool_stats() == {}
+        assert get_thread_pool("model").stats()["max_workers"] == 3
+        assert get_thread_pool().stats()["max_workers"] == 128
+
+    def test_shutdown_recreates_pool(self):
+        """A pool is recreated on demand after shutdown"""
+        pool = get_thread_pool()
+        shutdown_thread_pools(wait=True)
+        assert thread_pool_stats() == {}
+        assert get_thread_pool() is not pool
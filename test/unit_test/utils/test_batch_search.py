@@ -0,0 +1,108 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Unit tests for Dealer.batch_search, with a fake doc store counting msearch round trips.
+"""
+
+import asyncio
+
+import pytest
+from common import settings
+from rag.nlp import search
+
+
+class FakeQueryer:
+    def question(self, txt, min_match=0.3):
+        return f"{txt}|{min_match}", [txt]
+
+
+class FakeVectorCache:
+    async def async_encode_batch(self, emb_mdl, txts):
+        return [[0.1, 0.2] for _ in txts]
+
+
+class FakeDocStore:
+    def __init__(self, hits):
+        self.hits = hits
+        self.calls = []
+
+    def msearch(self, searches):
+        self.calls.append(searches)
+        res = []
+        for args in searches:
+            match_exprs = args[3]
+            total = 1 if not match_exprs else self.hits.get(match_exprs[0], 0)
+            res.append({"total": total, "ids": [f"c{i}" for i in range(total)]})
+        return res
+
+    def get_total(self, res):
+        return res["total"]
+
+    def get_doc_ids(self, res):
+        return res["ids"]
+
+    def get_highlight(self, res, keywords, field):
+        return {}
+
+    def get_aggregation(self, res, field):
+        return []
+
+    def get_fields(self, res, fields):
+        return {}
+
+
+@pytest.fixture
+def make_dealer(monkeypatch):
+    monkeypatch.setattr(search, "QUERY_VECTOR_CACHE", FakeVectorCache())
+    monkeypatch.setattr(search.Dealer, "_expand_keywords", staticmethod(lambda keywords: set(keywords)))
+    monkeypatch.setattr(settings, "DOC_ENGINE_INFINITY", False)
+
+    def make(hits):
+        dealer = search.Dealer.__new__(search.Dealer)
+        dealer.qryr = FakeQueryer()
+        dealer.dataStore = FakeDocStore(hits)
+        return dealer
+
+    return make
+
+
+class TestBatchSearch:
+    """Test zero-hit searches are only retried relaxed, in one more msearch"""
+
+    def test_all_hit(self, make_dealer):
+        dealer = make_dealer({"a|0.3": 2, "b|0.3": 1})
+        reqs = [{"question": "a"}, {"question": "b"}]
+        sreses = asyncio.run(dealer.batch_search(reqs, "ragflow_t1", ["kb1"], object()))
+        assert [s.total for s in sreses] == [2, 1]
+        assert len(dealer.dataStore.calls) == 1
+
+    def test_relaxed_retry(self, make_dealer):
+        dealer = make_dealer({"a|0.3": 2, "b|0.1": 3})
+        reqs = [{"question": "a"}, {"question": "b"}, {"question": "c", "doc_ids": ["d1"]}]
+        sreses = asyncio.run(dealer.batch_search(reqs, "ragflow_t1", ["kb1"], object()))
+        assert [s.total for s in sreses] == [2, 3, 1]
+        assert [s.ids for s in sreses] == [["c0", "c1"], ["c0", "c1", "c2"], ["c0"]]
+        assert [s.keywords for s in sreses] == [["a"], ["b"], ["c"]]
+
+        calls = dealer.dataStore.calls
+        assert len(calls) == 2
+        assert len(calls[1]) == 2
+        relaxed, doc_scan = calls[1]
+        assert relaxed[3][0] == "b|0.1"
+        assert relaxed[3][1].extra_options["similarity"] == 0.17
+        assert doc_scan[2]["doc_id"] == ["d1"]
+        assert doc_scan[3] == []
@@ -0,0 +1,152 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Unit tests for the chunk embedding cache.
+"""
+
+import numpy as np
+import pytest
+from rag.utils.embedding_cache import EmbeddingBuffer, EmbeddingCache, dedup_texts, embedding_cache_key, pack_vector, \
+    unpack_vector, vectors_for_doc_store
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+        self.expired = []
+
+    def mget(self, keys):
+        return [self.data.get(k) for k in keys]
+
+    def mset(self, mapping, exp=3600):
+        self.data.update(mapping)
+        return True
+
+    def mexpire(self, keys, exp=3600):
+        self.expired.extend(keys)
+        return True
+
+
+class TestEmbeddingCache:
+    """Test bulk get/put and hit counting"""
+
+    def test_key_depends_on_model_and_text(self):
+        assert embedding_cache_key("m1", "hello") == embedding_cache_key("m1", "hello")
+        assert embedding_cache_key("m1", "hello") != embedding_cache_key("m2", "hello")
+        assert embedding_cache_key("m1", "hello") != embedding_cache_key("m1", "hello ")
+
+    def test_key_depends_on_endpoint(self):
+        local = embedding_cache_key("bge-m3", "hello", "OpenAI-API-Compatible", "http://10.0.0.1:8000/v1")
+        other = embedding_cache_key("bge-m3", "hello", "OpenAI-API-Compatible", "http://10.0.0.2:8000/v1")
+        assert local != other
+        assert local != embedding_cache_key("bge-m3", "hello", "Ollama", "http://10.0.0.1:8000/v1")
+
+    def test_of_model(self):
+        class Bundle:
+            llm_name = "bge-m3"
+            llm_factory = "Ollama"
+            api_base = "http://ollama:11434"
+
+        conn = FakeRedis()
+        cache = EmbeddingCache.of_model(Bundle(), conn=conn, enabled=True)
+        cache.put(["a"], [np.array([1.0])])
+        assert list(conn.data) == [embedding_cache_key("bge-m3", "a", "Ollama", "http://ollama:11434")]
+
+    def test_pack_roundtrip_float32(self):
+        v = np.random.rand(1024)
+        packed = pack_vector(v)
+        assert isinstance(packed, str)
+        np.testing.assert_allclose(unpack_vector(packed), v.astype(np.float32))
+        assert unpack_vector(packed).dtype == np.float32
+
+    def test_get_put(self):
+        conn = FakeRedis()
+        cache = EmbeddingCache("bge", conn=conn, enabled=True)
+        assert cache.get(["a", "b"]) == [None, None]
+        cache.put(["a"], [np.array([1.0, 2.0])])
+        res = cache.get(["a", "b"])
+        np.testing.assert_allclose(res[0], [1.0, 2.0])
+        assert res[1] is None
+        assert cache.hits == 1
+        assert cache.misses == 3
+        assert conn.expired == [embedding_cache_key("bge", "a")]
+        assert "1/4" in str(cache)
+
+    def test_disabled(self):
+        conn = FakeRedis()
+        cache = EmbeddingCache("bge", conn=conn, enabled=False)
+        cache.put(["a"], [np.array([1.0])])
+        assert conn.data == {}
+        assert cache.get(["a"]) == [None]
+        assert cache.hit_rate == 0.0
+
+
+class TestDedupTexts:
+    """Test in-batch deduplication of texts to embed"""
+
+    def test_scatter_back(self):
+        texts = ["header", "body 1", "header", "body 2", "header", "body 1"]
+        uniq, index, duplicates = dedup_texts(texts)
+        assert uniq == ["header", "body 1", "body 2"]
+        assert duplicates == [2, 4, 5]
+        vectors = np.array([[0.0], [1.0], [2.0]])
+        scattered = vectors[index]
+        assert [uniq[i] for i in index] == texts
+        assert scattered[:, 0].tolist() == [0.0, 1.0, 0.0, 2.0, 0.0, 1.0]
+
+    def test_no_duplicates(self):
+        uniq, index, duplicates = dedup_texts(["a", "b"])
+        assert uniq == ["a", "b"]
+        assert index.tolist() == [0, 1]
+        assert duplicates == []
+
+    def test_empty(self):
+        uniq, index, duplicates = dedup_texts([])
+        assert uniq == []
+        assert len(index) == 0
+        assert duplicates == []
+
+
+class TestEmbeddingBuffer:
+    """Test the preallocated embedding matrix"""
+
+    def test_fill_in_place(self):
+        buffer = EmbeddingBuffer(5)
+        buffer.append(np.ones((2, 3)))
+        buffer.append(np.full((3, 3), 2.0))
+        assert buffer.matrix.dtype == np.float32
+        assert buffer.matrix.shape == (5, 3)
+        assert buffer.vector_size == 3
+        assert buffer.matrix[:, 0].tolist() == [1.0, 1.0, 2.0, 2.0, 2.0]
+
+    def test_overflow(self):
+        buffer = EmbeddingBuffer(1)
+        with pytest.raises(ValueError):
+            buffer.append(np.ones((2, 3)))
+
+    def test_empty(self):
+        buffer = EmbeddingBuffer(0)
+        assert buffer.vector_size == 0
+        assert len(buffer.matrix) == 0
+
+    def test_vectors_for_doc_store(self):
+        matrix = np.arange(6, dtype=np.float32).reshape(2, 3)
+        views = vectors_for_doc_store(matrix, "elasticsearch")
+        assert isinstance(views[0], np.ndarray)
+        assert np.shares_memory(views[1], matrix)
+        lists = vectors_for_doc_store(matrix, "infinity")
+        assert lists == [[0.0, 1.0, 2.0], [3.0, 4.0, 5.0]]
@@ -0,0 +1,145 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Unit tests for the candidate pairs of entity resolution.
+"""
+
+import itertools
+import random
+import sys
+import types
+
+import pytest
+from graphrag.entity_blocking import candidate_pairs
+from rag.nlp import is_english
+
+
+SYLLABLES = ["ka", "ro", "mi", "te", "su", "na", "lo", "vi", "an", "el", "or", "us", "in", "ex", "al", "ber", "ton",
+             "ley", "son", "ford", "ham"]
+HANZI = "华为科技有限公司北京上海大学研究院银行集团中心医院人民政府网络数据智能电子工业"
+
+
+def synthetic_names(n, seed=0):
+    """
+    Entity names with variants of them as extraction produces: typos, dropped characters, suffixes.
+    """
+    rnd = random.Random(seed)
+
+    def english():
+        words = ["".join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(1, 3))) for _ in range(rnd.randint(1, 3))]
+        return " ".join(words).upper()
+
+    def chinese():
+        return "".join(rnd.choice(HANZI) for _ in range(rnd.randint(2, 8)))
+
+    def variant(name):
+        i = rnd.randrange(len(name))
+        r = rnd.random()
+        if r < 0.3:
+            return name[:i] + name[i + 1:]
+        if r < 0.5:
+            return name[:i] + rnd.choice("AEIOURST" if name.isascii() else HANZI) + name[i + 1:]
+        if r < 0.7:
+            return name + rnd.choice([" INC", " CORP", "S", " LTD"] if name.isascii() else ["公司", "集团"])
+        if r < 0.85:
+            return name.replace(" ", "")
+        return name + "."
+
+    names = set()
+    while len(names) < n:
+        name = english() if rnd.random() < 0.7 else chinese()
+        names.add(name)
+        for _ in range(rnd.randint(0, 2)):
+            names.add(variant(name))
+    return sorted(names)[:n]
+
+
+# The modules graphrag.entity_resolution imports for LLM calls, task state and the graph, none of which
+# is_similarity uses.
+STUBS = {
+    "api.db.services.task_service": {"has_canceled": lambda task_id: False},
+    "rag.llm.chat_model": {"Base": object},
+    "graphrag.general.extractor": {"Extractor": object},
+    "graphrag.utils": {"perform_variable_replacements": None, "chat_limiter": None, "GraphChange": None},
+}
+
+
+@pytest.fixture(scope="module")
+def is_similarity():
+    loaded = "graphrag.entity_resolution" in sys.modules
+    with pytest.MonkeyPatch.context() as mp:
+        for name, attrs in STUBS.items():
+            if not loaded and name not in sys.modules:
+                stub = types.ModuleType(name)
+                stub.__dict__.update(attrs)
+                mp.setitem(sys.modules, name, stub)
+        from graphrag.entity_resolution import EntityResolution
+        if not loaded:
+            sys.modules.pop("graphrag.entity_resolution")
+    return EntityResolution.is_similarity
+
+
+def similar_pairs(names, is_similarity):
+    return {(a, b) for a, b in itertools.combinations(names, 2) if is_similarity(a, b)}
+
+
+class TestCandidatePairs:
+    """Test blocking finds similar names without all pairs"""
+
+    def test_english_variants(self):
+        names = sorted(["MICROSOFT", "MICROSOFT INC", "MICROSFT", "APPLE", "APPLES", "ORANGE", "NVIDIA"])
+        pairs = candidate_pairs(names, [True] * len(names))
+        for pair in [("MICROSFT", "MICROSOFT"), ("MICROSOFT", "MICROSOFT INC"), ("APPLE", "APPLES")]:
+            assert pair in pairs
+        assert ("APPLE", "MICROSOFT INC") not in pairs
+        assert all(names.index(a) < names.index(b) for a, b in pairs)
+
+    def test_char_sets_are_exact(self, is_similarity):
+        rnd = random.Random(0)
+        chars = "华为科技有限公司北京上海大学研究院银行"
+        names = sorted({"".join(rnd.choice(chars) for _ in range(rnd.randint(2, 7))) for _ in range(300)})
+        pairs = set(candidate_pairs(names, [is_english(name) for name in names]))
+        truth = similar_pairs(names, is_similarity)
+        assert truth and truth <= pairs
+        assert len(pairs) < len(names) * (len(names) - 1) // 2
+
+    def test_anchors(self):
+        names = ["北京大学", "北京大学院", "华为技术有限公司", "华为技术有限公司集", "APPLE", "APPLES"]
+        english = [False, False, False, False, True, True]
+        pairs = candidate_pairs(names, english, anchors={"华为技术有限公司集", "APPLE"})
+        assert ("华为技术有限公司", "华为技术有限公司集") in pairs
+        assert ("APPLE", "APPLES") in pairs
+        assert ("北京大学", "北京大学院") not in pairs
+
+    @pytest.mark.parametrize("seed", [0, 1])
+    def test_no_similar_pair_missed(self, is_similarity, seed):
+        names = synthetic_names(300, seed)
+        english = [is_english(name) for name in names]
+        total = len(names) * (len(names) - 1) // 2
+        truth = similar_pairs(names, is_similarity)
+        pairs = set(candidate_pairs(names, english))
+        assert truth and not truth - pairs
+        assert len(pairs) < 0.25 * total
+
+    def test_rarest_keys_recall(self, is_similarity):
+        names = synthetic_names(300)
+        english = [is_english(name) for name in names]
+        total = len(names) * (len(names) - 1) // 2
+        truth = similar_pairs(names, is_similarity)
+        pairs = set(candidate_pairs(names, english, num_keys=6))
+        assert len(truth & pairs) / len(truth) >= 0.97
+        assert len(pairs) < 0.1 * total
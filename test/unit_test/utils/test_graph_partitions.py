@@ -0,0 +1,268 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Unit tests for the partitioned KB graph: splitting and joining partitions, rewriting only the
+partitions that changed, serving the overview from the manifest, and reading or migrating graphs
+saved as a single node-link blob.
+"""
+
+import asyncio
+import json
+from types import SimpleNamespace
+
+import networkx as nx
+import pytest
+from networkx.readwrite import json_graph
+
+from common import settings
+from graphrag import utils
+
+KB_ID = "kb0"
+TENANT_ID = "tenant0"
+
+
+class FakeDocStore:
+    def __init__(self):
+        self.chunks = {}
+        self.deletes = []
+        self.fetched = []
+
+    def insert(self, rows, index_name, dataset_id=None):
+        for row in rows:
+            self.chunks[row["id"]] = dict(row)
+        return []
+
+    def delete(self, condition, index_name, dataset_id):
+        self.deletes.append(condition)
+        if "id" in condition:
+            ids = [i for i in condition["id"] if i in self.chunks]
+        else:
+            ids = [i for i, c in self.chunks.items() if c["knowledge_graph_kwd"] in condition["knowledge_graph_kwd"]]
+        for i in ids:
+            del self.chunks[i]
+        return len(ids)
+
+    def mget(self, data_ids, index_names, dataset_ids):
+        self.fetched.extend(data_ids)
+        return {i: self.chunks[i] for i in data_ids if i in self.chunks}
+
+    def of_kind(self, kind):
+        return [c for c in self.chunks.values() if c["knowledge_graph_kwd"] == kind]
+
+
+class FakeRetriever:
+    def __init__(self, store):
+        self.store = store
+
+    async def search(self, conds, index_name, kb_ids):
+        hits = [c for c in self.store.chunks.values() if c["knowledge_graph_kwd"] in conds["knowledge_graph_kwd"]]
+        hits = hits[: conds.get("size", len(hits))]
+        return SimpleNamespace(total=len(hits), ids=[c["id"] for c in hits], field={c["id"]: c for c in hits})
+
+
+@pytest.fixture
+def store(monkeypatch):
+    monkeypatch.setattr(utils, "GRAPH_PARTITION_NODES", 4)
+    store = FakeDocStore()
+    monkeypatch.setattr(settings, "docStoreConn", store)
+    monkeypatch.setattr(settings, "retriever", FakeRetriever(store))
+    return store
+
+
+def make_graph(num_nodes=12, reverse=False):
+    graph = nx.Graph()
+    names = [f"ENTITY {i}" for i in range(num_nodes)]
+    for i, name in enumerate(reversed(names) if reverse else names):
+        graph.add_node(name, entity_type="PERSON", description=f"description of {name}", source_id=["doc0"], rank=i % 3)
+    edges = [(names[i], names[(i * 5 + 1) % num_nodes]) for i in range(num_nodes)]
+    for source, target in reversed(edges) if reverse else edges:
+        if source != target:
+            graph.add_edge(source, target, description=f"{source} knows {target}", weight=2.0, keywords=["knows"], source_id=["doc0"])
+    nx.set_node_attributes(graph, {n: 1.0 / (i + 1) for i, n in enumerate(names)}, "pagerank")
+    return graph
+
+
+def graph_data(graph):
+    nodes = sorted((n, json.dumps(attrs, sort_keys=True)) for n, attrs in graph.nodes(data=True))
+    edges = sorted((*utils.get_from_to(s, t), json.dumps(attrs, sort_keys=True)) for s, t, attrs in graph.edges(data=True))
+    return nodes, edges
+
+
+def add_legacy_graph(store, graph, removed_kwd="N"):
+    store.insert([{
+        "id": "legacy",
+        "content_with_weight": json.dumps(json_graph.node_link_data(graph, edges="edges"), ensure_ascii=False),
+        "knowledge_graph_kwd": "graph",
+        "kb_id": KB_ID,
+        "source_id": ["doc0"],
+        "available_int": 0,
+        "removed_kwd": removed_kwd,
+    }], "", KB_ID)
+
+
+class TestGraphPartitions:
+    """Test graph_partitions and graph_from_partitions"""
+
+    def test_round_trip(self, store):
+        graph = make_graph()
+        manifest, contents = utils.graph_partitions(KB_ID, graph)
+        assert len(manifest["partitions"]) == len(contents) == 4
+        assert sum(p["nodes"] for p in manifest["partitions"]) == graph.number_of_nodes()
+        assert sum(p["edges"] for p in manifest["partitions"]) == graph.number_of_edges()
+        assert all("pagerank" not in content for content in contents)
+        assert graph_data(utils.graph_from_partitions(manifest, contents)) == graph_data(graph)
+
+    def test_partial_load_drops_cut_edges(self, store):
+        graph = make_graph()
+        manifest, contents = utils.graph_partitions(KB_ID, graph)
+        part = utils.graph_from_partitions(manifest, contents[:1])
+        nodes = {n for n in graph.nodes if utils.graph_partition_of(n, 4) == 0}
+        assert set(part.nodes) == nodes
+        assert part.number_of_edges() == graph.subgraph(nodes).number_of_edges()
+        assert all(part.nodes[n]["pagerank"] == graph.nodes[n]["pagerank"] for n in nodes)
+
+    def test_hashes_ignore_insertion_order(self, store):
+        manifest, _ = utils.graph_partitions(KB_ID, make_graph())
+        reversed_manifest, _ = utils.graph_partitions(KB_ID, make_graph(reverse=True))
+        assert manifest["partitions"] == reversed_manifest["partitions"]
+
+
+class TestGraphManifestChunks:
+    """Test graph_manifest_chunks only rewrites partitions that changed"""
+
+    def test_unknown_graph_rewrites_all(self, store):
+        graph = make_graph()
+        chunks, partitions = asyncio.run(utils.graph_manifest_chunks(TENANT_ID, KB_ID, graph))
+        assert store.deletes == [{"knowledge_graph_kwd": ["graph_partition"]}]
+        assert chunks[0]["knowledge_graph_kwd"] == "graph"
+        assert chunks[0]["source_id"] == graph.graph.get("source_id", [])
+        assert [c["id"] for c in chunks[1:]] == [p["id"] for p in partitions]
+        assert all(c["knowledge_graph_kwd"] == "graph_partition" for c in chunks[1:])
+
+    def test_changed_partition_only(self, store):
+        graph = make_graph()
+        _, partitions = asyncio.run(utils.graph_manifest_chunks(TENANT_ID, KB_ID, graph))
+        utils._graph_partitions[graph] = partitions
+        store.deletes.clear()
+
+        graph.nodes["ENTITY 3"]["description"] = "a new description"
+        chunks, new_partitions = asyncio.run(utils.graph_manifest_chunks(TENANT_ID, KB_ID, graph))
+        changed = partitions[utils.graph_partition_of("ENTITY 3", 4)]["id"]
+        assert [c["id"] for c in chunks[1:]] == [changed]
+        assert store.deletes == [{"id": [changed]}]
+        assert [p["id"] for p in new_partitions] == [p["id"] for p in partitions]
+
+    def test_pagerank_change_rewrites_manifest_only(self, store):
+        graph = make_graph()
+        _, partitions = asyncio.run(utils.graph_manifest_chunks(TENANT_ID, KB_ID, graph))
+        utils._graph_partitions[graph] = partitions
+        store.deletes.clear()
+
+        nx.set_node_attributes(graph, {n: 0.5 for n in graph.nodes}, "pagerank")
+        chunks, _ = asyncio.run(utils.graph_manifest_chunks(TENANT_ID, KB_ID, graph))
+        assert len(chunks) == 1
+        assert json.loads(chunks[0]["content_with_weight"])["pagerank"] == {n: 0.5 for n in graph.nodes}
+        assert store.deletes == []
+
+    def test_growth_deletes_stale_partitions(self, store):
+        graph = make_graph()
+        _, partitions = asyncio.run(utils.graph_manifest_chunks(TENANT_ID, KB_ID, graph))
+        utils._graph_partitions[graph] = partitions
+        store.deletes.clear()
+
+        graph.add_nodes_from(f"NEW ENTITY {i}" for i in range(8))
+        chunks, new_partitions = asyncio.run(utils.graph_manifest_chunks(TENANT_ID, KB_ID, graph))
+        assert len(new_partitions) == 8
+        assert store.deletes == [{"id": [p["id"] for p in partitions]}]
+        assert [c["id"] for c in chunks[1:]] == [p["id"] for p in new_partitions]
+
+
+class TestGraphOverview:
+    """Test get_graph_overview reads the top pagerank nodes from the manifest"""
+
+    def save(self, store, monkeypatch, graph):
+        monkeypatch.setattr(utils, "GRAPH_OVERVIEW_NODES", 5)
+        chunks, _ = asyncio.run(utils.graph_manifest_chunks(TENANT_ID, KB_ID, graph))
+        store.insert(chunks, "", KB_ID)
+        return json.loads(chunks[0]["content_with_weight"])
+
+    def test_overview_loads_no_partition(self, store, monkeypatch):
+        graph = make_graph()
+        manifest = self.save(store, monkeypatch, graph)
+        overview = asyncio.run(utils.get_graph_overview(TENANT_ID, KB_ID, manifest, max_nodes=5))
+        assert len(store.fetched) < len(manifest["partitions"])
+        assert store.fetched == []
+
+        top = [f"ENTITY {i}" for i in range(5)]
+        assert sorted(n["id"] for n in overview["nodes"]) == sorted(top)
+        assert all(n["pagerank"] == graph.nodes[n["id"]]["pagerank"] for n in overview["nodes"])
+        expected = {utils.get_from_to(s, t) for s, t in graph.subgraph(top).edges}
+        assert {utils.get_from_to(e["source"], e["target"]) for e in overview["edges"]} == expected
+
+    def test_smaller_overview(self, store, monkeypatch):
+        manifest = self.save(store, monkeypatch, make_graph())
+        overview = asyncio.run(utils.get_graph_overview(TENANT_ID, KB_ID, manifest, max_nodes=3))
+        assert sorted(n["id"] for n in overview["nodes"]) == [f"ENTITY {i}" for i in range(3)]
+        assert all({e["source"], e["target"]} <= {"ENTITY 0", "ENTITY 1", "ENTITY 2"} for e in overview["edges"])
+        assert store.fetched == []
+
+    def test_drill_down_loads_partitions(self, store, monkeypatch):
+        manifest = self.save(store, monkeypatch, make_graph())
+        overview = asyncio.run(utils.get_graph_overview(TENANT_ID, KB_ID, manifest, max_nodes=8))
+        assert store.fetched
+        assert {f"ENTITY {i}" for i in range(8)} <= {n["id"] for n in overview["nodes"]}
+
+        store.fetched.clear()
+        manifest.pop("overview")
+        asyncio.run(utils.get_graph_overview(TENANT_ID, KB_ID, manifest, max_nodes=5))
+        assert store.fetched
+
+
+class TestLegacyGraph:
+    """Test reading and migrating a graph saved as a single node-link blob"""
+
+    def test_get_graph_reads_legacy_blob(self, store):
+        graph = make_graph()
+        add_legacy_graph(store, graph)
+        loaded = asyncio.run(utils.get_graph(TENANT_ID, KB_ID))
+        assert graph_data(loaded) == graph_data(graph)
+        assert loaded.graph["source_id"] == ["doc0"]
+
+    def test_migrate_graph(self, store):
+        graph = make_graph()
+        add_legacy_graph(store, graph)
+        messages = []
+        assert asyncio.run(utils.migrate_graph(TENANT_ID, KB_ID, callback=lambda msg: messages.append(msg)))
+        assert len(messages) == 1
+
+        manifests = store.of_kind("graph")
+        assert len(manifests) == 1
+        assert manifests[0]["source_id"] == ["doc0"]
+        manifest = json.loads(manifests[0]["content_with_weight"])
+        assert manifest["format"] == utils.GRAPH_FORMAT_PARTITIONED
+        assert sorted(c["id"] for c in store.of_kind("graph_partition")) == sorted(p["id"] for p in manifest["partitions"])
+
+        loaded = asyncio.run(utils.get_graph(TENANT_ID, KB_ID))
+        assert graph_data(loaded) == graph_data(graph)
+        assert loaded.graph["source_id"] == ["doc0"]
+        assert not asyncio.run(utils.migrate_graph(TENANT_ID, KB_ID))
+
+    def test_migrate_graph_skips_removed_or_absent(self, store):
+        assert not asyncio.run(utils.migrate_graph(TENANT_ID, KB_ID))
+        add_legacy_graph(store, make_graph(), removed_kwd="Y")
+        assert not asyncio.run(utils.migrate_graph(TENANT_ID, KB_ID))
+        assert store.of_kind("graph_partition") == []
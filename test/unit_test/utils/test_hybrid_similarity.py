@@ -0,0 +1,99 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Unit tests for the vectorized hybrid similarity of rerank, against the former
+per-candidate implementation.
+"""
+
+import random
+from collections import defaultdict
+
+import numpy as np
+from rag.nlp.query import FulltextQueryer
+
+
+class FakeTermWeight:
+    def weights(self, tks, preprocess=True):
+        return [(t, (len(t) * 7 % 11 + 1) / 10) for t in tks]
+
+
+def make_queryer():
+    qryr = FulltextQueryer.__new__(FulltextQueryer)
+    qryr.tw = FakeTermWeight()
+    return qryr
+
+
+def cosine(avec, bvecs):
+    a = np.asarray(avec, dtype=np.float64)
+    res = []
+    for b in np.asarray(bvecs, dtype=np.float64):
+        n = np.linalg.norm(a) * np.linalg.norm(b)
+        res.append(a @ b / n if n else 0.0)
+    return np.array(res)
+
+
+def legacy_hybrid_similarity(qryr, avec, bvecs, atks, btkss, tkweight=0.3, vtweight=0.7):
+    def to_dict(tks):
+        if isinstance(tks, str):
+            tks = tks.split()
+        d = defaultdict(int)
+        for t, c in qryr.tw.weights(tks, preprocess=False):
+            d[t] += c
+        return d
+
+    sims = cosine(avec, bvecs)
+    atks = to_dict(atks)
+    tksim = [qryr.similarity(atks, to_dict(tks)) for tks in btkss]
+    if np.sum(sims) == 0:
+        return np.array(tksim), tksim, sims
+    return sims * vtweight + np.array(tksim) * tkweight, tksim, sims
+
+
+class TestHybridSimilarity:
+    """Test the vectorized scores equal the per-candidate ones"""
+
+    def test_same_as_legacy(self):
+        rnd = random.Random(0)
+        rng = np.random.default_rng(0)
+        vocab = [f"term{i}" + "x" * (i % 4) for i in range(200)]
+        keywords = rnd.choices(vocab, k=12) + ["term1", "term1"]
+        avec = rng.standard_normal(64)
+        bvecs = rng.standard_normal((100, 64)).astype(np.float32)
+        bvecs[3] = 0
+        btkss = [rnd.choices(vocab, k=rnd.randint(0, 80)) for _ in range(100)]
+        btkss[5] = " ".join(btkss[5])
+
+        qryr = make_queryer()
+        old, old_tk, old_vt = legacy_hybrid_similarity(qryr, avec, bvecs, keywords, btkss)
+        new, new_tk, new_vt = qryr.hybrid_similarity(avec, bvecs, keywords,
+                                                     [tks if isinstance(tks, str) else set(tks) for tks in btkss])
+        np.testing.assert_allclose(new_tk, old_tk, rtol=1e-6, atol=1e-9)
+        np.testing.assert_allclose(new_vt, old_vt, rtol=1e-4, atol=1e-6)
+        np.testing.assert_allclose(new, old, rtol=1e-4, atol=1e-6)
+        assert new_vt[3] == 0
+
+    def test_zero_query_vector(self):
+        qryr = make_queryer()
+        score, tksim, vtsim = qryr.hybrid_similarity(np.zeros(8), np.ones((3, 8)), ["a", "bb"], [["a"], ["bb", "a"], []])
+        np.testing.assert_allclose(score, tksim)
+        np.testing.assert_allclose(vtsim, [0, 0, 0])
+        assert tksim[1] > tksim[0] > tksim[2]
+
+    def test_no_candidates(self):
+        qryr = make_queryer()
+        score, tksim, vtsim = qryr.hybrid_similarity(np.ones(8), np.zeros((0, 8)), ["a"], [])
+        assert len(score) == len(tksim) == len(vtsim) == 0
@@ -0,0 +1,76 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Unit tests for OCR.batch, with fake detection and recognition models.
+"""
+
+import numpy as np
+from deepdoc.vision.ocr import OCR
+
+
+class FakeDetector:
+    def __init__(self, boxes):
+        self.boxes = boxes
+
+    def __call__(self, img):
+        boxes = self.boxes.get(int(img[0, 0]))
+        return (None if boxes is None else np.array(boxes, dtype=np.float32)), 0.0
+
+
+class FakeRecognizer:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, img_crop_list):
+        self.calls.append(len(img_crop_list))
+        # Lines on odd rows come out with a low score, to be dropped.
+        return [(crop, 0.3 if int(crop.split(":")[1]) % 20 else 0.9) for crop in img_crop_list], 0.0
+
+
+def make_ocr(boxes):
+    ocr = OCR.__new__(OCR)
+    ocr.text_detector = [FakeDetector(boxes)]
+    ocr.text_recognizer = [FakeRecognizer()]
+    ocr.drop_score = 0.5
+    ocr.get_rotate_crop_image = lambda img, points: f"{int(img[0, 0])}:{int(points[0][1])}"
+    return ocr
+
+
+def box(top):
+    return [[0, top], [50, top], [50, top + 8], [0, top + 8]]
+
+
+class TestOCRBatch:
+    """Test OCR.batch gives the per image results of OCR.__call__"""
+
+    def test_same_as_per_page(self):
+        boxes = {0: [box(40), box(0), box(20)], 1: None, 2: [box(10), box(60)], 3: [box(100)]}
+        pages = [np.full((4, 4), i, dtype=np.uint8) for i in range(4)]
+        ocr = make_ocr(boxes)
+
+        batched = ocr.batch(pages)
+        assert ocr.text_recognizer[0].calls == [6]
+
+        single = [ocr(img) for img in pages]
+        single = [res if isinstance(res, list) else [] for res in single]
+        assert batched == single
+        assert [[t for _, (t, _) in page] for page in batched] == [["0:0", "0:20", "0:40"], [], ["2:60"], ["3:100"]]
+
+    def test_none_and_empty(self):
+        ocr = make_ocr({})
+        assert ocr.batch([None, np.zeros((4, 4), dtype=np.uint8)]) == [[], []]
+        assert ocr.batch([]) == []
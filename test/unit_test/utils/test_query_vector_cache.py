@@ -0,0 +1,122 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Unit tests for the query vector cache.
+"""
+
+import asyncio
+
+import numpy as np
+from rag.utils.query_vector_cache import QueryVectorCache
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+
+    def get(self, k):
+        return self.data.get(k)
+
+    def set(self, k, v, exp=3600):
+        self.data[k] = v
+        return True
+
+
+class FakeEmbedding:
+    def __init__(self, llm_name="bge", tenant_id="t1", llm_factory="OpenAI-API-Compatible", api_base=""):
+        self.llm_name = llm_name
+        self.tenant_id = tenant_id
+        self.llm_factory = llm_factory
+        self.api_base = api_base
+        self.queries = []
+
+    def encode_queries(self, txt):
+        self.queries.append(txt)
+        return np.array([float(len(txt)), 1.0]), 3
+
+
+class TestQueryVectorCache:
+    """Test the in-process LRU, the Redis tier and the counters"""
+
+    def test_memory_hit(self):
+        cache = QueryVectorCache(max_size=8, use_redis=False)
+        mdl = FakeEmbedding()
+        v1 = cache.encode(mdl, "what is  RAG?")
+        v2 = cache.encode(mdl, " what is RAG? ")
+        assert mdl.queries == ["what is RAG?"]
+        np.testing.assert_allclose(v1, v2)
+        assert cache.memory_hits == 1
+        assert cache.misses == 1
+        assert cache.stats()["hit_rate"] == 0.5
+
+    def test_key_depends_on_model_and_tenant(self):
+        cache = QueryVectorCache(max_size=8, use_redis=False)
+        cache.encode(FakeEmbedding("bge", "t1"), "q")
+        cache.encode(FakeEmbedding("bge", "t2"), "q")
+        cache.encode(FakeEmbedding("e5", "t1"), "q")
+        assert cache.misses == 3
+
+    def test_key_depends_on_endpoint(self):
+        cache = QueryVectorCache(max_size=8, use_redis=False)
+        cache.encode(FakeEmbedding("bge", "t1", "OpenAI-API-Compatible", "http://a:8080/v1"), "q")
+        cache.encode(FakeEmbedding("bge", "t1", "OpenAI-API-Compatible", "http://b:8080/v1"), "q")
+        cache.encode(FakeEmbedding("bge", "t1", "LocalAI", "http://a:8080/v1"), "q")
+        cache.encode(FakeEmbedding("bge", "t1", "LocalAI", "http://a:8080/v1"), "q")
+        assert cache.misses == 3
+        assert cache.memory_hits == 1
+
+    def test_lru_eviction(self):
+        cache = QueryVectorCache(max_size=2, use_redis=False)
+        mdl = FakeEmbedding()
+        cache.encode(mdl, "a")
+        cache.encode(mdl, "b")
+        cache.encode(mdl, "a")
+        cache.encode(mdl, "c")
+        cache.encode(mdl, "a")
+        cache.encode(mdl, "b")
+        assert mdl.queries == ["a", "b", "c", "b"]
+
+    def test_redis_tier(self):
+        conn = FakeRedis()
+        mdl = FakeEmbedding()
+        QueryVectorCache(max_size=8, conn=conn, use_redis=True).encode(mdl, "hello")
+        other_worker = QueryVectorCache(max_size=8, conn=conn, use_redis=True)
+        v = other_worker.encode(mdl, "hello")
+        assert mdl.queries == ["hello"]
+        assert other_worker.redis_hits == 1
+        np.testing.assert_allclose(v, [5.0, 1.0])
+
+    def test_uncacheable_model(self):
+        class Raw:
+            def encode_queries(self, txt):
+                return np.array([1.0]), 1
+
+        cache = QueryVectorCache(max_size=8, use_redis=False)
+        cache.encode(Raw(), "q")
+        assert cache.stats()["size"] == 0
+
+    def test_async_encode(self):
+        cache = QueryVectorCache(max_size=8, use_redis=False)
+        mdl = FakeEmbedding()
+
+        async def run():
+            await cache.async_encode(mdl, "q")
+            return await cache.async_encode(mdl, "q")
+
+        v = asyncio.run(run())
+        np.testing.assert_allclose(v, [1.0, 1.0])
+        assert mdl.queries == ["q"]
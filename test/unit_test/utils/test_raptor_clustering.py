@@ -0,0 +1,80 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Unit tests for the choice of the number of RAPTOR clusters.
+"""
+
+import numpy as np
+import pytest
+
+from rag.utils.raptor_clustering import GaussianMixtureSearch
+
+
+def blobs(n_centers, points_per_center, dim=4, seed=0):
+    rnd = np.random.RandomState(seed)
+    centers = rnd.uniform(-20, 20, size=(n_centers, dim))
+    return np.vstack([c + rnd.normal(size=(points_per_center, dim)) for c in centers])
+
+
+class TestGaussianMixtureSearch:
+    """Test the search matches fitting every number of clusters"""
+
+    def test_matches_linear_search(self):
+        embeddings = blobs(6, 60)
+        n_linear, gm_linear = GaussianMixtureSearch(40, search="linear").search(embeddings, 0)
+        search = GaussianMixtureSearch(40, search="golden", grid=6)
+        n, gm = search.search(embeddings, 0)
+        assert n == n_linear == 6
+        assert gm.n_components == n
+        assert gm.bic(embeddings) == pytest.approx(gm_linear.bic(embeddings))
+        assert len(search.fits) < 39
+
+    def test_reduced_embeddings(self):
+        # RAPTOR reduces embeddings to at most 12 dimensions before clustering.
+        embeddings = blobs(10, 40, dim=12, seed=2)
+        n_linear, gm_linear = GaussianMixtureSearch(64, search="linear").search(embeddings, 0)
+        search = GaussianMixtureSearch(64, search="golden")
+        n, gm = search.search(embeddings, 0)
+        assert gm.bic(embeddings) <= gm_linear.bic(embeddings) + abs(gm_linear.bic(embeddings)) * 0.01
+        assert len(search.fits) < 63
+
+    def test_processes_give_same_choice(self):
+        embeddings = blobs(6, 60)
+        n, gm = GaussianMixtureSearch(40, grid=6).search(embeddings, 0)
+        n_pool, gm_pool = GaussianMixtureSearch(40, grid=6, processes=2).search(embeddings, 0)
+        assert n_pool == n
+        assert gm_pool.bic(embeddings) == pytest.approx(gm.bic(embeddings))
+
+    def test_small_layers_fit_every_number(self):
+        search = GaussianMixtureSearch(6, grid=8)
+        n, _ = search.search(blobs(2, 30), 0)
+        assert sorted(search.fits) == [1, 2, 3, 4, 5]
+        assert n == 2
+
+    def test_previous_layer_is_a_hint(self):
+        search = GaussianMixtureSearch(64, grid=4)
+        search.search(blobs(5, 50), 0)
+        assert search._ratio == pytest.approx(5 / 250)
+        search.search(blobs(8, 50, seed=1), 0)
+        assert 8 in search.fits
+
+    def test_should_stop(self):
+        def stop():
+            raise RuntimeError("canceled")
+
+        with pytest.raises(RuntimeError):
+            GaussianMixtureSearch(64).search(blobs(3, 5), 0, should_stop=stop)
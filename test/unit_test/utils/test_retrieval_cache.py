@@ -0,0 +1,169 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Unit tests for the retrieval result cache and its knowledge base generations.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from rag.utils import retrieval_cache
+from rag.utils.retrieval_cache import RetrievalCache, bump_kb_generations, invalidates_retrieval_cache, \
+    kb_generation_key, kb_written_key, KB_GENERATION_PREFIX
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+
+    def get(self, k):
+        return self.data.get(k)
+
+    def set(self, k, v, exp=3600):
+        self.data[k] = v
+        return True
+
+    def mget(self, keys):
+        return [self.data.get(k) for k in keys]
+
+    def mset(self, mapping, exp=3600):
+        self.data.update(mapping)
+        return True
+
+    def mincr(self, keys, exp=3600):
+        for k in keys:
+            self.data[k] = int(self.data.get(k, 0)) + 1
+        return True
+
+
+class DownRedis(FakeRedis):
+    """Like RedisDB when Redis is unreachable: reads give None, writes give False."""
+
+    def mget(self, keys):
+        return None
+
+    def mset(self, mapping, exp=3600):
+        return False
+
+    def mincr(self, keys, exp=3600):
+        return False
+
+
+PARAMS = {"page": 1, "page_size": 6, "rerank_mdl": None}
+
+
+class TestRetrievalCache:
+    """Test keys, get/put and invalidation through generations"""
+
+    def test_key_depends_on_everything(self):
+        cache = RetrievalCache(conn=FakeRedis(), enabled=True)
+        key = cache.key(["t1"], ["kb1", "kb2"], "What is RAG?", PARAMS)
+        assert key == cache.key(["t1"], ["kb2", "kb1"], "  What is   RAG? ", PARAMS)
+        assert key != cache.key(["t2"], ["kb1", "kb2"], "What is RAG?", PARAMS)
+        assert key != cache.key(["t1"], ["kb1"], "What is RAG?", PARAMS)
+        assert key != cache.key(["t1"], ["kb1", "kb2"], "What is RAG", PARAMS)
+        assert key != cache.key(["t1"], ["kb1", "kb2"], "What is RAG?", {**PARAMS, "page": 2})
+        assert key != cache.key(["t1"], ["kb1", "kb2"], "What is RAG?", {**PARAMS, "rerank_mdl": "bge-reranker"})
+
+    def test_get_put_and_invalidate(self):
+        conn = FakeRedis()
+        cache = RetrievalCache(conn=conn, enabled=True)
+        ranks = {"total": 1, "chunks": [{"chunk_id": "c1", "vector": np.array([0.5, 1.0], dtype=np.float32),
+                                         "similarity": np.float64(0.9)}], "doc_aggs": []}
+        key = cache.key(["t1"], ["kb1"], "q", PARAMS)
+        assert cache.get(key) is None
+        cache.put(key, ranks)
+        res = cache.get(cache.key(["t1"], ["kb1"], "q", PARAMS))
+        assert res["chunks"][0]["vector"] == [0.5, 1.0]
+        assert res["chunks"][0]["similarity"] == 0.9
+
+        bump_kb_generations(["kb1"], conn=conn)
+        assert conn.data[kb_generation_key("kb1")] == 1
+        # Expire the written mark, as Redis does once the refresh window is over.
+        conn.data.pop(kb_written_key("kb1"))
+        assert cache.get(cache.key(["t1"], ["kb1"], "q", PARAMS)) is None
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 2
+
+    def test_bypass_within_refresh_window(self):
+        conn = FakeRedis()
+        cache = RetrievalCache(conn=conn, enabled=True)
+        bump_kb_generations(["kb1"], conn=conn)
+        assert cache.key(["t1"], ["kb1", "kb2"], "q", PARAMS) is None
+        assert cache.key(["t1"], ["kb2"], "q", PARAMS) is not None
+        assert cache.stats()["skips"] == 1
+        assert cache.stats()["errors"] == 0
+
+        conn.data.pop(kb_written_key("kb1"))
+        assert cache.key(["t1"], ["kb1", "kb2"], "q", PARAMS) is not None
+
+    def test_concurrent_stats(self):
+        conn = FakeRedis()
+        cache = RetrievalCache(conn=conn, enabled=True)
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(lambda i: cache.get(f"k{i % 2}"), range(4000)))
+        assert cache.stats()["misses"] == 4000
+
+    def test_no_key_without_generations(self):
+        conn = DownRedis()
+        cache = RetrievalCache(conn=conn, enabled=True)
+        assert cache.key(["t1"], ["kb1"], "q", PARAMS) is None
+        assert cache.stats()["errors"] == 1
+
+    def test_failed_bump_is_reported(self, caplog):
+        assert bump_kb_generations([], conn=DownRedis())
+        assert not bump_kb_generations(["kb1"], conn=DownRedis())
+        assert "kb1" in caplog.text
+
+    def test_disabled(self):
+        cache = RetrievalCache(conn=FakeRedis(), enabled=False)
+        assert not cache.enabled
+        assert cache.stats()["hit_rate"] == 0.0
+
+
+class TestInvalidatesRetrievalCache:
+    """Test the doc store write decorator finds the written knowledge bases"""
+
+    def test_written_kb_ids(self, monkeypatch):
+        conn = FakeRedis()
+        monkeypatch.setattr(retrieval_cache, "bump_kb_generations",
+                            lambda kb_ids: bump_kb_generations(kb_ids, conn=conn))
+
+        class Store:
+            @invalidates_retrieval_cache
+            def insert(self, documents, index_name, knowledgebase_id=None):
+                return []
+
+            @invalidates_retrieval_cache
+            def delete(self, condition, index_name, knowledgebase_id):
+                raise RuntimeError("down")
+
+            @invalidates_retrieval_cache
+            def delete_idx(self, index_name, dataset_id):
+                return None
+
+        store = Store()
+        store.insert([{"kb_id": "kb1"}], "ragflow_t1", "kb1")
+        store.insert([{"kb_id": "kb2"}, {"kb_id": ["kb3"]}], "ragflow_t1")
+        try:
+            store.delete({"doc_id": "d1"}, "ragflow_t1", knowledgebase_id="kb1")
+        except RuntimeError:
+            pass
+        store.delete_idx("ragflow_t1", "kb3")
+        generations = {k: v for k, v in conn.data.items() if k.startswith(KB_GENERATION_PREFIX)}
+        assert generations == {kb_generation_key("kb1"): 2, kb_generation_key("kb2"): 1, kb_generation_key("kb3"): 2}
+        assert all(conn.data[kb_written_key(kb)] for kb in ["kb1", "kb2", "kb3"])
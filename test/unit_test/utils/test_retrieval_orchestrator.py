@@ -0,0 +1,75 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Unit tests for the concurrent retrieval orchestrator.
+"""
+
+import asyncio
+import time
+
+import pytest
+from rag.utils.retrieval_orchestrator import RetrievalOrchestrator
+
+
+async def source(value, delay=0.0):
+    await asyncio.sleep(delay)
+    return value
+
+
+async def failing():
+    raise ValueError("boom")
+
+
+class TestRetrievalOrchestrator:
+    """Test concurrency, ordering, timeouts and failures"""
+
+    def test_concurrent_and_ordered(self):
+        orch = RetrievalOrchestrator()
+        orch.add("slow", source, "a", delay=0.2)
+        orch.add("fast", source, "b", delay=0.0)
+        orch.add("medium", source, "c", delay=0.1)
+        st = time.time()
+        res = asyncio.run(orch.run())
+        assert time.time() - st < 0.35
+        assert list(res.items()) == [("slow", "a"), ("fast", "b"), ("medium", "c")]
+        assert set(orch.status.values()) == {"ok"}
+        assert orch.timings["slow"] >= orch.timings["fast"]
+
+    def test_optional_timeout_and_error(self):
+        orch = RetrievalOrchestrator()
+        orch.add("kb", source, "chunks", required=True)
+        orch.add("web", source, "pages", delay=1.0, timeout=0.05)
+        orch.add("kg", failing, timeout=1.0)
+        res = asyncio.run(orch.run())
+        assert res == {"kb": "chunks", "web": None, "kg": None}
+        assert orch.status == {"kb": "ok", "web": "timeout", "kg": "error"}
+        elapsed = orch.elapsed({"kb": "2 stages"})
+        assert elapsed.splitlines()[0].startswith("    - kb: ")
+        assert elapsed.splitlines()[0].endswith("(2 stages)")
+        assert "(timeout)" in elapsed.splitlines()[1]
+
+    def test_required_error_raises(self):
+        orch = RetrievalOrchestrator()
+        orch.add("kb", failing, required=True)
+        orch.add("web", source, "pages", delay=0.05)
+        with pytest.raises(ValueError):
+            asyncio.run(orch.run())
+
+    def test_empty(self):
+        orch = RetrievalOrchestrator()
+        assert asyncio.run(orch.run()) == {}
+        assert orch.elapsed() == ""
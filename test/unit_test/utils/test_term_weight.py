@@ -0,0 +1,159 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Unit tests for the memoized token weights of term_weight.Dealer, against the
+former implementation which weighted every token on each call.
+"""
+
+import math
+import re
+
+import numpy as np
+import pytest
+from rag.nlp import rag_tokenizer, term_weight
+
+DF = {"数据库": 1200, "检索": 800, "知识": 5000, "图谱": 300, "生成": 9000, "模型": 20000, "hello": 40}
+
+# Long tokens outside DF go through the fine_grained_tokenize fallbacks of freq and df.
+TOKENS = ["数据库", "检索", "检索增强生成", "知识图谱构建", "大语言模型", "2024", "3.14", "1-2-3", "rag", "ab",
+          "gpt-4", "retrieval", "hello", "的", "北京大学", "数据库", "检索"]
+TEXTS = ["如何用知识图谱增强检索？", "RAGFlow retrieval with GPT-4 in 2024", "数据库 检索 数据库"]
+
+
+def legacy_weights(dealer, tks, preprocess=True):
+    num_pattern = re.compile(r"[0-9,.]{2,}$")
+    short_letter_pattern = re.compile(r"[a-z]{1,2}$")
+    num_space_pattern = re.compile(r"[0-9. -]{2,}$")
+    letter_pattern = re.compile(r"[a-z. -]+$")
+
+    def ner(t):
+        if num_pattern.match(t):
+            return 2
+        if short_letter_pattern.match(t):
+            return 0.01
+        if not dealer.ne or t not in dealer.ne:
+            return 1
+        m = {"toxic": 2, "func": 1, "corp": 3, "loca": 3, "sch": 3, "stock": 3,
+             "firstnm": 1}
+        return m[dealer.ne[t]]
+
+    def postag(t):
+        t = rag_tokenizer.tag(t)
+        if t in set(["r", "c", "d"]):
+            return 0.3
+        if t in set(["ns", "nt"]):
+            return 3
+        if t in set(["n"]):
+            return 2
+        if re.match(r"[0-9-]+", t):
+            return 2
+        return 1
+
+    def freq(t):
+        if num_space_pattern.match(t):
+            return 3
+        s = rag_tokenizer.freq(t)
+        if not s and letter_pattern.match(t):
+            return 300
+        if not s:
+            s = 0
+
+        if not s and len(t) >= 4:
+            s = [tt for tt in rag_tokenizer.fine_grained_tokenize(t).split() if len(tt) > 1]
+            if len(s) > 1:
+                s = np.min([freq(tt) for tt in s]) / 6.
+            else:
+                s = 0
+
+        return max(s, 10)
+
+    def df(t):
+        if num_space_pattern.match(t):
+            return 5
+        if t in dealer.df:
+            return dealer.df[t] + 3
+        elif letter_pattern.match(t):
+            return 300
+        elif len(t) >= 4:
+            s = [tt for tt in rag_tokenizer.fine_grained_tokenize(t).split() if len(tt) > 1]
+            if len(s) > 1:
+                return max(3, np.min([df(tt) for tt in s]) / 6.)
+
+        return 3
+
+    def idf(s, N):
+        return math.log10(10 + ((N - s + 0.5) / (s + 0.5)))
+
+    if preprocess:
+        tks = [t for tk in tks for t in dealer.token_merge(dealer.pretoken(tk, True))]
+    wts = (0.3 * np.array([idf(freq(t), 10000000) for t in tks]) + 0.7 * np.array([idf(df(t), 1000000000) for t in tks])) * \
+        np.array([ner(t) * postag(t) for t in tks])
+    S = np.sum(wts)
+    return [(t, s / S) for t, s in zip(tks, wts)]
+
+
+def make_dealer(monkeypatch, cache_size=term_weight.TERM_WEIGHT_CACHE_SIZE, precompute=False):
+    monkeypatch.setattr(term_weight, "TERM_WEIGHT_CACHE_SIZE", cache_size)
+    monkeypatch.setattr(term_weight, "TERM_WEIGHT_PRECOMPUTE", False)
+    dealer = term_weight.Dealer()
+    dealer.df = dict(DF)
+    if precompute:
+        dealer.precompute_vocabulary()
+    return dealer
+
+
+def assert_same_weights(res, expected):
+    assert [t for t, _ in res] == [t for t, _ in expected]
+    np.testing.assert_allclose([w for _, w in res], [w for _, w in expected], rtol=1e-12)
+
+
+class TestTermWeight:
+    """Test the cached and precomputed weights equal the former ones"""
+
+    @pytest.mark.parametrize("cache_size,precompute", [(0, False), (100000, False), (100000, True), (2, True)])
+    def test_same_as_legacy(self, monkeypatch, cache_size, precompute):
+        dealer = make_dealer(monkeypatch, cache_size, precompute)
+        for _ in range(2):
+            assert_same_weights(dealer.weights(TOKENS, preprocess=False), legacy_weights(dealer, TOKENS, preprocess=False))
+            assert_same_weights(dealer.weights(TEXTS), legacy_weights(dealer, TEXTS))
+
+    def test_cache_stats(self, monkeypatch):
+        dealer = make_dealer(monkeypatch, cache_size=100000)
+        distinct = len(set(TOKENS))
+        dealer.weights(TOKENS, preprocess=False)
+        stats = dealer.cache_stats()
+        assert stats["misses"] == distinct
+        assert stats["hits"] == len(TOKENS) - distinct
+        assert stats["size"] == distinct
+        assert stats["max_size"] == 100000
+        assert stats["vocabulary_size"] == 0
+        assert stats["vocabulary_hits"] == 0
+
+    def test_cache_stats_with_vocabulary(self, monkeypatch):
+        dealer = make_dealer(monkeypatch, cache_size=100000, precompute=True)
+        dealer.weights(TOKENS, preprocess=False)
+        stats = dealer.cache_stats()
+        in_vocab = [t for t in TOKENS if t in DF]
+        assert stats["vocabulary_size"] == len(DF)
+        assert stats["vocabulary_hits"] == len(in_vocab)
+        assert stats["misses"] == len(set(TOKENS) - set(DF))
+        assert stats["hits"] + stats["misses"] == len(TOKENS) - len(in_vocab)
+
+    def test_lru_is_bounded(self, monkeypatch):
+        dealer = make_dealer(monkeypatch, cache_size=2)
+        dealer.weights(TOKENS, preprocess=False)
+        assert dealer.cache_stats()["size"] == 2